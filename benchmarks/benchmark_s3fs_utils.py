@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append("./modules/")
+import os
+from time import perf_counter
+from typing import Dict, List
+
+from data_processing.s3fs_utils import S3ParallelFileSystem
+
+# Throughput benchmark for S3ParallelFileSystem against a local S3 stand-in.
+# Requires moto's server extra (pip install "moto[server]"), run from the repo root:
+#   python benchmarks/benchmark_s3fs_utils.py
+
+BUCKET = "benchmark"
+OBJECT_SIZES_MB = [1, 5, 20, 100, 500]
+REPEATS = 3
+
+
+def run_benchmark(endpoint_url: str, sizes_mb: List[int] = OBJECT_SIZES_MB) -> Dict[int, float]:
+    """Upload one object per size, then time full reads of each. Returns MB/s per size."""
+    fs = S3ParallelFileSystem(
+        key="testing",
+        secret="testing",
+        client_kwargs={"endpoint_url": endpoint_url, "region_name": "us-east-1"},
+        default_cache_type="none",
+        skip_instance_cache=True,
+    )
+    fs.mkdir(BUCKET)
+    throughput: Dict[int, float] = {}
+    for size_mb in sizes_mb:
+        path = f"{BUCKET}/object_{size_mb}mb"
+        payload = os.urandom(size_mb * 1024 * 1024)
+        fs.pipe(path, payload)
+        # the first read also fetches the object size, the rest should skip the HEAD
+        start = perf_counter()
+        for _ in range(REPEATS):
+            data = fs.cat_file(path)
+        elapsed = perf_counter() - start
+        assert data == payload, f"Mismatched contents for {path}"
+        throughput[size_mb] = size_mb * REPEATS / elapsed
+        print(f"{size_mb:>5} MB: {throughput[size_mb]:8.1f} MB/s")
+    return throughput
+
+
+if __name__ == "__main__":
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        run_benchmark(f"http://{host}:{port}")
+    finally:
+        server.stop()
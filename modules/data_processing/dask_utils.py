@@ -1,11 +1,221 @@
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
 
-from dask.distributed import Client
+from dask.distributed import Client, LocalCluster
 
 logger = logging.getLogger(__name__)
 
+# seconds a pause waits for the workers to retire
+RETIRE_TIMEOUT = 30
+
+
+class ClusterManager:
+    """
+    Keeps a single LocalCluster alive for the lifetime of the process.
+
+    Starting a cluster takes seconds, so instead of shutting it down before
+    the multiprocessing phases of the pipeline, the cluster is paused: its
+    workers are retired, freeing their memory and cores, while the scheduler
+    and client stay up. Resuming scales the workers back up.
+
+    Pauses are counted, so nested or concurrent paused() blocks only resume
+    the workers when the last of them ends.
+    """
+
+    def __init__(self):
+        self.n_workers: Optional[int] = None
+        self.threads_per_worker: Optional[int] = None
+        self.memory_limit: str | float | int | None = "auto"
+        self.cluster: Optional[LocalCluster] = None
+        self.client: Optional[Client] = None
+        self._paused_workers: Optional[int] = None
+        self._pause_count = 0
+        self._active_jobs = 0
+        self._lock = threading.RLock()
+        # set while a pause or resume waits for the workers to retire or start, without the lock
+        self._transitioning = False
+        self._transition = threading.Condition(self._lock)
+
+    def configure(
+        self,
+        n_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None,
+        memory_limit: str | float | int | None = "auto",
+    ) -> None:
+        """
+        Set the size of the cluster. None leaves the choice to dask. If the
+        cluster is running it is restarted with the new settings.
+
+        Raises:
+            RuntimeError: If a job is using or pausing the cluster, restarting
+                it would fail that job.
+        """
+        with self._lock:
+            if self.is_busy:
+                raise RuntimeError("The dask cluster is in use, try again when the job finishes")
+            self.n_workers = n_workers
+            self.threads_per_worker = threads_per_worker
+            self.memory_limit = memory_limit
+            if self.cluster is not None:
+                self.shutdown()
+                self.get_client()
+
+    def get_client(self) -> Client:
+        """Return the running client, starting the cluster if needed."""
+        with self._lock:
+            if self.client is None:
+                try:
+                    # a client created elsewhere, e.g. connected to a remote scheduler
+                    return Client.current()
+                except ValueError:
+                    pass
+                self.cluster = LocalCluster(
+                    n_workers=self.n_workers,
+                    threads_per_worker=self.threads_per_worker,
+                    memory_limit=self.memory_limit,
+                )
+                self.client = Client(self.cluster)
+                logger.info(f"Started dask cluster, dashboard at {self.client.dashboard_link}")
+            return self.client
+
+    @property
+    def is_paused(self) -> bool:
+        with self._lock:
+            return self._pause_count > 0
+
+    @property
+    def is_busy(self) -> bool:
+        """True while a job is using the cluster, has paused it, or it's still resuming."""
+        with self._lock:
+            return self._active_jobs > 0 or self._pause_count > 0 or self._transitioning
+
+    @property
+    def scheduler(self) -> Optional[str]:
+        """
+        Scheduler to pass to .compute(). The client registers itself as the
+        default scheduler and while paused it has no workers to run anything,
+        so computations use the local threaded scheduler instead. None keeps
+        the default.
+        """
+        return "threads" if self.is_paused else None
+
+    def pause(self) -> None:
+        """
+        Retire all workers but keep the scheduler and client running.
+        Every call must be matched by a call to resume.
+        """
+        with self._lock:
+            self._pause_count += 1
+            if self._pause_count > 1 or self.cluster is None:
+                return
+            # a resume still scaling up would have its new workers retired before they arrive
+            self._transition.wait_for(lambda: not self._transitioning)
+            if self.cluster is None:
+                return
+            client = self.client
+            # cluster.workers is only updated after a scale has settled, the scheduler knows sooner
+            if client is not None:
+                workers = client.scheduler_info()["workers"]
+            else:
+                workers = self.cluster.workers
+            n_workers = self._paused_workers = len(workers)
+            self.cluster.scale(0)
+            self._transitioning = True
+        # the wait happens outside the lock, so it doesn't block the scheduler property
+        try:
+            if client is not None:
+                # a resume before the workers have retired would count them as the new ones
+                deadline = time.monotonic() + RETIRE_TIMEOUT
+                while client.scheduler_info()["workers"] and time.monotonic() < deadline:
+                    time.sleep(0.1)
+        finally:
+            self._end_transition()
+        logger.debug(f"Paused dask cluster, retired {n_workers} workers")
+
+    def resume(self) -> None:
+        """
+        End one pause, once no pauses are left scale the workers back to the
+        number running before the first one.
+        """
+        with self._lock:
+            if self._pause_count == 0:
+                return
+            # the pause may still be retiring workers if it was ended right away
+            self._transition.wait_for(lambda: not self._transitioning)
+            self._pause_count -= 1
+            if self._pause_count > 0 or self._paused_workers is None:
+                return
+            n_workers = self._paused_workers
+            self._paused_workers = None
+            client = self.client
+            if self.cluster is None or client is None:
+                return
+            self.cluster.scale(n_workers)
+            self._transitioning = True
+        try:
+            client.wait_for_workers(n_workers)
+        finally:
+            self._end_transition()
+        logger.debug(f"Resumed dask cluster with {n_workers} workers")
+
+    def _end_transition(self) -> None:
+        with self._lock:
+            self._transitioning = False
+            self._transition.notify_all()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._paused_workers = None
+            if self.client is not None:
+                self.client.shutdown()
+            self.client = None
+            self.cluster = None
+
+    def links(self) -> Dict[str, Optional[str]]:
+        """Links to the dashboard and the prometheus metrics of the running cluster."""
+        try:
+            dashboard = self.client.dashboard_link if self.client else None
+        except Exception:
+            dashboard = None
+        metrics = dashboard.rsplit("/", 1)[0] + "/metrics" if dashboard else None
+        return {
+            "dashboard": dashboard,
+            "metrics": metrics,
+            "paused": self.is_paused,
+            "workers": len(self.cluster.workers) if self.cluster else 0,
+        }
+
+    @contextmanager
+    def in_use(self) -> Iterator[None]:
+        """Mark the cluster as in use for the duration of the block, so it isn't reconfigured."""
+        with self._lock:
+            self._active_jobs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_jobs -= 1
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """Pause the cluster for the duration of the block, then resume it."""
+        self.pause()
+        try:
+            yield
+        finally:
+            self.resume()
+
+
+cluster_manager = ClusterManager()
+
 
 def shutdown_cluster():
+    if cluster_manager.client is not None:
+        cluster_manager.shutdown()
+        return
     try:
         client = Client.current()
         client.shutdown()
@@ -15,11 +225,11 @@ def shutdown_cluster():
 
 def no_cluster(func):
     """
-    Decorator that ensures the wrapped function runs with no active Dask cluster.
+    Decorator that ensures the wrapped function runs with no active Dask workers.
 
-    This decorator attempts to shut down any existing Dask cluster before
-    executing the wrapped function. If no cluster is found, it logs a debug message
-    and continues execution.
+    The cluster kept by the cluster manager is paused while the wrapped
+    function runs, so its workers don't compete for memory and cores with
+    multiprocessing, and resumed afterwards.
 
     Parameters:
         func: The function to be executed without a Dask cluster
@@ -29,8 +239,8 @@ def no_cluster(func):
     """
 
     def wrapper(*args, **kwargs):
-        shutdown_cluster()
-        result = func(*args, **kwargs)
+        with cluster_manager.paused():
+            result = func(*args, **kwargs)
         return result
 
     return wrapper
@@ -40,8 +250,9 @@ def use_cluster(func):
     """
     Decorator that ensures the wrapped function has access to a Dask cluster.
 
-    If a Dask cluster is already running, it uses the existing one.
-    If no cluster is available, it creates a new one before executing the function.
+    If a Dask cluster is already running, it uses the existing one. While the cluster is
+    paused, computations should pass cluster_manager.scheduler to run on local threads.
+    If no cluster is available, the cluster manager starts one before executing the function.
     The cluster remains active after the function completes.
 
     Parameters:
@@ -52,11 +263,9 @@ def use_cluster(func):
     """
 
     def wrapper(*args, **kwargs):
-        try:
-            client = Client.current()
-        except ValueError:
-            client = Client()
-        result = func(*args, **kwargs)
+        with cluster_manager.in_use():
+            cluster_manager.get_client()
+            result = func(*args, **kwargs)
         return result
 
     return wrapper
@@ -1,15 +1,17 @@
 import logging
 import os
+import shutil
 from datetime import datetime
 from pathlib import Path
-from typing import List, Literal, Optional, Tuple, Union
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
 import geopandas as gpd
 import numpy as np
 import xarray as xr
 from xarray.core.types import InterpOptions
 from dask.distributed import Client, progress, Future
-from data_processing.dask_utils import use_cluster
+from data_processing.dask_utils import cluster_manager, use_cluster
+from data_processing.store_cache import log_chunk_cache_stats
 
 logger = logging.getLogger(__name__)
 
@@ -80,11 +82,109 @@ def validate_time_range(dataset: xr.Dataset, start_time: str, end_time: str) ->
     return start_time, end_time
 
 
+def get_chunk_boundaries(dataset: xr.Dataset) -> Dict[str, np.ndarray]:
+    """
+    Return the positions along each dimension where a chunk of every variable
+    starts, plus the dimension length, taken from the dask chunks.
+
+    A dataset opened from zarr with chunks={} is chunked like its store, and a
+    concatenation of several stores (e.g. one AORC store per year) keeps each
+    store's own chunk grid, so these are the native chunk boundaries even when
+    the grid restarts part way along a dimension.
+    """
+    boundaries: Dict[str, np.ndarray] = {}
+    for var in dataset.data_vars.values():
+        if not var.chunks:
+            continue
+        for dim, sizes in var.chunksizes.items():
+            edges = np.concatenate([[0], np.cumsum(sizes)])
+            if dim in boundaries:
+                edges = np.intersect1d(boundaries[dim], edges)
+            boundaries[dim] = edges
+    return boundaries
+
+
+def expand_to_chunk_boundaries(index_slice: slice, boundaries: np.ndarray) -> slice:
+    """Widen a positional slice so it starts and ends on the given chunk boundaries."""
+    start = boundaries[np.searchsorted(boundaries, index_slice.start, side="right") - 1]
+    stop = boundaries[np.searchsorted(boundaries, index_slice.stop, side="left")]
+    return slice(int(start), int(stop))
+
+
+def log_read_plan(
+    dataset: xr.Dataset,
+    window: Dict[str, slice],
+    needed: Dict[str, slice],
+) -> None:
+    """
+    Log how many native chunks a positional window touches, and how many bytes
+    (uncompressed) are fetched compared to the bytes actually needed.
+    """
+    chunks_touched = 0
+    bytes_fetched = 0
+    bytes_needed = 0
+    for var in dataset.data_vars.values():
+        var_chunks = 1
+        fetched_elements = 1
+        needed_elements = 1
+        chunk_sizes = var.chunksizes if var.chunks else {}
+        for dim in var.dims:
+            length = var.sizes[dim]
+            dim_window = window.get(dim, slice(0, length))
+            dim_needed = needed.get(dim, slice(0, length))
+            edges = np.concatenate([[0], np.cumsum(chunk_sizes.get(dim, (length,)))])
+            first_chunk = np.searchsorted(edges, dim_window.start, side="right") - 1
+            last_chunk = np.searchsorted(edges, dim_window.stop, side="left")
+            var_chunks *= max(int(last_chunk - first_chunk), 0)
+            fetched_elements *= int(edges[last_chunk] - edges[first_chunk])
+            needed_elements *= max(dim_needed.stop - dim_needed.start, 0)
+        chunks_touched += var_chunks
+        bytes_fetched += fetched_elements * var.dtype.itemsize
+        bytes_needed += needed_elements * var.dtype.itemsize
+    efficiency = 100 * bytes_needed / bytes_fetched if bytes_fetched else 100
+    logger.info(
+        f"Read plan: {chunks_touched} chunks, "
+        f"{bytes_fetched / 10**6:.1f} Mb fetched (uncompressed) "
+        f"for {bytes_needed / 10**6:.1f} Mb needed ({efficiency:.0f}% of fetched bytes used)"
+    )
+
+
+def align_clip_window_to_chunks(
+    dataset: xr.Dataset,
+    bounds: Tuple[float, float, float, float] | np.ndarray[tuple[int], np.dtype[np.float64]],
+    start_time: str,
+    end_time: str,
+) -> xr.Dataset:
+    """
+    Select the smallest window of dataset that contains the requested bounds
+    and time range and starts and ends on native chunk boundaries, so every
+    chunk read from the remote store is a whole chunk.
+    """
+    boundaries = get_chunk_boundaries(dataset)
+    requested = {
+        "x": (bounds[0], bounds[2]),
+        "y": (bounds[1], bounds[3]),
+        "time": (start_time, end_time),
+    }
+    needed: Dict[str, slice] = {}
+    window: Dict[str, slice] = {}
+    for dim, (low, high) in requested.items():
+        index_slice = dataset.indexes[dim].slice_indexer(low, high)
+        length = dataset.sizes[dim]
+        start, stop, _ = index_slice.indices(length)
+        needed[dim] = slice(start, stop)
+        dim_boundaries = boundaries.get(dim, np.array([0, length]))
+        window[dim] = expand_to_chunk_boundaries(needed[dim], dim_boundaries)
+    log_read_plan(dataset, window, needed)
+    return dataset.isel(window)
+
+
 def clip_dataset_to_bounds(
     dataset: xr.Dataset,
     bounds: Tuple[float, float, float, float] | np.ndarray[tuple[int], np.dtype[np.float64]],
     start_time: str,
     end_time: str,
+    align_to_chunks: bool = False,
 ) -> xr.Dataset:
     """
     Clip the dataset to specified geographical bounds.
@@ -100,6 +200,10 @@ def clip_dataset_to_bounds(
         Desired start time in YYYY/MM/DD HH:MM:SS format.
     end_time : str
         Desired end time in YYYY/MM/DD HH:MM:SS format.
+    align_to_chunks : bool, optional
+        If True, return the window expanded to the native chunk boundaries
+        of the source store instead of the exact bounds. The caller is
+        expected to trim it once the whole chunks have been written.
 
     Returns
     -------
@@ -108,6 +212,10 @@ def clip_dataset_to_bounds(
     """
     # check time range here in case just this function is imported and not the whole module
     start_time, end_time = validate_time_range(dataset, start_time, end_time)
+    if align_to_chunks:
+        dataset = align_clip_window_to_chunks(dataset, bounds, start_time, end_time)
+        logger.info("Selected chunk aligned window around time range and bounds")
+        return dataset
     dataset = dataset.sel(
         x=slice(bounds[0], bounds[2]),
         y=slice(bounds[1], bounds[3]),
@@ -150,7 +258,7 @@ def interpolate_nan_values(
         if not np.issubdtype(var.dtype, np.number):
             continue
         # if there are no NANs, skip
-        if not var.isnull().any().compute():
+        if not var.isnull().any().compute(scheduler=cluster_manager.scheduler):
             continue
 
         dataset[name] = var.interpolate_na(
@@ -160,6 +268,140 @@ def interpolate_nan_values(
         )
 
 
+def fill_nan_nearest(values: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """
+    Replace NaNs along the last axis with the nearest valid value, extrapolating
+    at the start and end. Ties are resolved towards the earlier value, matching
+    interpolate_na(method="nearest"). Series with no valid values are unchanged.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array with the interpolation dimension as the last axis.
+    positions : np.ndarray
+        Coordinate values along the last axis, used to measure distances.
+
+    Returns
+    -------
+    np.ndarray
+        values with the NaNs filled, or values itself if there are no NaNs.
+    """
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    length = values.shape[-1]
+    index = np.broadcast_to(np.arange(length), values.shape)
+    # index of the last valid value at or before each position, -1 if there is none
+    previous = np.maximum.accumulate(np.where(missing, -1, index), axis=-1)
+    # index of the first valid value at or after each position, length if there is none
+    following = np.flip(
+        np.minimum.accumulate(np.flip(np.where(missing, length, index), axis=-1), axis=-1),
+        axis=-1,
+    )
+    has_previous = previous >= 0
+    has_following = following < length
+    here = positions[index]
+    previous_distance = here - positions[np.clip(previous, 0, length - 1)]
+    following_distance = positions[np.clip(following, 0, length - 1)] - here
+    use_previous = has_previous & (~has_following | (previous_distance <= following_distance))
+    source = np.clip(np.where(use_previous, previous, following), 0, length - 1)
+    filled = np.take_along_axis(values, source, axis=-1)
+    return np.where(missing & (has_previous | has_following), filled, values)
+
+
+def interpolate_nan_values_lazy(
+    dataset: xr.Dataset,
+    dim: str = "time",
+    target_chunk_bytes: int = 64 * 1024 * 1024,
+) -> xr.Dataset:
+    """
+    Lazily fill NaN values with the nearest valid value along dim, for every
+    numeric variable containing dim.
+
+    Unlike interpolate_nan_values, this doesn't compute anything. The NaN check
+    and the fill happen per block inside the dask graph, so they run in the
+    same pass as the write. Each block holds the whole of dim so the result
+    matches interpolating the full series, the other dimensions are split so a
+    block is roughly target_chunk_bytes.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        The input dataset.
+    dim : str, optional
+        The dimension along which to interpolate (default is "time").
+    target_chunk_bytes : int, optional
+        Approximate size of each block.
+
+    Returns
+    -------
+    xr.Dataset
+        A new dataset with the fill added to the graph of each variable.
+    """
+    positions = dataset[dim].values
+    if np.issubdtype(positions.dtype, np.datetime64):
+        positions = positions.astype("datetime64[ns]").astype(np.int64)
+    result = dataset.copy()
+    for name, var in dataset.data_vars.items():
+        # if the variable is non-numeric, or doesn't vary along dim, skip
+        if not np.issubdtype(var.dtype, np.number) or dim not in var.dims:
+            continue
+        other_dims = [d for d in var.dims if d != dim]
+        series_bytes = var.sizes[dim] * var.dtype.itemsize
+        cells_per_block = max(target_chunk_bytes // max(series_bytes, 1), 1)
+        # split the cells of a block evenly between the other dimensions
+        edge = max(int(cells_per_block ** (1 / max(len(other_dims), 1))), 1)
+        chunks = {d: min(edge, var.sizes[d]) for d in other_dims}
+        chunks[dim] = -1
+        result[name] = xr.apply_ufunc(
+            fill_nan_nearest,
+            var.chunk(chunks),
+            input_core_dims=[[dim]],
+            output_core_dims=[[dim]],
+            kwargs={"positions": positions},
+            dask="parallelized",
+            output_dtypes=[var.dtype],
+            keep_attrs=True,
+        ).transpose(*var.dims)
+    return result
+
+
+def is_zarr_cache(cache_path: Path) -> bool:
+    """Return True if the cache at cache_path is a Zarr store rather than a NetCDF file."""
+    return cache_path.suffix == ".zarr"
+
+
+def remove_cache_path(cache_path: Path) -> None:
+    """Delete a cache file or Zarr store directory."""
+    if cache_path.is_dir():
+        shutil.rmtree(cache_path)
+    elif cache_path.exists():
+        os.remove(cache_path)
+
+
+def open_cached_dataset(cache_path: Path) -> xr.Dataset:
+    """Lazily open a cache written by save_dataset, in either format."""
+    if is_zarr_cache(cache_path):
+        return xr.open_zarr(cache_path, consolidated=True)
+    return xr.open_mfdataset(cache_path, parallel=True, engine="h5netcdf")
+
+
+def get_zarr_cache_chunks(
+    dataset: xr.Dataset, target_chunk_bytes: int = 64 * 1024 * 1024
+) -> Dict[str, int]:
+    """
+    Chunking used for the Zarr cache. Zonal stats read every cell of a
+    timestep, so each chunk is the full spatial tile with as many timesteps as
+    fit in target_chunk_bytes.
+    """
+    cells = dataset.sizes.get("x", 1) * dataset.sizes.get("y", 1)
+    time_chunk = max(target_chunk_bytes // (cells * np.dtype(np.float32).itemsize), 1)
+    chunks = {dim: -1 for dim in dataset.dims}
+    if "time" in chunks:
+        chunks["time"] = min(int(time_chunk), dataset.sizes["time"])
+    return chunks
+
+
 @use_cluster
 def save_dataset(
     ds_to_save: xr.Dataset,
@@ -167,25 +409,39 @@ def save_dataset(
     engine: Literal["netcdf4", "scipy", "h5netcdf"] = "h5netcdf",
 ):
     """
-    Helper function to compute and save an xarray.Dataset to a NetCDF file.
+    Helper function to compute and save an xarray.Dataset to a NetCDF file,
+    or to a Zarr store if target_path ends in .zarr.
     Uses a temporary file and rename for atomicity.
     """
     if not target_path.parent.exists():
         target_path.parent.mkdir(parents=True, exist_ok=True)
 
-    temp_file_path = target_path.with_name(target_path.name + ".saving.nc")
-    if temp_file_path.exists():
-        os.remove(temp_file_path)
+    suffix = ".zarr" if is_zarr_cache(target_path) else ".nc"
+    temp_file_path = target_path.with_name(target_path.name + ".saving" + suffix)
+    remove_cache_path(temp_file_path)
 
     client = Client.current()
-    future: Future = client.compute(
-        ds_to_save.to_netcdf(temp_file_path, engine=engine, compute=False)
-    )  # type: ignore
-    logger.debug(
-        f"NetCDF write task submitted to Dask. Waiting for completion to {temp_file_path}..."
-    )
-    progress(future)
-    future.result()
+    if is_zarr_cache(target_path):
+        ds_to_save = ds_to_save.chunk(get_zarr_cache_chunks(ds_to_save))
+        for var in ds_to_save.variables.values():
+            # chunk encodings from the source store would conflict with the new chunks
+            for key in ("chunks", "preferred_chunks", "compressor", "filters"):
+                var.encoding.pop(key, None)
+        # every chunk is written by its own task, so the write is parallel across workers
+        delayed_write = ds_to_save.to_zarr(
+            temp_file_path, mode="w", consolidated=True, compute=False
+        )
+    else:
+        delayed_write = ds_to_save.to_netcdf(temp_file_path, engine=engine, compute=False)
+    if cluster_manager.is_paused:
+        # the paused cluster has no workers to run the write
+        delayed_write.compute(scheduler=cluster_manager.scheduler)
+    else:
+        future: Future = client.compute(delayed_write)  # type: ignore
+        logger.debug(f"Write task submitted to Dask. Waiting for completion to {temp_file_path}...")
+        progress(future)
+        future.result()
+    remove_cache_path(target_path)
     os.rename(str(temp_file_path), str(target_path))
     logger.info(f"Successfully saved data to: {target_path}")
 
@@ -195,7 +451,9 @@ def save_to_cache(
     stores: xr.Dataset, cached_nc_path: Path, interpolate_nans: bool = True
 ) -> xr.Dataset:
     """
-    Compute the store and save it to a cached netCDF file. This is not required but will save time and bandwidth.
+    Compute the store and save it to a cached netCDF file, or a Zarr store if the path ends in .zarr.
+    This is not required but will save time and bandwidth.
+    Casting to float32 and filling NaNs happen in a single dask graph, so the file is written once.
     """
     logger.info(f"Processing dataset for caching. Final cache target: {cached_nc_path}")
 
@@ -204,14 +462,12 @@ def save_to_cache(
         if np.issubdtype(var.dtype, np.number):
             stores[name] = var.astype("float32", casting="same_kind")
 
-    # save dataset locally before manipulating it
-    save_dataset(stores, cached_nc_path)
-    stores = xr.open_mfdataset(cached_nc_path, parallel=True, engine="h5netcdf")
-
     if interpolate_nans:
-        interpolate_nan_values(dataset=stores)
-        save_dataset(stores, cached_nc_path)
-        stores = xr.open_mfdataset(cached_nc_path, parallel=True, engine="h5netcdf")
+        # the NaN fill is part of the same graph, so the data is read and written once
+        stores = interpolate_nan_values_lazy(stores)
+
+    save_dataset(stores, cached_nc_path)
+    stores = open_cached_dataset(cached_nc_path)
 
     return stores
 
@@ -231,7 +487,7 @@ def check_local_cache(
 
     logger.info("Found cached nc file")
     # open the cached file and check that the time range is correct
-    cached_data = xr.open_mfdataset(cached_nc_path, parallel=True, engine="h5netcdf")
+    cached_data = open_cached_dataset(cached_nc_path)
 
     if "name" not in cached_data.attrs or "name" not in remote_dataset.attrs:
         logger.warning("No name attribute found to compare datasets")
@@ -266,12 +522,183 @@ def check_local_cache(
     return merged_data
 
 
+def find_cache_gaps(
+    cached_data: xr.Dataset,
+    start_time: str,
+    end_time: str,
+    gdf: gpd.GeoDataFrame,
+    remote_dataset: xr.Dataset,
+) -> Optional[Tuple[List[Tuple[str, np.datetime64, np.datetime64]], List[str]]]:
+    """
+    Work out what the cached dataset is missing to satisfy a request.
+
+    Parameters
+    ----------
+    cached_data : xr.Dataset
+        Dataset opened from the local cache.
+    start_time : str
+        Desired start time in YYYY/MM/DD HH:MM:SS format.
+    end_time : str
+        Desired end time in YYYY/MM/DD HH:MM:SS format.
+    gdf : gpd.GeoDataFrame
+        Catchments the data is requested for, in the crs of the dataset.
+    remote_dataset : xr.Dataset
+        Dataset the cache was created from.
+
+    Returns
+    -------
+    Optional[Tuple[List[Tuple[str, np.datetime64, np.datetime64]], List[str]]]
+        The missing ("before" | "after", start, end) time ranges and the
+        missing variables. None if the cache can't be extended, because it
+        comes from a different source or doesn't cover the requested area.
+    """
+    if "name" not in cached_data.attrs or "name" not in remote_dataset.attrs:
+        return None
+    if cached_data.name != remote_dataset.name:
+        return None
+
+    # the cache can only be extended in time, check it covers the requested area
+    bounds = gdf.total_bounds
+    x_step = abs(float(cached_data.x[1] - cached_data.x[0])) if cached_data.sizes["x"] > 1 else 0
+    y_step = abs(float(cached_data.y[1] - cached_data.y[0])) if cached_data.sizes["y"] > 1 else 0
+    covers_area = (
+        float(cached_data.x.min()) <= bounds[0] + x_step
+        and float(cached_data.x.max()) >= bounds[2] - x_step
+        and float(cached_data.y.min()) <= bounds[1] + y_step
+        and float(cached_data.y.max()) >= bounds[3] - y_step
+    )
+    if not covers_area:
+        logger.warning("Cached data doesn't cover the requested area")
+        return None
+
+    start_time, end_time = validate_time_range(remote_dataset, start_time, end_time)
+    cached_start = cached_data.time[0].values
+    cached_end = cached_data.time[-1].values
+    one_second = np.timedelta64(1, "s")
+    missing_ranges = []
+    if np.datetime64(start_time) < cached_start:
+        missing_ranges.append(("before", np.datetime64(start_time), cached_start - one_second))
+    if np.datetime64(end_time) > cached_end:
+        missing_ranges.append(("after", cached_end + one_second, np.datetime64(end_time)))
+
+    missing_vars = sorted(set(remote_dataset.data_vars) - set(cached_data.data_vars))
+    return missing_ranges, missing_vars
+
+
+def fill_cache_gaps(
+    cached_data: xr.Dataset,
+    cached_nc_path: Path,
+    missing_ranges: List[Tuple[str, np.datetime64, np.datetime64]],
+    missing_vars: List[str],
+    remote_dataset: xr.Dataset,
+) -> xr.Dataset:
+    """
+    Download only what the cache is missing and merge it into the cache file.
+
+    Missing time ranges are fetched for the variables already in the cache,
+    missing variables are fetched for the full time range of the merged cache.
+    Both are fetched on the same x/y window as the cache.
+
+    Returns
+    -------
+    xr.Dataset
+        The updated cache, reopened from disk.
+    """
+    x_window = slice(float(cached_data.x.min()), float(cached_data.x.max()))
+    y_window = slice(float(cached_data.y.min()), float(cached_data.y.max()))
+
+    def fetch(variables: List[str], start, end, label: str) -> Tuple[xr.Dataset, Path]:
+        logger.info(f"Fetching {variables} from {start} to {end} to fill the cache")
+        remote_part = remote_dataset[variables].sel(
+            x=x_window, y=y_window, time=slice(start, end)
+        )
+        if remote_part.sizes["x"] != cached_data.sizes["x"] or (
+            remote_part.sizes["y"] != cached_data.sizes["y"]
+        ):
+            raise ValueError("Remote data doesn't line up with the cached grid")
+        part_path = cached_nc_path.with_name(
+            f"{cached_nc_path.stem}_{label}{cached_nc_path.suffix}"
+        )
+        part = save_to_cache(remote_part, part_path)
+        # use the cached coordinates so the parts merge without float mismatches
+        part = part.assign_coords(x=cached_data.x, y=cached_data.y)
+        return part, part_path
+
+    parts = {}
+    part_paths = []
+    for label, start, end in missing_ranges:
+        parts[label], part_path = fetch(list(cached_data.data_vars), start, end, label)
+        part_paths.append(part_path)
+
+    time_parts = [parts[label] for label in ("before",) if label in parts]
+    time_parts.append(cached_data)
+    time_parts += [parts[label] for label in ("after",) if label in parts]
+    combined = xr.concat(time_parts, dim="time") if len(time_parts) > 1 else cached_data
+
+    if missing_vars:
+        extra, part_path = fetch(
+            missing_vars, combined.time[0].values, combined.time[-1].values, "variables"
+        )
+        part_paths.append(part_path)
+        combined = xr.merge([combined, extra], join="exact")
+
+    combined.attrs = dict(cached_data.attrs)
+    save_dataset(combined, cached_nc_path)
+    combined.close()
+    cached_data.close()
+    _ = [part.close() for part in parts.values()]
+    for part_path in part_paths:
+        remove_cache_path(part_path)
+    return open_cached_dataset(cached_nc_path)
+
+
+def extend_local_cache(
+    cached_nc_path: Path,
+    start_time: str,
+    end_time: str,
+    gdf: gpd.GeoDataFrame,
+    remote_dataset: xr.Dataset,
+) -> Union[xr.Dataset, None]:
+    """
+    Fill the gaps in an existing cache that doesn't fully cover the request,
+    so only the missing time ranges and variables are downloaded.
+
+    Returns the clipped dataset, or None if there is no cache or it can't be
+    extended and has to be downloaded again.
+    """
+    if not os.path.exists(cached_nc_path):
+        return None
+    cached_data = open_cached_dataset(cached_nc_path)
+    gaps = find_cache_gaps(cached_data, start_time, end_time, gdf, remote_dataset)
+    if gaps is None:
+        cached_data.close()
+        return None
+    missing_ranges, missing_vars = gaps
+    if not missing_ranges and not missing_vars:
+        # the request only reaches past the end of the remote data, nothing to fetch
+        return clip_dataset_to_bounds(cached_data, gdf.total_bounds, start_time, end_time)
+    logger.info(
+        f"Filling cache gaps: time ranges {[label for label, _, _ in missing_ranges]}, "
+        f"variables {missing_vars}"
+    )
+    try:
+        cached_data = fill_cache_gaps(
+            cached_data, cached_nc_path, missing_ranges, missing_vars, remote_dataset
+        )
+    except ValueError as e:
+        logger.warning(f"Unable to fill cache gaps, downloading again: {e}")
+        cached_data.close()
+        return None
+    return clip_dataset_to_bounds(cached_data, gdf.total_bounds, start_time, end_time)
+
+
 def save_and_clip_dataset(
     dataset: xr.Dataset,
     gdf: gpd.GeoDataFrame,
     start_time: datetime,
     end_time: datetime,
     cache_location: Path,
+    align_to_chunks: bool = False,
 ) -> xr.Dataset:
     """convenience function clip the remote dataset, and either load from cache or save to cache if it's not present"""
     gdf = gdf.to_crs(dataset.crs)
@@ -284,12 +711,33 @@ def save_and_clip_dataset(
         dataset,
     )
 
+    if not cached_data:
+        # only download what the cache is missing if possible
+        cached_data = extend_local_cache(
+            cache_location,
+            start_time,  # type: ignore
+            end_time,  # type: ignore
+            gdf,
+            dataset,
+        )
+
     if not cached_data:
         clipped_data = clip_dataset_to_bounds(
             dataset,
             gdf.total_bounds,
             start_time,  # type: ignore
             end_time,  # type: ignore
+            align_to_chunks=align_to_chunks,
         )
         cached_data = save_to_cache(clipped_data, cache_location)
+        if align_to_chunks:
+            # the cache keeps the whole chunks so nearby requests can reuse them,
+            # the caller only gets the requested bounds and time range
+            cached_data = clip_dataset_to_bounds(
+                cached_data,
+                gdf.total_bounds,
+                start_time,  # type: ignore
+                end_time,  # type: ignore
+            )
+    log_chunk_cache_stats()
     return cached_data
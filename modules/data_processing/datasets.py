@@ -1,18 +1,31 @@
 import logging
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
 
 import s3fs
 import xarray as xr
 from data_processing.dask_utils import use_cluster
 from data_processing.dataset_utils import validate_dataset_format
 from data_processing.s3fs_utils import S3ParallelFileSystem
+from data_processing.store_cache import get_cached_store
 
 logger = logging.getLogger(__name__)
 
+# coordinate arrays of the v3 retrospective stores, cached locally with the metadata
+V3_COORDINATE_ARRAYS = ("time", "x", "y", "crs")
+
 
 @use_cluster
-def load_v3_retrospective_zarr(forcing_vars: Optional[list[str]] = None) -> xr.Dataset:
-    """Load zarr datasets from S3 within the specified time range."""
+def load_v3_retrospective_zarr(
+    forcing_vars: Optional[list[str]] = None, use_chunk_cache: bool = False
+) -> xr.Dataset:
+    """
+    Load zarr datasets from S3 within the specified time range.
+    If use_chunk_cache is set, chunks read from S3 are also kept on disk.
+    """
     # if a LocalCluster is not already running, start one
     if not forcing_vars:
         forcing_vars = ["lwdown", "precip", "psfc", "q2d", "swdown", "t2d", "u2d", "v2d"]
@@ -22,10 +35,16 @@ def load_v3_retrospective_zarr(forcing_vars: Optional[list[str]] = None) -> xr.D
     ]
     # default cache is readahead which is detrimental to performance in this case
     fs = S3ParallelFileSystem(anon=True, default_cache_type="none")  # default_block_size
-    s3_stores = [s3fs.S3Map(url, s3=fs) for url in s3_urls]
+    # metadata and coordinates are kept on disk, repeat loads don't query s3 for them
+    s3_stores = [
+        get_cached_store(url, s3fs.S3Map(url, s3=fs), V3_COORDINATE_ARRAYS, use_chunk_cache)
+        for url in s3_urls
+    ]
     # the cache option here just holds accessed data in memory to prevent s3 being queried multiple times
     # most of the data is read once and written to disk but some of the coordinate data is read multiple times
-    dataset = xr.open_mfdataset(s3_stores, parallel=True, engine="zarr", cache=True)  # type: ignore
+    dataset = xr.open_mfdataset(
+        s3_stores, parallel=True, engine="zarr", cache=True, consolidated=True  # type: ignore
+    )
 
     # set the crs attribute to conform with the format
     esri_pe_string = dataset.crs.esri_pe_string
@@ -50,26 +69,85 @@ def load_v3_retrospective_zarr(forcing_vars: Optional[list[str]] = None) -> xr.D
     return dataset
 
 
+AORC_S3_URL = "s3://noaa-nws-aorc-v1-1-1km/"
+AORC_FIRST_YEAR = 1979
+AORC_LAST_YEAR = 2023
+AORC_COORDINATE_ARRAYS = ("time", "latitude", "longitude")
+
+# yearly AORC stores opened so far in this process, reused across requests
+# keyed by (year, use_chunk_cache)
+_aorc_year_datasets: Dict[Tuple[int, bool], xr.Dataset] = {}
+_aorc_year_lock = threading.Lock()
+
+
+def open_aorc_year(year: int, fs: S3ParallelFileSystem, use_chunk_cache: bool) -> xr.Dataset:
+    """Lazily open one yearly AORC store, with its metadata cached locally."""
+    url = f"{AORC_S3_URL}{year}.zarr"
+    store = get_cached_store(
+        url, s3fs.S3Map(url, s3=fs), AORC_COORDINATE_ARRAYS, use_chunk_cache
+    )
+    return xr.open_dataset(store, engine="zarr", chunks={}, consolidated=True, cache=True)
+
+
+def get_aorc_years(years: List[int], use_chunk_cache: bool = False) -> List[xr.Dataset]:
+    """Return the datasets for the given years, opening any not already open."""
+    with _aorc_year_lock:
+        missing_years = [
+            year for year in years if (year, use_chunk_cache) not in _aorc_year_datasets
+        ]
+        if missing_years:
+            logger.info(f"Opening AORC zarr stores for {missing_years}")
+            start = perf_counter()
+            fs = S3ParallelFileSystem(anon=True, default_cache_type="none")
+            with ThreadPoolExecutor(max_workers=len(missing_years)) as executor:
+                opened = executor.map(
+                    lambda year: open_aorc_year(year, fs, use_chunk_cache), missing_years
+                )
+                for year, dataset in zip(missing_years, opened):
+                    _aorc_year_datasets[(year, use_chunk_cache)] = dataset
+            logger.info(f"Opened {len(missing_years)} stores in {perf_counter() - start:.2f}s")
+        return [_aorc_year_datasets[(year, use_chunk_cache)] for year in years]
+
+
 @use_cluster
-def load_aorc_zarr(start_year: Optional[int] = None, end_year: Optional[int] = None) -> xr.Dataset:
-    """Load the aorc zarr dataset from S3."""
+def load_aorc_zarr(
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    use_chunk_cache: bool = False,
+) -> xr.Dataset:
+    """
+    Load the aorc zarr dataset from S3.
+
+    The data is stored as one zarr store per year, only the stores that
+    intersect the requested range are opened. Passing start_time and
+    end_time takes precedence over start_year and end_year.
+    If use_chunk_cache is set, chunks read from S3 are also kept on disk.
+    """
+    if start_time is not None:
+        start_year = start_time.year
+    if end_time is not None:
+        end_year = end_time.year
     if not start_year or not end_year:
-        logger.warning("No start or end year provided, defaulting to 1979-2023")
+        logger.warning(
+            f"No start or end year provided, defaulting to {AORC_FIRST_YEAR}-{AORC_LAST_YEAR}"
+        )
         logger.warning("To reduce the time taken to load the data, provide a smaller range")
     if not start_year:
-        start_year = 1979
+        start_year = AORC_FIRST_YEAR
     if not end_year:
-        end_year = 2023
+        end_year = AORC_LAST_YEAR
 
     logger.info(f"Loading AORC zarr datasets from {start_year} to {end_year}")
-    estimated_time_s = ((end_year - start_year) * 2.5) + 3.5
-    # from testing, it's about 2.1s per year + 3.5s overhead
-    logger.info(f"This should take roughly {estimated_time_s} seconds")
-    fs = S3ParallelFileSystem(anon=True, default_cache_type="none")
-    s3_url = "s3://noaa-nws-aorc-v1-1-1km/"
-    urls = [f"{s3_url}{i}.zarr" for i in range(start_year, end_year + 1)]
-    filestores = [s3fs.S3Map(url, s3=fs) for url in urls]
-    dataset = xr.open_mfdataset(filestores, parallel=True, engine="zarr", cache=True)  # type: ignore
+    datasets = get_aorc_years(list(range(start_year, end_year + 1)), use_chunk_cache)
+    if len(datasets) == 1:
+        # copy so the attributes set below don't leak into the cached dataset
+        dataset = datasets[0].copy()
+    else:
+        dataset = xr.concat(
+            datasets, dim="time", data_vars="minimal", coords="minimal", compat="override"
+        )
     dataset.attrs["crs"] = "+proj=longlat +datum=WGS84 +no_defs"
     dataset.attrs["name"] = "aorc_1km_zarr"
     # rename latitude and longitude to x and y
@@ -80,15 +158,23 @@ def load_aorc_zarr(start_year: Optional[int] = None, end_year: Optional[int] = N
 
 
 @use_cluster
-def load_swe_zarr() -> xr.Dataset:
-    """Load the swe zarr dataset from S3."""
+def load_swe_zarr(use_chunk_cache: bool = False) -> xr.Dataset:
+    """
+    Load the swe zarr dataset from S3.
+    If use_chunk_cache is set, chunks read from S3 are also kept on disk.
+    """
     s3_urls = ["s3://noaa-nwm-retrospective-3-0-pds/CONUS/zarr/ldasout.zarr"]
     # default cache is readahead which is detrimental to performance in this case
     fs = S3ParallelFileSystem(anon=True, default_cache_type="none")  # default_block_size
-    s3_stores = [s3fs.S3Map(url, s3=fs) for url in s3_urls]
+    s3_stores = [
+        get_cached_store(url, s3fs.S3Map(url, s3=fs), V3_COORDINATE_ARRAYS, use_chunk_cache)
+        for url in s3_urls
+    ]
     # the cache option here just holds accessed data in memory to prevent s3 being queried multiple times
     # most of the data is read once and written to disk but some of the coordinate data is read multiple times
-    dataset = xr.open_mfdataset(s3_stores, parallel=True, engine="zarr", cache=True)  # type: ignore
+    dataset = xr.open_mfdataset(
+        s3_stores, parallel=True, engine="zarr", cache=True, consolidated=True  # type: ignore
+    )
 
     # set the crs attribute to conform with the format
     esri_pe_string = dataset.crs.esri_pe_string
@@ -2,6 +2,10 @@ from pathlib import Path
 from typing import Optional
 from datetime import datetime
 
+# formats of the local gridded data cache, see file_paths.cached_gridded_data
+GRIDDED_CACHE_FORMATS = ("netcdf", "zarr")
+
+
 class file_paths:
     """
     This class contains all of the file paths used in the data processing
@@ -13,6 +17,9 @@ class file_paths:
     hydrofabric_download_log = Path("~/.ngiab/hydrofabric/v2.2/download_log.json").expanduser()
     no_update_hf = Path("~/.ngiab/hydrofabric/v2.2/no_update").expanduser()
     cache_dir = Path("~/.ngiab/zarr_cache").expanduser()
+    store_metadata_cache = cache_dir / "store_metadata"
+    chunk_cache = cache_dir / "chunks"
+    tile_cache = cache_dir / "tiles"
     output_dir = None
     data_sources = Path(__file__).parent.parent / "data_sources"
     map_app_static = Path(__file__).parent.parent / "map_app" / "static"
@@ -23,6 +30,7 @@ class file_paths:
     triggers_sql = data_sources / "triggers.sql"
     conus_hydrofabric = hydrofabric_dir / "conus_nextgen.gpkg"
     hydrofabric_graph = hydrofabric_dir / "conus_igraph_network.gpickle"
+    hydrofabric_graph_cache = hydrofabric_dir / "conus_network_graph"
     template_nc = data_sources / "forcing_template.nc"
     dev_file = Path(__file__).parent.parent.parent / ".dev"
     template_troute_config = data_sources / "ngen-routing-template.yaml"
@@ -99,6 +107,24 @@ class file_paths:
     def cached_nc_file(self) -> Path:
         return self.forcings_dir / "raw_gridded_data.nc"
 
+    @property
+    def cached_zarr_store(self) -> Path:
+        return self.forcings_dir / "raw_gridded_data.zarr"
+
+    def cached_gridded_data(self, cache_format: str = "netcdf") -> Path:
+        """Path of the local gridded data cache for the given format, "netcdf" or "zarr"."""
+        if cache_format == "zarr":
+            return self.cached_zarr_store
+        if cache_format == "netcdf":
+            return self.cached_nc_file
+        raise ValueError(
+            f"Unknown cache format {cache_format}, expected one of {GRIDDED_CACHE_FORMATS}"
+        )
+
+    @property
+    def forcings_nc_file(self) -> Path:
+        return self.forcings_dir / "forcings.nc"
+
     def append_cli_command(self, command: list[str]) -> None:
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         command_string = " ".join(command)
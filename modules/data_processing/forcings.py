@@ -1,24 +1,32 @@
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os
+import pickle
+import shutil
+import threading
 import time
 import warnings
 from functools import partial
 from math import ceil
 from multiprocessing import shared_memory
 from pathlib import Path
-from typing import List, Tuple
+from typing import Hashable, Iterable, List, Optional, Set, Tuple
 
+import dask
+import dask.array as da
 import geopandas as gpd
+import netCDF4
 import numpy as np
 import pandas as pd
 import psutil
 import xarray as xr
-from data_processing.dask_utils import no_cluster, use_cluster
+from data_processing.dask_utils import cluster_manager, no_cluster, use_cluster
 from data_processing.dataset_utils import validate_dataset_format
 from data_processing.file_paths import file_paths
 from exactextract import exact_extract
 from exactextract.raster import NumPyRasterSource
+from scipy import sparse
 from rich.progress import (
     BarColumn,
     Progress,
@@ -28,6 +36,16 @@ from rich.progress import (
 )
 
 logger = logging.getLogger(__name__)
+# per worker cache of the catchment weight chunks, keyed by the name of the
+# shared memory block they were published in
+_worker_cat_chunks: dict[str, List[pd.DataFrame]] = {}
+# approximate size of the time blocks of gridded data reduced by each dask task
+DASK_BLOCK_BYTES = 256 * 1024 * 1024
+ZONAL_STATS_ENGINES = ("multiprocessing", "dask")
+# approximate size of the blocks of catchments written to the final forcings file
+WRITE_BLOCK_BYTES = 256 * 1024 * 1024
+# seconds between the memory samples taken while a time chunk is processed
+MEMORY_SAMPLE_INTERVAL = 0.05
 # Suppress the specific warning from numpy to keep the cli output clean
 warnings.filterwarnings(
     "ignore", message="'DataFrame.swapaxes' is deprecated", category=FutureWarning
@@ -135,7 +153,9 @@ def add_precip_rate_to_dataset(dataset: xr.Dataset) -> xr.Dataset:
     return dataset
 
 
-def get_index_chunks(data: xr.DataArray) -> list[tuple[int, int]]:
+def get_index_chunks(
+    data: xr.DataArray, memory_budget: Optional[float] = None
+) -> list[tuple[int, int]]:
     """
     Take a DataArray and calculate the start and end index for each chunk based
     on the available memory.
@@ -144,6 +164,9 @@ def get_index_chunks(data: xr.DataArray) -> list[tuple[int, int]]:
     ----------
     data : xr.DataArray
         Large DataArray that can't be loaded into memory all at once.
+    memory_budget : float, optional
+        Memory in bytes each chunk may use. Defaults to 80% of the available
+        memory, capped at 20 GB.
 
     Returns
     -------
@@ -152,19 +175,172 @@ def get_index_chunks(data: xr.DataArray) -> list[tuple[int, int]]:
         the chunk indicates the start index and end index of the chunk.
     """
     array_memory_usage = data.nbytes
-    free_memory = psutil.virtual_memory().available * 0.8  # 80% of available memory
-    # limit the chunk to 20gb, makes things more stable
-    free_memory = min(free_memory, 20 * 1024 * 1024 * 1024)
+    free_memory = memory_budget or get_default_memory_budget()
     num_chunks = ceil(array_memory_usage / free_memory)
     max_index = data.shape[0]
-    stride = max_index // num_chunks
+    stride = max(max_index // num_chunks, 1)
     chunk_start = range(0, max_index, stride)
     index_chunks = [(start, start + stride) for start in chunk_start]
     return index_chunks
 
 
+def get_default_memory_budget() -> float:
+    """Return the memory budget in bytes used when none is given explicitly."""
+    free_memory = psutil.virtual_memory().available * 0.8  # 80% of available memory
+    # limit the chunk to 20gb, makes things more stable
+    return min(free_memory, 20 * 1024 * 1024 * 1024)
+
+
+def get_pipeline_memory_usage() -> int:
+    """
+    Return the memory in bytes held by this process and its pool workers.
+
+    The parent's RSS includes the shared memory blocks it has written, so only
+    the private part (rss - shared) of each child is added to avoid counting
+    the shared raster once per worker.
+    """
+    process = psutil.Process()
+    usage = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            info = child.memory_info()
+        except psutil.NoSuchProcess:
+            continue
+        usage += info.rss - getattr(info, "shared", 0)
+    return usage
+
+
+class PeakMemorySampler:
+    """
+    Sample get_pipeline_memory_usage on a background thread for the duration
+    of a with block and keep the highest value, so peaks between the steps of
+    a chunk, e.g. while the pool workers hold their results, are not missed.
+
+    resource.getrusage can't be used instead, ru_maxrss is the peak over the
+    whole life of the process and RUSAGE_CHILDREN only covers workers that
+    have exited, not the ones in the pool.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_pipeline_memory_usage())
+
+    def __enter__(self) -> "PeakMemorySampler":
+        self.peak = get_pipeline_memory_usage()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.peak = max(self.peak, get_pipeline_memory_usage())
+
+
+class TimeChunkPlanner:
+    """
+    Plan the size of the time chunks processed by the zonal stats pipeline.
+
+    The peak memory of one chunk is modelled per timestep as the sum of
+    everything that is alive at the same time:
+
+    - the float32 shared memory block holding the raster
+    - the staging copy of the raster loaded from the source dataset
+    - the gathered cells of the largest catchment in every worker
+    - the float64 result arrays, which exist in the workers, in transit,
+      in the parent's result list and in the concatenated output
+
+    Chunks are sized so that the modelled peak fits in the memory budget.
+    After each chunk the measured peak is compared to the model and the ratio
+    is used to correct the size of the next chunk.
+    """
+
+    # worker arrays, worker concat, pickled transfer and the concat in the parent
+    RESULT_COPIES = 4
+    MIN_CORRECTION = 0.25
+    MAX_CORRECTION = 8.0
+
+    def __init__(
+        self,
+        num_cells: int,
+        num_catchments: int,
+        max_cells_per_catchment: int,
+        num_workers: int,
+        memory_budget: Optional[float] = None,
+    ):
+        """
+        Parameters
+        ----------
+        num_cells : int
+            Number of raster cells (x * y) in one timestep of the gridded data.
+        num_catchments : int
+            Number of catchments the zonal stats are computed for.
+        max_cells_per_catchment : int
+            Largest number of raster cells intersecting a single catchment.
+        num_workers : int
+            Number of pool workers processing catchment chunks concurrently.
+        memory_budget : float, optional
+            Memory in bytes that one chunk is allowed to use. Defaults to 80% of
+            the available memory, capped at 20 GB.
+        """
+        self.num_cells = num_cells
+        self.num_catchments = num_catchments
+        self.max_cells_per_catchment = max_cells_per_catchment
+        self.num_workers = num_workers
+        self.memory_budget = memory_budget or get_default_memory_budget()
+        self.correction = 1.0
+
+    def bytes_per_timestep(self, source_itemsize: int = 4) -> int:
+        """Modelled peak memory in bytes for a single timestep."""
+        shared_block = self.num_cells * np.dtype(np.float32).itemsize
+        staging = self.num_cells * source_itemsize
+        # fancy indexing and the multiplication by the weights both allocate
+        gathered = self.num_workers * self.max_cells_per_catchment * 8 * 2
+        results = self.num_catchments * 8 * self.RESULT_COPIES
+        return shared_block + staging + gathered + results
+
+    def chunk_length(self, source_itemsize: int = 4) -> int:
+        """Number of timesteps that fit in the budget with the current correction."""
+        step_bytes = self.bytes_per_timestep(source_itemsize) * self.correction
+        return max(int(self.memory_budget // step_bytes), 1)
+
+    def next_chunk(self, start: int, num_times: int, source_itemsize: int = 4) -> Tuple[int, int]:
+        """Return the (start, end) indices of the chunk beginning at start."""
+        end = min(start + self.chunk_length(source_itemsize), num_times)
+        return start, end
+
+    def record(self, chunk_length: int, measured_bytes: int, source_itemsize: int = 4) -> None:
+        """
+        Update the correction factor from the measured peak memory of a chunk.
+        Increases are applied straight away, decreases are smoothed so a single
+        quiet chunk doesn't cause the next one to overshoot.
+        """
+        modelled = chunk_length * self.bytes_per_timestep(source_itemsize)
+        if modelled <= 0 or measured_bytes <= 0:
+            return
+        observed = measured_bytes / modelled
+        if observed > self.correction:
+            correction = observed
+        else:
+            correction = (self.correction + observed) / 2
+        self.correction = min(max(correction, self.MIN_CORRECTION), self.MAX_CORRECTION)
+        logger.debug(
+            f"Chunk of {chunk_length} timesteps used {measured_bytes / 10**6:.1f} Mb, "
+            f"modelled {modelled / 10**6:.1f} Mb, correction now {self.correction:.2f}"
+        )
+
+
 def create_shared_memory(
     lazy_array: xr.DataArray,
+    memory_budget: Optional[float] = None,
 ) -> Tuple[shared_memory.SharedMemory, Tuple[int, ...], np.dtype]:
     """
     Create a shared memory object so that multiple processes can access loaded
@@ -174,6 +350,9 @@ def create_shared_memory(
     ----------
     lazy_array : xr.Dataset
         A chunk of gridded forcing variable data.
+    memory_budget : float, optional
+        Memory in bytes the staging copy of each block loaded from lazy_array
+        may use. Defaults to 80% of the available memory, capped at 20 GB.
 
     Returns
     -------
@@ -191,9 +370,11 @@ def create_shared_memory(
     shared_array = np.ndarray(lazy_array.shape, dtype=np.float32, buffer=shm.buf)
     # if your data is not float32, xarray will do an automatic conversion here
     # which consumes a lot more memory, forcings downloaded with this tool will work
-    for start, end in get_index_chunks(lazy_array):
+    for start, end in get_index_chunks(lazy_array, memory_budget):
         # copy data from lazy to shared memory one chunk at a time
-        shared_array[start:end] = lazy_array[start:end]
+        shared_array[start:end] = lazy_array[start:end].compute(
+            scheduler=cluster_manager.scheduler
+        )
 
     time, x, y = shared_array.shape
     shared_array = shared_array.reshape(time, -1)
@@ -253,8 +434,67 @@ def process_chunk_shared(
     return xr.concat(results, dim="catchment")
 
 
+def share_cat_chunks(cat_chunks: List[pd.DataFrame]) -> shared_memory.SharedMemory:
+    """
+    Publish the catchment weight chunks in a SharedMemory block so that pool
+    workers can load them once, instead of receiving them with every task.
+
+    Parameters
+    ----------
+    cat_chunks : List[pd.DataFrame]
+        Cell weights for each chunk of catchments.
+
+    Returns
+    -------
+    shared_memory.SharedMemory
+        Block containing the pickled chunks. The caller is responsible for
+        closing and unlinking it once all tasks have completed.
+    """
+    payload = pickle.dumps(cat_chunks, protocol=pickle.HIGHEST_PROTOCOL)
+    shm = shared_memory.SharedMemory(create=True, size=len(payload))
+    shm.buf[: len(payload)] = payload
+    return shm
+
+
+def get_worker_cat_chunks(weights_shm_name: str) -> List[pd.DataFrame]:
+    """
+    Return the catchment weight chunks published by share_cat_chunks. The
+    chunks are unpickled the first time a worker sees a given block and reused
+    for every following task.
+    """
+    if weights_shm_name not in _worker_cat_chunks:
+        # only one job runs on a pool at a time, drop weights from previous jobs
+        _worker_cat_chunks.clear()
+        existing_shm = shared_memory.SharedMemory(name=weights_shm_name)
+        # pickle ignores the trailing padding the OS may add to the block
+        _worker_cat_chunks[weights_shm_name] = pickle.loads(existing_shm.buf)
+        existing_shm.close()
+    return _worker_cat_chunks[weights_shm_name]
+
+
+def process_chunk_pooled(
+    weights_shm_name: str,
+    variable: str,
+    times: np.ndarray,
+    shm_name: str,
+    shape: Tuple[int, ...],
+    dtype: np.dtype,
+    chunk_index: int,
+) -> xr.DataArray:
+    """
+    Pool task wrapper for process_chunk_shared. Looks up the catchment chunk
+    from the weights cached in the worker, so the task itself only carries
+    the names of the shared blocks, the time slice and the chunk index.
+    """
+    chunk = get_worker_cat_chunks(weights_shm_name)[chunk_index]
+    return process_chunk_shared(variable, times, shm_name, shape, dtype, chunk)
+
+
 def get_cell_weights_parallel(
-    gdf: gpd.GeoDataFrame, input_forcings: xr.Dataset, num_partitions: int
+    gdf: gpd.GeoDataFrame,
+    input_forcings: xr.Dataset,
+    num_partitions: int,
+    pool: Optional[multiprocessing.pool.Pool] = None,
 ) -> pd.DataFrame:
     """
     Execute get_cell_weights with multiprocessing, with chunking for the passed
@@ -268,6 +508,8 @@ def get_cell_weights_parallel(
         A gridded forcings file.
     num_partitions : int
         Number of chunks to split gdf into.
+    pool : multiprocessing.pool.Pool, optional
+        Existing pool to run on. If not provided, a temporary pool is created.
 
     Returns
     -------
@@ -277,10 +519,13 @@ def get_cell_weights_parallel(
     """
     gdf_chunks = np.array_split(gdf, num_partitions)
     wkt = gdf.crs.to_wkt()  # type: ignore
-    one_timestep = input_forcings.isel(time=0).compute()
-    with multiprocessing.Pool() as pool:
-        args = [(one_timestep, gdf_chunk, wkt) for gdf_chunk in gdf_chunks]
+    one_timestep = input_forcings.isel(time=0).compute(scheduler=cluster_manager.scheduler)
+    args = [(one_timestep, gdf_chunk, wkt) for gdf_chunk in gdf_chunks]
+    if pool is not None:
         catchments = pool.starmap(get_cell_weights, args)
+    else:
+        with multiprocessing.Pool() as temp_pool:
+            catchments = temp_pool.starmap(get_cell_weights, args)
     return pd.concat(catchments)
 
 
@@ -305,35 +550,33 @@ def get_units(dataset: xr.Dataset) -> dict:
     return units
 
 
-@no_cluster
-def compute_zonal_stats(
-    gdf: gpd.GeoDataFrame, gridded_data: xr.Dataset, forcings_dir: Path
+def process_variables(
+    pool: multiprocessing.pool.Pool,
+    weights_shm_name: str,
+    num_cat_chunks: int,
+    gridded_data: xr.Dataset,
+    forcings_dir: Path,
+    planner: TimeChunkPlanner,
 ) -> None:
     """
-    Compute zonal statistics in parallel for all timesteps over all desired
-    catchments. Create chunks of catchments and within those, chunks of
-    timesteps for memory management.
+    Compute the catchment averages of every variable in gridded_data, one time
+    chunk at a time, and write one NetCDF file per variable to the temp folder.
 
     Parameters
     ----------
-    gdf : gpd.GeoDataFrame
-        Contains identity and geometry information on desired catchments.
-    merged_data : xr.Dataset
+    pool : multiprocessing.pool.Pool
+        Pool that is reused for every variable and time chunk.
+    weights_shm_name : str
+        Name of the SharedMemory block created by share_cat_chunks.
+    num_cat_chunks : int
+        Number of catchment chunks stored in the weights block.
+    gridded_data : xr.Dataset
         Gridded forcing data that intersects with desired catchments.
     forcings_dir : Path
         Path to directory where outputs are to be stored.
+    planner : TimeChunkPlanner
+        Decides how many timesteps are processed at once.
     """
-    logger.info("Computing zonal stats in parallel for all timesteps")
-    timer_start = time.time()
-    num_partitions = multiprocessing.cpu_count() - 1
-    if num_partitions > len(gdf):
-        num_partitions = len(gdf)
-
-    catchments = get_cell_weights_parallel(gdf, gridded_data, num_partitions)
-    units = get_units(gridded_data)
-
-    cat_chunks: List[pd.DataFrame] = np.array_split(catchments, num_partitions)  # type: ignore
-
     progress = Progress(
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
@@ -357,31 +600,54 @@ def compute_zonal_stats(
         progress.update(variable_task, description=f"Processing {data_var_name}")
 
         # to make sure this fits in memory, we need to chunk the data
-        time_chunks = get_index_chunks(gridded_data[data_var_name])
-        chunk_task = progress.add_task("[purple] processing chunks", total=len(time_chunks))
-        for i, times in enumerate(time_chunks):
-            progress.update(chunk_task, advance=1)
-            start, end = times
+        # the planner resizes the chunks as it measures the memory actually used
+        data_var = gridded_data[data_var_name]
+        num_times = data_var.shape[0]
+        itemsize = data_var.dtype.itemsize
+        chunk_task = progress.add_task(
+            "[purple] processing chunks", total=ceil(num_times / planner.chunk_length(itemsize))
+        )
+        num_time_chunks = 0
+        end = 0
+        while end < num_times:
+            start, end = planner.next_chunk(end, num_times, itemsize)
+            i = num_time_chunks
+            num_time_chunks += 1
+            remaining = ceil((num_times - end) / planner.chunk_length(itemsize))
+            progress.update(chunk_task, advance=1, total=num_time_chunks + remaining)
+            baseline_memory = get_pipeline_memory_usage()
             # select the chunk of time we want to process
-            data_chunk = gridded_data[data_var_name].isel(time=slice(start, end))
-            # put it in shared memory
-            shm, shape, dtype = create_shared_memory(data_chunk)
-            times = data_chunk.time.values
-            # create a partial function to pass to the multiprocessing pool
-            partial_process_chunk = partial(
-                process_chunk_shared, data_var_name, times, shm.name, shape, dtype
-            )
+            data_chunk = data_var.isel(time=slice(start, end))
+            with PeakMemorySampler() as processing_memory:
+                # put it in shared memory
+                shm, shape, dtype = create_shared_memory(data_chunk, planner.memory_budget)
+                times = data_chunk.time.values
+                # create a partial function to pass to the multiprocessing pool
+                partial_process_chunk = partial(
+                    process_chunk_pooled,
+                    weights_shm_name,
+                    data_var_name,
+                    times,
+                    shm.name,
+                    shape,
+                    dtype,
+                )
 
-            logger.debug(f"Processing variable: {data_var_name}")
-            # process the chunks of catchments in parallel
-            with multiprocessing.Pool(num_partitions) as pool:
-                variable_data = pool.map(partial_process_chunk, cat_chunks)
-            del partial_process_chunk
+                logger.debug(f"Processing variable: {data_var_name}")
+                # process the chunks of catchments in parallel
+                variable_data = pool.map(partial_process_chunk, range(num_cat_chunks))
+                del partial_process_chunk
             # clean up the shared memory
             shm.close()
             shm.unlink()
             logger.debug(f"Processed variable: {data_var_name}")
-            concatenated_da = xr.concat(variable_data, dim="catchment")
+            with PeakMemorySampler() as concat_memory:
+                concatenated_da = xr.concat(variable_data, dim="catchment")
+            # the shared block is already released here, add it back as it coexists in the
+            # pipeline model with the concatenated copy
+            shared_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            peak_memory = max(processing_memory.peak, concat_memory.peak + shared_bytes)
+            planner.record(end - start, peak_memory - baseline_memory, itemsize)
             # delete the data to free up memory
             del variable_data
             logger.debug(f"Concatenated variable: {data_var_name}")
@@ -394,7 +660,7 @@ def compute_zonal_stats(
         # Merge the chunks back together
         datasets = [
             xr.open_dataset(forcings_dir / "temp" / f"{data_var_name}_timechunk_{i}.nc")
-            for i in range(len(time_chunks))
+            for i in range(num_time_chunks)
         ]
         result = xr.concat(datasets, dim="time")
         result.to_netcdf(forcings_dir / "temp" / f"{data_var_name}.nc")
@@ -409,95 +675,582 @@ def compute_zonal_stats(
         description=f"Forcings processed in {time.perf_counter() - timer:2f} seconds",
     )
     progress.stop()
+
+
+@no_cluster
+def compute_zonal_stats(
+    gdf: gpd.GeoDataFrame,
+    gridded_data: xr.Dataset,
+    forcings_dir: Path,
+    memory_budget: Optional[float] = None,
+    output_name: str = "forcings.nc",
+) -> None:
+    """
+    Compute zonal statistics in parallel for all timesteps over all desired
+    catchments. Create chunks of catchments and within those, chunks of
+    timesteps for memory management.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        Contains identity and geometry information on desired catchments.
+    merged_data : xr.Dataset
+        Gridded forcing data that intersects with desired catchments.
+    forcings_dir : Path
+        Path to directory where outputs are to be stored.
+    memory_budget : float, optional
+        Memory in bytes each time chunk may use. Defaults to 80% of the
+        available memory, capped at 20 GB.
+    output_name : str, optional
+        Name of the NetCDF file written to forcings_dir.
+    """
+    logger.info("Computing zonal stats in parallel for all timesteps")
+    timer_start = time.time()
+    os.makedirs(forcings_dir / "temp", exist_ok=True)
+    num_partitions = multiprocessing.cpu_count() - 1
+    if num_partitions > len(gdf):
+        num_partitions = len(gdf)
+
+    # one pool is used for the whole job, spawning a pool re-imports geopandas and xarray
+    # in every worker which adds up quickly with many variables and time chunks
+    with multiprocessing.Pool(num_partitions) as pool:
+        catchments = get_cell_weights_parallel(gdf, gridded_data, num_partitions, pool=pool)
+        units = get_units(gridded_data)
+
+        cat_chunks: List[pd.DataFrame] = np.array_split(catchments, num_partitions)  # type: ignore
+        # the weights are loaded by each worker once, tasks only reference them by index
+        weights_shm = share_cat_chunks(cat_chunks)
+        planner = TimeChunkPlanner(
+            num_cells=gridded_data.sizes["x"] * gridded_data.sizes["y"],
+            num_catchments=catchments.index.nunique(),
+            max_cells_per_catchment=int(catchments.groupby(level=0).size().max()),
+            num_workers=num_partitions,
+            memory_budget=memory_budget,
+        )
+        try:
+            process_variables(
+                pool, weights_shm.name, len(cat_chunks), gridded_data, forcings_dir, planner
+            )
+        finally:
+            weights_shm.close()
+            weights_shm.unlink()
     logger.info(
         f"Forcing generation complete! Zonal stats computed in {time.time() - timer_start:2f} seconds"
     )
-    write_outputs(forcings_dir, units)
+    write_outputs(forcings_dir, units, output_name)
+
+
+def build_weight_matrix(
+    catchments: pd.DataFrame, num_cells: int
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Build a sparse matrix that turns a flattened raster into catchment means.
+
+    Parameters
+    ----------
+    catchments : pd.DataFrame
+        Cell weights indexed by divide_id, as returned by get_cell_weights.
+    num_cells : int
+        Number of raster cells (x * y) in one timestep of the gridded data.
+
+    Returns
+    -------
+    sparse.csr_matrix
+        Matrix of shape (catchment, cell). Each row holds the coverage of the
+        cells in that catchment divided by the catchment's total coverage, so
+        multiplying it with a (cell, time) raster gives the same weighted
+        means as weighted_sum_of_cells.
+    np.ndarray
+        The divide_id of each row.
+    """
+    codes, catchment_ids = pd.factorize(catchments.index)
+    coverage = catchments["coverage"].to_numpy(dtype=np.float64)
+    totals = np.bincount(codes, weights=coverage)
+    weights = sparse.csr_matrix(
+        (coverage / totals[codes], (codes, catchments["cell_id"].to_numpy())),
+        shape=(len(catchment_ids), num_cells),
+    )
+    return weights, np.asarray(catchment_ids)
+
+
+def reduce_block_to_catchments(block: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """Reduce a (time, y, x) block of gridded data to a (catchment, time) block of means."""
+    flat_block = block.reshape(block.shape[0], -1).astype(np.float64)
+    return np.asarray(weights @ flat_block.T)
+
+
+def get_cell_weights_dask(
+    gdf: gpd.GeoDataFrame, input_forcings: xr.Dataset, num_partitions: int
+) -> pd.DataFrame:
+    """
+    Same as get_cell_weights_parallel, but the chunks of gdf are processed as
+    dask tasks so they run wherever the cluster's workers are.
+    """
+    gdf_chunks = np.array_split(gdf, num_partitions)
+    wkt = gdf.crs.to_wkt()  # type: ignore
+    # wrapped once so the timestep is a single key in the graph rather than copied per task
+    one_timestep = input_forcings.isel(time=0).compute(scheduler=cluster_manager.scheduler)
+    one_timestep = dask.delayed(one_timestep, pure=True)
+    tasks = [dask.delayed(get_cell_weights)(one_timestep, chunk, wkt) for chunk in gdf_chunks]
+    return pd.concat(dask.compute(*tasks, scheduler=cluster_manager.scheduler))
 
 
 @use_cluster
-def write_outputs(forcings_dir: Path, units: dict) -> None:
+def compute_zonal_stats_dask(
+    gdf: gpd.GeoDataFrame,
+    gridded_data: xr.Dataset,
+    forcings_dir: Path,
+    output_name: str = "forcings.nc",
+    block_bytes: int = DASK_BLOCK_BYTES,
+) -> None:
+    """
+    Compute zonal statistics with dask arrays instead of shared memory and a
+    multiprocessing pool, so the work can run on a cluster of any size,
+    including a distributed scheduler spread over several machines.
+
+    The cell weights become one sparse matrix that is put in the graph once,
+    each worker receives it a single time. Every time block of each variable
+    is then reduced to catchment means with map_blocks.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        Contains identity and geometry information on desired catchments.
+    gridded_data : xr.Dataset
+        Gridded forcing data that intersects with desired catchments.
+    forcings_dir : Path
+        Path to directory where outputs are to be stored.
+    output_name : str, optional
+        Name of the NetCDF file written to forcings_dir.
+    block_bytes : int, optional
+        Approximate size of the time blocks of gridded data in each task.
+    """
+    logger.info("Computing zonal stats with dask for all timesteps")
+    timer_start = time.time()
+    os.makedirs(forcings_dir / "temp", exist_ok=True)
+    num_partitions = min(max(multiprocessing.cpu_count() - 1, 1), len(gdf))
+
+    catchments = get_cell_weights_dask(gdf, gridded_data, num_partitions)
+    units = get_units(gridded_data)
+    # the cell ids index the raster flattened in the order of its own dims
+    spatial_dims = [dim for dim in gridded_data[next(iter(gridded_data.data_vars))].dims]
+    spatial_dims.remove("time")
+    num_cells = int(np.prod([gridded_data.sizes[dim] for dim in spatial_dims]))
+    weights, catchment_ids = build_weight_matrix(catchments, num_cells)
+    weights = dask.delayed(weights, pure=True)
+
+    for data_var_name in list(gridded_data.data_vars):
+        data_var = gridded_data[data_var_name].transpose("time", *spatial_dims)
+        # each block needs whole timesteps, as the weights cover the whole raster
+        step_bytes = num_cells * data_var.dtype.itemsize
+        time_chunk = max(int(block_bytes // step_bytes), 1)
+        data = data_var.chunk({"time": time_chunk, **{dim: -1 for dim in spatial_dims}}).data
+        means = da.map_blocks(
+            reduce_block_to_catchments,
+            data,
+            weights,
+            dtype=np.float64,
+            drop_axis=[1, 2],
+            new_axis=[0],
+            chunks=((len(catchment_ids),), data.chunks[0]),
+        )
+        result = xr.DataArray(
+            means,
+            dims=["catchment", "time"],
+            coords={"catchment": catchment_ids, "time": data_var.time.values},
+        )
+        logger.debug(f"Processing variable: {data_var_name}")
+        # written lazily so the scheduler can be chosen, the cluster may be paused
+        result.to_dataset(name=data_var_name).to_netcdf(
+            forcings_dir / "temp" / f"{data_var_name}.nc", compute=False
+        ).compute(scheduler=cluster_manager.scheduler)
+        logger.debug(f"Processed variable: {data_var_name}")
+    logger.info(
+        f"Forcing generation complete! Zonal stats computed in {time.time() - timer_start:2f} seconds"
+    )
+    write_outputs(forcings_dir, units, output_name)
+
+
+def run_zonal_stats(
+    engine: str,
+    gdf: gpd.GeoDataFrame,
+    gridded_data: xr.Dataset,
+    forcings_dir: Path,
+    memory_budget: Optional[float] = None,
+    output_name: str = "forcings.nc",
+) -> None:
+    """Compute the zonal stats with the named engine, see ZONAL_STATS_ENGINES."""
+    if engine == "dask":
+        compute_zonal_stats_dask(gdf, gridded_data, forcings_dir, output_name=output_name)
+    else:
+        compute_zonal_stats(
+            gdf, gridded_data, forcings_dir, memory_budget=memory_budget, output_name=output_name
+        )
+
+
+def write_outputs(forcings_dir: Path, units: dict, output_name: str = "forcings.nc") -> None:
     """
-    Write outputs to disk in the form of a NetCDF file, using dask clusters to
-    facilitate parallel computing.
+    Write outputs to disk in the form of a NetCDF file, streaming one variable
+    at a time from the per-variable files in the temp folder.
 
     Parameters
     ----------
     forcings_dir : Path
         Path to directory where outputs are to be stored.
-    variables : dict
-        Preset dictionary where the keys are forcing variable names and the
-        values are units.
     units : dict
         Dictionary where the keys are forcing variable names and the values are
-        units. Differs from variables, as this dictionary depends on the gridded
-        forcing dataset.
+        units. Depends on the gridded forcing dataset.
+    output_name : str, optional
+        Name of the NetCDF file written to forcings_dir.
     """
     temp_forcings_dir = forcings_dir / "temp"
-    # Combine all variables into a single dataset using dask
-    results = [xr.open_dataset(file, chunks="auto") for file in temp_forcings_dir.glob("*.nc")]
-    final_ds = xr.merge(results)
-    for var in final_ds.data_vars:
-        if var in units:
-            final_ds[var].attrs["units"] = units[var]
-        else:
-            logger.warning(f"Variable {var} has no units")
+    results = [xr.open_dataset(file) for file in sorted(temp_forcings_dir.glob("*.nc"))]
+    logger.info("Saving to disk")
+    try:
+        stream_forcings_to_netcdf(results, units, forcings_dir / output_name)
+    finally:
+        # close the datasets
+        _ = [result.close() for result in results]
+
+    # clean up the temp files
+    for file in temp_forcings_dir.glob("*.*"):
+        file.unlink()
+    temp_forcings_dir.rmdir()
 
-    rename_dict = {}
 
-    final_ds = final_ds.rename_vars(rename_dict)
-    if "APCP_surface" in final_ds.data_vars:
-        final_ds = add_precip_rate_to_dataset(final_ds)
-    elif "precip_rate" in final_ds.data_vars:
-        final_ds = add_APCP_SURFACE_to_dataset(final_ds)
+def stream_forcings_to_netcdf(
+    datasets: List[xr.Dataset],
+    units: dict,
+    target_path: Path,
+    block_bytes: int = WRITE_BLOCK_BYTES,
+) -> None:
+    """
+    Write the catchment averaged forcings to a NetCDF file in the format ngen
+    expects, one variable at a time and in blocks of catchments, so the memory
+    used is bounded by block_bytes rather than catchments x timesteps.
 
-    # this step halves the storage size of the forcings
-    for var in final_ds.data_vars:
-        final_ds[var] = final_ds[var].astype(np.float32)
+    The format for the netcdf is to support a legacy format which is why it's
+    a little "unorthodox". There are no coordinates, just dimensions. Catchment
+    ids are stored in a 1d data var and time is stored in a 2d data var with the
+    same array of unix timestamps for every catchment.
+
+    Parameters
+    ----------
+    datasets : List[xr.Dataset]
+        Lazily opened datasets with (catchment, time) variables.
+    units : dict
+        Dictionary where the keys are forcing variable names and the values are
+        units.
+    target_path : Path
+        Path of the NetCDF file to write.
+    block_bytes : int, optional
+        Approximate size of each block of rows read and written at once.
+    """
+    variables: dict[str, xr.DataArray] = {}
+    for dataset in datasets:
+        for name, var in dataset.data_vars.items():
+            variables[str(name)] = var
+    if not variables:
+        raise ValueError(f"No forcing variables found to write to {target_path}")
+
+    first_var = next(iter(variables.values()))
+    catchment_ids = first_var["catchment"].values
+    for name, var in variables.items():
+        # every variable is computed from the same catchment chunks, this is just a safeguard
+        if not np.array_equal(var["catchment"].values, catchment_ids):
+            variables[name] = var.sel(catchment=catchment_ids)
+
+    # precipitation is written under both of the names used by the models
+    derived = None
+    if "APCP_surface" in variables:
+        derived = ("precip_rate", "APCP_surface", add_precip_rate_to_dataset)
+    elif "precip_rate" in variables:
+        derived = ("APCP_surface", "precip_rate", add_APCP_SURFACE_to_dataset)
 
-    logger.info("Saving to disk")
-    # The format for the netcdf is to support a legacy format
-    # which is why it's a little "unorthodox"
-    # There are no coordinates, just dimensions, catchment ids are stored in a 1d data var
-    # and time is stored in a 2d data var with the same time array for every catchment
-    # time is stored as unix timestamps, units have to be set
-    # add the catchment ids as a 1d data var
-    final_ds["ids"] = final_ds["catchment"].astype(str)
-    # time needs to be a 2d array of the same time array as unix timestamps for every catchment
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         time_array = (
-            final_ds.time.astype("datetime64[s]").astype(np.int64).values // 10**9
+            first_var["time"].values.astype("datetime64[ns]").astype(np.int64) // 10**9
         )  ## convert from ns to s
     time_array = time_array.astype(np.int32)  ## convert to int32 to save space
-    final_ds = final_ds.drop_vars(
-        ["catchment", "time"]
-    )  ## drop the original time and catchment vars
-    final_ds = final_ds.rename_dims({"catchment": "catchment-id"})  # rename the catchment dimension
-    # add the time as a 2d data var, yes this is wasting disk space.
-    final_ds["Time"] = (("catchment-id", "time"), [time_array for _ in range(len(final_ds["ids"]))])
-    # set the time unit
-    final_ds["Time"].attrs["units"] = "s"
-    final_ds["Time"].attrs["epoch_start"] = (
-        "01/01/1970 00:00:00"  # not needed but suppresses the ngen warning
-    )
 
-    final_ds.to_netcdf(forcings_dir / "forcings.nc", engine="netcdf4")
-    # close the datasets
-    _ = [result.close() for result in results]
-    final_ds.close()
+    num_catchments = len(catchment_ids)
+    num_times = len(time_array)
+    rows_per_block = max(block_bytes // max(num_times * 4, 1), 1)
+    row_blocks = [
+        (start, min(start + rows_per_block, num_catchments))
+        for start in range(0, num_catchments, rows_per_block)
+    ]
+    dims = ("catchment-id", "time")
+
+    with netCDF4.Dataset(target_path, "w", format="NETCDF4") as nc:
+        nc.createDimension("catchment-id", num_catchments)
+        nc.createDimension("time", num_times)
+
+        for name, var in variables.items():
+            if derived is not None and name == derived[0]:
+                # overwritten by the derived variable below
+                continue
+            output_var = nc.createVariable(name, "f4", dims, fill_value=np.nan)
+            if name in units:
+                output_var.units = units[name]
+            else:
+                logger.warning(f"Variable {name} has no units")
+            for start, end in row_blocks:
+                # this step halves the storage size of the forcings
+                block = var.isel(catchment=slice(start, end)).compute(
+                    scheduler=cluster_manager.scheduler
+                )
+                block = block.values.astype(np.float32)
+                output_var[start:end, :] = block
+
+        if derived is not None:
+            derived_name, source_name, add_derived_variable = derived
+            output_var = nc.createVariable(derived_name, "f4", dims, fill_value=np.nan)
+            derived_attrs = {}
+            for start, end in row_blocks:
+                source_block = (
+                    variables[source_name]
+                    .isel(catchment=slice(start, end))
+                    .compute(scheduler=cluster_manager.scheduler)
+                    .values
+                )
+                # converted in float64 and only rounded to float32 when written, so the
+                # derived values match converting the source values exactly
+                block_ds = add_derived_variable(
+                    xr.Dataset({source_name: (dims, source_block.astype(np.float64))})
+                )
+                output_var[start:end, :] = block_ds[derived_name].values.astype(np.float32)
+                derived_attrs = block_ds[derived_name].attrs
+            output_var.setncatts(derived_attrs)
+
+        ids_var = nc.createVariable("ids", str, ("catchment-id",))
+        ids_var[:] = catchment_ids.astype(str).astype(object)
+
+        # time needs to be a 2d array of the same time array as unix timestamps for every catchment
+        # yes this is wasting disk space, it's written from a broadcast view one block at a time
+        time_var = nc.createVariable("Time", "i4", dims)
+        # set the time unit
+        time_var.units = "s"
+        time_var.epoch_start = "01/01/1970 00:00:00"  # not needed but suppresses the ngen warning
+        for start, end in row_blocks:
+            time_var[start:end, :] = np.broadcast_to(time_array, (end - start, num_times))
+
+    logger.info(f"Wrote {len(variables)} forcing variables to {target_path}")
+
+
+def get_output_variable_names(data_vars: Iterable[Hashable]) -> Set[str]:
+    """Names of the forcing variables stream_forcings_to_netcdf writes for data_vars."""
+    names = {str(name) for name in data_vars}
+    # precipitation is written under both of the names used by the models
+    if "APCP_surface" in names:
+        names.add("precip_rate")
+    elif "precip_rate" in names:
+        names.add("APCP_surface")
+    return names
+
+
+def read_forcings_times(forcings_nc: Path) -> np.ndarray:
+    """Return the timesteps stored in a forcings file as datetime64[s]."""
+    with netCDF4.Dataset(forcings_nc) as nc:
+        # every row of Time holds the same array of unix timestamps
+        timestamps = np.asarray(nc["Time"][0, :], dtype=np.int64)
+    return timestamps.astype("datetime64[s]")
+
+
+def read_forcings_ids(forcings_nc: Path) -> np.ndarray:
+    """Return the catchment ids stored in a forcings file."""
+    with netCDF4.Dataset(forcings_nc) as nc:
+        return np.asarray(nc["ids"][:], dtype=str)
+
+
+def get_missing_time_ranges(
+    dataset: xr.Dataset, forcings_nc: Path, catchment_ids: List[str]
+) -> Optional[List[Tuple[str, Tuple[int, int]]]]:
+    """
+    Work out which timesteps of dataset are not yet in an existing forcings file.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Gridded forcing data covering the requested time range.
+    forcings_nc : Path
+        Existing forcings file.
+    catchment_ids : List[str]
+        Catchments the forcings are being generated for.
+
+    Returns
+    -------
+    Optional[List[Tuple[str, Tuple[int, int]]]]
+        ("before" | "after", (start index, end index)) for each range of
+        dataset that has to be computed. An empty list if the existing file
+        already covers the dataset, or None if the existing file can't be
+        extended and has to be regenerated.
+    """
+    existing_ids = read_forcings_ids(forcings_nc)
+    if set(existing_ids) != set(catchment_ids):
+        logger.warning("Existing forcings were generated for different catchments")
+        return None
+    with netCDF4.Dataset(forcings_nc) as nc:
+        existing_vars = set(nc.variables) - {"ids", "Time"}
+    # the parts are concatenated variable by variable, so both have to hold the same ones
+    requested_vars = get_output_variable_names(dataset.data_vars)
+    if existing_vars != requested_vars:
+        logger.warning(
+            f"Existing forcings have different variables: {sorted(existing_vars)}, "
+            f"requested {sorted(requested_vars)}"
+        )
+        return None
+
+    existing_times = read_forcings_times(forcings_nc)
+    requested_times = dataset.time.values.astype("datetime64[s]")
+    num_before = int(np.searchsorted(requested_times, existing_times[0], side="left"))
+    first_after = int(np.searchsorted(requested_times, existing_times[-1], side="right"))
+
+    # where the ranges overlap, the existing timesteps are served, so they have to line up
+    overlap = requested_times[num_before:first_after]
+    if not np.isin(overlap, existing_times).all():
+        logger.warning("Requested timesteps don't line up with the existing forcings")
+        return None
+    if num_before == 0 and first_after == len(requested_times):
+        return []
+
+    # the appended timesteps must have the existing file's spacing, so the step has to be
+    # known from at least one side; with a single timestep on both sides it can't be checked
+    requested_steps = np.unique(np.diff(requested_times))
+    if len(existing_times) > 1:
+        time_step = existing_times[1] - existing_times[0]
+    elif len(requested_steps) == 1:
+        time_step = requested_steps[0]
+    else:
+        logger.warning("Can't work out the timestep of the existing forcings")
+        return None
+    if len(requested_steps) > 1 or (len(requested_steps) == 1 and requested_steps[0] != time_step):
+        logger.warning("Requested timesteps don't match the spacing of existing forcings")
+        return None
+
+    missing = []
+    if num_before > 0:
+        # the new range has to join up with the existing one, otherwise there would be a gap
+        gap = existing_times[0] - requested_times[num_before - 1]
+        if gap != time_step:
+            logger.warning("Requested range doesn't join up with the start of existing forcings")
+            return None
+        missing.append(("before", (0, num_before)))
+    if first_after < len(requested_times):
+        gap = requested_times[first_after] - existing_times[-1]
+        if gap != time_step:
+            logger.warning("Requested range doesn't join up with the end of existing forcings")
+            return None
+        missing.append(("after", (first_after, len(requested_times))))
+    return missing
 
-    # clean up the temp files
-    for file in temp_forcings_dir.glob("*.*"):
-        file.unlink()
-    temp_forcings_dir.rmdir()
 
+def concat_forcings_files(
+    files: List[Path],
+    target_path: Path,
+    reference_index: int = 0,
+    block_bytes: int = WRITE_BLOCK_BYTES,
+) -> None:
+    """
+    Concatenate forcings files along the time dimension, streaming blocks of
+    catchment rows so the files never have to be loaded whole.
+
+    Parameters
+    ----------
+    files : List[Path]
+        Forcings files in time order.
+    target_path : Path
+        Path of the NetCDF file to write. May be one of the input files, the
+        output is written to a temporary file and renamed when complete.
+    reference_index : int, optional
+        Index of the file whose catchment order and attributes are used for the
+        output, the rows of the others are reordered to match.
+    block_bytes : int, optional
+        Approximate size of each block of rows read and written at once.
+    """
+    temp_path = target_path.with_name(target_path.name + ".saving.nc")
+    sources = [netCDF4.Dataset(file) for file in files]
+    try:
+        reference = sources[reference_index]
+        ids = np.asarray(reference["ids"][:], dtype=str)
+        # for each source, the row holding each catchment of the reference file
+        row_orders = []
+        for source in sources:
+            source_ids = np.asarray(source["ids"][:], dtype=str)
+            if np.array_equal(source_ids, ids):
+                row_orders.append(None)
+            else:
+                lookup = {cat_id: row for row, cat_id in enumerate(source_ids)}
+                row_orders.append(np.array([lookup[cat_id] for cat_id in ids]))
+        times = [np.asarray(source["Time"][0, :], dtype=np.int32) for source in sources]
+        time_array = np.concatenate(times)
+        offsets = np.cumsum([0] + [len(t) for t in times])
+
+        num_catchments = len(ids)
+        num_times = len(time_array)
+        rows_per_block = max(block_bytes // max(num_times * 4, 1), 1)
+        row_blocks = [
+            (start, min(start + rows_per_block, num_catchments))
+            for start in range(0, num_catchments, rows_per_block)
+        ]
+        variables = [name for name in reference.variables if name not in ("ids", "Time")]
 
-def setup_directories(cat_id: str) -> file_paths:
+        def read_rows(source_index: int, name: str, start: int, end: int) -> np.ndarray:
+            var = sources[source_index][name]
+            order = row_orders[source_index]
+            if order is None:
+                return var[start:end, :]
+            rows = order[start:end]
+            # netCDF4 wants increasing indices, read sorted and put back in order
+            sort = np.argsort(rows)
+            block = np.empty((len(rows), var.shape[1]), dtype=var.dtype)
+            block[sort] = var[rows[sort], :]
+            return block
+
+        with netCDF4.Dataset(temp_path, "w", format="NETCDF4") as nc:
+            nc.createDimension("catchment-id", num_catchments)
+            nc.createDimension("time", num_times)
+            dims = ("catchment-id", "time")
+            for name in variables:
+                source_var = reference[name]
+                output_var = nc.createVariable(name, "f4", dims, fill_value=np.nan)
+                output_var.setncatts(
+                    {k: source_var.getncattr(k) for k in source_var.ncattrs() if k != "_FillValue"}
+                )
+                for start, end in row_blocks:
+                    for i in range(len(sources)):
+                        output_var[start:end, offsets[i] : offsets[i + 1]] = read_rows(
+                            i, name, start, end
+                        )
+
+            ids_var = nc.createVariable("ids", str, ("catchment-id",))
+            ids_var[:] = ids.astype(object)
+            time_var = nc.createVariable("Time", "i4", dims)
+            time_var.units = "s"
+            # not needed but suppresses the ngen warning
+            time_var.epoch_start = "01/01/1970 00:00:00"
+            for start, end in row_blocks:
+                time_var[start:end, :] = np.broadcast_to(time_array, (end - start, num_times))
+    finally:
+        _ = [source.close() for source in sources]
+    os.replace(temp_path, target_path)
+    logger.info(f"Concatenated {len(files)} forcings files into {target_path}")
+
+
+def setup_directories(cat_id: str, keep_forcings: bool = False) -> file_paths:
     forcing_paths = file_paths(cat_id)
-    # delete everything in the forcing folder except the cached nc file
+    # delete everything in the forcing folder except the cached gridded data
+    # and, when extending them, the existing forcings
+    keep = {forcing_paths.cached_nc_file, forcing_paths.cached_zarr_store}
+    if keep_forcings:
+        keep.add(forcing_paths.forcings_nc_file)
     for file in forcing_paths.forcings_dir.glob("*.*"):
-        if file != forcing_paths.cached_nc_file:
+        if file in keep:
+            continue
+        if file.is_dir():
+            shutil.rmtree(file)
+        else:
             file.unlink()
 
     os.makedirs(forcing_paths.forcings_dir / "temp", exist_ok=True)
@@ -505,11 +1258,90 @@ def setup_directories(cat_id: str) -> file_paths:
     return forcing_paths
 
 
-def create_forcings(dataset: xr.Dataset, output_folder_name: str) -> None:
+def extend_forcings(
+    gdf: gpd.GeoDataFrame,
+    dataset: xr.Dataset,
+    forcing_paths: file_paths,
+    memory_budget: Optional[float] = None,
+    engine: str = "multiprocessing",
+) -> bool:
+    """
+    Extend an existing forcings.nc with the timesteps of dataset that it doesn't
+    contain yet, only computing zonal stats for the missing range(s).
+
+    Returns
+    -------
+    bool
+        True if the existing file was kept or extended, False if it can't be
+        extended and the forcings need to be generated from scratch.
+    """
+    forcings_nc = forcing_paths.forcings_nc_file
+    missing = get_missing_time_ranges(dataset, forcings_nc, list(gdf["divide_id"]))
+    if missing is None:
+        return False
+    if not missing:
+        logger.info(f"Requested time range is already in {forcings_nc}")
+        (forcing_paths.forcings_dir / "temp").rmdir()
+        return True
+
+    parts = {}
+    for label, (start, end) in missing:
+        logger.info(f"Computing forcings for {end - start} timesteps {label} the existing range")
+        part_name = f"forcings_{label}.nc"
+        run_zonal_stats(
+            engine,
+            gdf,
+            dataset.isel(time=slice(start, end)),
+            forcing_paths.forcings_dir,
+            memory_budget=memory_budget,
+            output_name=part_name,
+        )
+        parts[label] = forcing_paths.forcings_dir / part_name
+
+    files = [forcings_nc]
+    if "before" in parts:
+        files.insert(0, parts["before"])
+    if "after" in parts:
+        files.append(parts["after"])
+    # keep the catchment order of the existing file
+    concat_forcings_files(files, forcings_nc, reference_index=files.index(forcings_nc))
+    for part in parts.values():
+        part.unlink()
+    return True
+
+
+def create_forcings(
+    dataset: xr.Dataset,
+    output_folder_name: str,
+    memory_budget: Optional[float] = None,
+    incremental: bool = False,
+    engine: str = "multiprocessing",
+) -> None:
+    """
+    Generate forcings.nc for the catchments in the output folder's geopackage.
+
+    If incremental is True and forcings.nc already exists, only the timesteps
+    before and/or after the range already in the file are computed and
+    appended along the time dimension.
+
+    engine selects how the zonal stats are computed, "multiprocessing" uses
+    shared memory and a process pool, "dask" uses dask arrays on the cluster.
+    """
+    if engine not in ZONAL_STATS_ENGINES:
+        raise ValueError(
+            f"Unknown zonal stats engine {engine}, expected one of {ZONAL_STATS_ENGINES}"
+        )
     validate_dataset_format(dataset)
-    forcing_paths = setup_directories(output_folder_name)
+    forcing_paths = setup_directories(output_folder_name, keep_forcings=incremental)
     logger.debug(f"forcing path {output_folder_name} {forcing_paths.forcings_dir}")
     gdf = gpd.read_file(forcing_paths.geopackage_path, layer="divides")
     logger.debug(f"gdf  bounds: {gdf.total_bounds}")
     gdf = gdf.to_crs(dataset.crs)
-    compute_zonal_stats(gdf, dataset, forcing_paths.forcings_dir)
+    if incremental and forcing_paths.forcings_nc_file.exists():
+        if extend_forcings(gdf, dataset, forcing_paths, memory_budget=memory_budget, engine=engine):
+            return
+        logger.warning("Regenerating forcings for the full time range")
+        forcing_paths.forcings_nc_file.unlink()
+    run_zonal_stats(
+        engine, gdf, dataset, forcing_paths.forcings_dir, memory_budget=memory_budget
+    )
@@ -1,10 +1,15 @@
 import logging
 import sqlite3
 import struct
+import threading
+from contextlib import contextmanager
+from functools import cache
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
 
+import numpy as np
 import pyproj
+import shapely
 from data_processing.file_paths import file_paths
 from shapely.geometry import Point
 from shapely.geometry.base import BaseGeometry
@@ -28,6 +33,34 @@ class GeoPackage:
         self.conn.close()
 
 
+@contextmanager
+def temp_id_table(
+    con: sqlite3.Connection, ids: Iterable, name: str = "id_set"
+) -> Iterator[str]:
+    """
+    Bulk insert ids into a temporary table, to be used as
+    `WHERE x IN (SELECT id FROM <table>)` instead of formatting every id into
+    the sql. That is slow to parse for large subsets, can hit sqlite's limits
+    on expression size and makes every statement unique.
+
+    Args:
+        con (sqlite3.Connection): The connection the table is created on.
+        ids (Iterable): The ids, duplicates are ignored.
+        name (str): Name of the temporary table.
+
+    Yields:
+        str: The qualified name of the table, dropped when the block exits.
+    """
+    table = f'temp."{name}"'
+    con.execute(f"DROP TABLE IF EXISTS {table}")
+    con.execute(f'CREATE TEMP TABLE "{name}" (id PRIMARY KEY) WITHOUT ROWID')
+    con.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?)", ((x,) for x in ids))
+    try:
+        yield table
+    finally:
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+
+
 def verify_indices(gpkg: Path = file_paths.conus_hydrofabric) -> None:
     """
     Verify that the indices in the specified geopackage are correct.
@@ -149,19 +182,224 @@ def blob_to_centre_point(blob: bytes) -> Point | None:
     return Point(x, y)
 
 
+# envelope size in bytes for each envelope type in the gpkg header, types 5-7 are invalid
+GPKG_ENVELOPE_SIZES = np.array([0, 32, 48, 48, 64, -1, -1, -1])
+# every envelope type starts with minx, maxx, miny, maxy
+GPKG_XY_ENVELOPE = np.dtype([("minx", "<f8"), ("maxx", "<f8"), ("miny", "<f8"), ("maxy", "<f8")])
+
+
+def parse_gpkg_headers(blobs: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read the flags byte of every blob at once, see blob_to_geometry for the layout.
+
+    Returns:
+        np.ndarray: The length of each header in bytes.
+        np.ndarray: True where the geometry is empty.
+        np.ndarray: True where the header (srs id and envelope) is little endian.
+
+    Raises:
+        ValueError: If a blob has one of the invalid envelope types 5-7.
+    """
+    flags = np.fromiter((blob[3] for blob in blobs), dtype=np.uint8, count=len(blobs))
+    envelope_types = (flags & 14) >> 1
+    envelope_sizes = GPKG_ENVELOPE_SIZES[envelope_types]
+    invalid = envelope_sizes < 0
+    if invalid.any():
+        index = int(np.argmax(invalid))
+        raise ValueError(
+            f"Invalid envelope type {envelope_types[index]} in the header of geometry {index}"
+        )
+    empty = ((flags & 16) >> 4).astype(bool)
+    little_endian = (flags & 1).astype(bool)
+    header_lengths = 8 + envelope_sizes
+    return header_lengths, empty, little_endian
+
+
+def blobs_to_geometries(blobs: Sequence[bytes]) -> np.ndarray:
+    """
+    Batch version of blob_to_geometry. The headers are stripped using offsets
+    computed for all blobs at once and the WKB is decoded in a single
+    shapely.from_wkb call.
+
+    Args:
+        blobs (Sequence[bytes]): GeoPackage geometry blobs.
+
+    Returns:
+        np.ndarray: Object array of geometries, None where the geometry is empty.
+
+    Raises:
+        ValueError: If a blob has one of the invalid envelope types 5-7.
+    """
+    if len(blobs) == 0:
+        return np.array([], dtype=object)
+    header_lengths, empty, _ = parse_gpkg_headers(blobs)
+    wkb = np.array(
+        [blob[header_length:] for blob, header_length in zip(blobs, header_lengths.tolist())],
+        dtype=object,
+    )
+    wkb[empty] = None
+    return shapely.from_wkb(wkb)
+
+
+def blobs_to_centre_points(blobs: Sequence[bytes]) -> np.ndarray:
+    """
+    Batch version of blob_to_centre_point, the centres are computed from the
+    envelopes read as one structured array, without decoding the geometries.
+
+    Args:
+        blobs (Sequence[bytes]): GeoPackage geometry blobs.
+
+    Returns:
+        np.ndarray: Object array of points, None where the geometry is empty
+        or the blob has no envelope.
+    """
+    if len(blobs) == 0:
+        return np.array([], dtype=object)
+    header_lengths, empty, little_endian = parse_gpkg_headers(blobs)
+    has_envelope = (header_lengths > 8) & ~empty
+    # blobs without an envelope are padded so every row has the same layout
+    padding = bytes(GPKG_XY_ENVELOPE.itemsize)
+    envelopes = np.frombuffer(
+        b"".join(
+            blob[8:40] if usable else padding
+            for blob, usable in zip(blobs, has_envelope.tolist())
+        ),
+        dtype=GPKG_XY_ENVELOPE,
+    ).copy()
+    big_endian = ~little_endian & has_envelope
+    if big_endian.any():
+        envelopes[big_endian] = envelopes[big_endian].byteswap()
+    x = (envelopes["minx"] + envelopes["maxx"]) / 2
+    y = (envelopes["miny"] + envelopes["maxy"]) / 2
+    points = shapely.points(x, y)
+    points[~has_envelope] = None
+    return points
+
+
+@cache
+def get_transformer_to_5070() -> pyproj.Transformer:
+    """The lat/lon to EPSG:5070 transformer, built once per process."""
+    return pyproj.Transformer.from_crs("EPSG:4326", "EPSG:5070", always_xy=True)
+
+
 def convert_to_5070(shapely_geometry: Point) -> Point:
     # convert to web mercator
     if shapely_geometry.is_empty:
         return shapely_geometry
-    source_crs = pyproj.CRS("EPSG:4326")
-    target_crs = pyproj.CRS("EPSG:5070")
-    project = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True).transform
+    project = get_transformer_to_5070().transform
     new_geometry = transform(project, shapely_geometry)
     logger.debug(f" new geometry: {new_geometry}")
     logger.debug(f"old geometry: {shapely_geometry}")
     return new_geometry
 
 
+class CatchmentLocator:
+    """
+    Finds the divide containing each of a batch of points, keeping everything
+    it needs warm between calls: a read only connection to the hydrofabric,
+    and optionally an STRtree over every divide geometry, which takes a while
+    and a lot of memory to build so it is only loaded when first asked for.
+    """
+
+    def __init__(self, gpkg: Path = file_paths.conus_hydrofabric):
+        self.gpkg = gpkg
+        self._con: sqlite3.Connection | None = None
+        self._tree: shapely.STRtree | None = None
+        self._tree_ids: np.ndarray | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            self._con = sqlite3.connect(
+                sqlite_uri(self.gpkg, read_only=True), uri=True, check_same_thread=False
+            )
+        return self._con
+
+    def load_tree(self) -> None:
+        """Read every divide geometry and build the STRtree over them."""
+        logger.info(f"Building divide STRtree from {self.gpkg}")
+        rows = self.connection.execute("SELECT divide_id, geom FROM divides").fetchall()
+        ids = np.array([row[0] for row in rows], dtype=object)
+        geoms = blobs_to_geometries([row[1] for row in rows])
+        self._tree = shapely.STRtree(geoms)
+        self._tree_ids = ids
+
+    def get_candidates(
+        self, x: np.ndarray, y: np.ndarray, use_strtree: bool
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the divides whose bounding box contains each point, as arrays of
+        (point index, divide id, divide geometry), ordered by point index.
+        """
+        if use_strtree:
+            if self._tree is None:
+                self.load_tree()
+            point_idx, geom_idx = self._tree.query(shapely.points(x, y))  # type: ignore
+            order = np.argsort(point_idx, kind="stable")
+            point_idx, geom_idx = point_idx[order], geom_idx[order]
+            geoms = self._tree.geometries[geom_idx]  # type: ignore
+            return point_idx, self._tree_ids[geom_idx], geoms  # type: ignore
+
+        con = self.connection
+        con.execute("DROP TABLE IF EXISTS temp.query_points")
+        con.execute("CREATE TEMP TABLE query_points (i INTEGER PRIMARY KEY, x REAL, y REAL)")
+        con.executemany(
+            "INSERT INTO temp.query_points VALUES (?, ?, ?)",
+            zip(range(len(x)), x.tolist(), y.tolist()),
+        )
+        sql = """SELECT DISTINCT p.i, d.divide_id, d.geom
+                FROM temp.query_points p
+                JOIN rtree_divides_geom r
+                ON r.minx <= p.x AND r.maxx >= p.x AND r.miny <= p.y AND r.maxy >= p.y
+                JOIN divides d ON d.fid = r.id
+                ORDER BY p.i"""
+        rows = con.execute(sql).fetchall()
+        con.execute("DROP TABLE temp.query_points")
+        point_idx = np.array([row[0] for row in rows], dtype=np.int64)
+        ids = np.array([row[1] for row in rows], dtype=object)
+        geoms = blobs_to_geometries([row[2] for row in rows])
+        return point_idx, ids, geoms
+
+    def locate(
+        self, lngs: Sequence[float], lats: Sequence[float], use_strtree: bool = False
+    ) -> List[str | None]:
+        """
+        Return the divide_id containing each lng/lat point, or None if the point
+        isn't in any divide's bounding box. If a point is in several bounding
+        boxes but none of the geometries, the first candidate is returned.
+        """
+        x, y = get_transformer_to_5070().transform(
+            np.asarray(lngs, dtype=np.float64), np.asarray(lats, dtype=np.float64)
+        )
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        with self._lock:
+            point_idx, ids, geoms = self.get_candidates(x, y, use_strtree)
+        results: List[str | None] = [None] * len(x)
+        if len(point_idx) == 0:
+            return results
+        contains = shapely.contains_xy(geoms, x[point_idx], y[point_idx])
+        # candidates are ordered by point, take the first per point as the fallback
+        first = np.unique(point_idx, return_index=True)[1]
+        for i in first:
+            results[point_idx[i]] = ids[i]
+        # then overwrite with a containing divide, last write wins so iterate in reverse
+        for i in np.flatnonzero(contains)[::-1]:
+            results[point_idx[i]] = ids[i]
+        return results
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+
+@cache
+def get_catchment_locator() -> CatchmentLocator:
+    """The process wide CatchmentLocator for the CONUS hydrofabric."""
+    return CatchmentLocator(file_paths.conus_hydrofabric)
+
+
 def get_catid_from_point(coords: Dict[str, float]) -> str:
     """
     Retrieves the watershed boundary ID (catid) of the watershed that contains the given point.
@@ -178,81 +416,42 @@ def get_catid_from_point(coords: Dict[str, float]) -> str:
 
     """
     logger.info(f"Getting catid for {coords}")
-    q = file_paths.conus_hydrofabric
-    point = Point(coords["lng"], coords["lat"])
-    point = convert_to_5070(point)
-    with sqlite3.connect(q) as con:
-        sql = f"""SELECT DISTINCT d.divide_id, d.geom
-                FROM divides d
-                JOIN rtree_divides_geom r ON d.fid = r.id
-                WHERE r.minx <= {point.x} AND r.maxx >= {point.x}
-                AND r.miny <= {point.y} AND r.maxy >= {point.y}"""
-        results = con.execute(sql).fetchall()
-    if len(results) == 0:
+    catid = get_catchment_locator().locate([coords["lng"]], [coords["lat"]])[0]
+    if catid is None:
         raise IndexError(f"No watershed boundary found for {coords}")
-    if len(results) > 1:
-        # check the geometries to see which one contains the point
-        for result in results:
-            geom = blob_to_geometry(result[1])
-            if geom is None:
-                continue
-            if geom.contains(point):
-                return result[0]
-    return results[0][0]
+    return catid
 
 
-def create_rTree_table(table: str, con: sqlite3.Connection) -> None:
+def get_catids_from_points(
+    coords: List[Dict[str, float]], use_strtree: bool = False
+) -> List[str | None]:
     """
-    Create an rTree table for the specified table.
+    Batch version of get_catid_from_point, resolves every point in one call.
 
     Args:
-        table (str): The table name.
-        con (sqlite3.Connection): The database connection.
-    """
-    con.execute(
-        f'CREATE VIRTUAL TABLE "rtree_{table}_geom" USING rtree("id", "minx", "maxx", "miny", "maxy")'
-    )
-    con.commit()
-
+        coords (list): Dictionaries with "lat" and "lng" keys.
+        use_strtree (bool): Search an in memory STRtree of the divides rather than
+            the geopackage's rtree, the tree is built on first use and kept.
 
-def copy_rTree_tables(
-    table: str, ids: List[str], source_db: sqlite3.Connection, dest_db: sqlite3.Connection
-) -> None:
-    """
-    Copy rTree tables from source database to destination database.
-    This contains the spatial index for the specified table.
-    Copying it saves us from having to rebuild the index.
-    Args:
-        table (str): The table name.
-        ids (List[str]): The list of IDs.
-        source_db (sqlite3.Connection): The source database connection.
-        dest_db (sqlite3.Connection): The destination database connection.
+    Returns:
+        list: The catid for each point, None where no watershed boundary was found.
     """
-    rTree_table = f"rtree_{table}_geom"
+    lngs = [point["lng"] for point in coords]
+    lats = [point["lat"] for point in coords]
+    return get_catchment_locator().locate(lngs, lats, use_strtree=use_strtree)
 
-    create_rTree_table(table, dest_db)
 
-    geom_data = source_db.execute(
-        f"SELECT * FROM {rTree_table} WHERE id in ({','.join(ids)})"
-    ).fetchall()
-    insert_data(dest_db, rTree_table, geom_data)
-
-
-def insert_data(con: sqlite3.Connection, table: str, contents: List[Tuple]) -> None:
+def create_rTree_table(table: str, con: sqlite3.Connection) -> None:
     """
-    Insert data into the specified table.
+    Create an rTree table for the specified table.
 
     Args:
-        con (sqlite3.Connection): The database connection.
         table (str): The table name.
-        contents (List[Tuple]): The data to be inserted.
+        con (sqlite3.Connection): The database connection.
     """
-    if len(contents) == 0:
-        return
-
-    logger.debug(f"Inserting {table}")
-    placeholders = ",".join("?" * len(contents[0]))
-    con.executemany(f"INSERT INTO '{table}' VALUES ({placeholders})", contents)
+    con.execute(
+        f'CREATE VIRTUAL TABLE "rtree_{table}_geom" USING rtree("id", "minx", "maxx", "miny", "maxy")'
+    )
     con.commit()
 
 
@@ -291,6 +490,54 @@ def update_geopackage_metadata(gpkg: Path) -> None:
     con.close()
 
 
+def sqlite_uri(path: Path, read_only: bool = False) -> str:
+    """
+    Build the URI to open path with sqlite3.connect(..., uri=True).
+
+    The path is percent-encoded, a plain f"file:{path}" would treat ?, # and %
+    in the file name as the start of the query, the fragment or an escape.
+
+    Args:
+        path (Path): The database file.
+        read_only (bool): Open the database with mode=ro.
+    """
+    uri = Path(path).resolve().as_uri()
+    return f"{uri}?mode=ro" if read_only else uri
+
+
+def open_subset_connection(subset_gpkg_name: Path, hydrofabric: Path) -> sqlite3.Connection:
+    """
+    Open the subset geopackage with the hydrofabric attached read only as the
+    "source" schema, so rows can be copied with INSERT INTO ... SELECT without
+    passing through python.
+    """
+    dest_db = sqlite3.connect(sqlite_uri(subset_gpkg_name), uri=True)
+    dest_db.execute("ATTACH DATABASE ? AS source", (sqlite_uri(hydrofabric, read_only=True),))
+    return dest_db
+
+
+def copy_rTree_rows(table: str, dest_db: sqlite3.Connection) -> None:
+    """
+    Copy the rTree rows of every feature already copied to table from the
+    attached source database, see open_subset_connection.
+    This contains the spatial index for the specified table.
+    Copying it saves us from having to rebuild the index.
+    Args:
+        table (str): The table name.
+        dest_db (sqlite3.Connection): The destination database connection.
+    """
+    rTree_table = f"rtree_{table}_geom"
+
+    create_rTree_table(table, dest_db)
+
+    # the feature ids are copied unchanged, so they still match the source rTree
+    dest_db.execute(
+        f"""INSERT INTO main."{rTree_table}"
+        SELECT r.* FROM main."{table}" t JOIN source."{rTree_table}" r ON r.id = t.rowid"""
+    )
+    dest_db.commit()
+
+
 def subset_table_by_vpu(table: str, vpu: str, hydrofabric: Path, subset_gpkg_name: Path) -> None:
     """
     Subset the specified table from the hydrofabric database by vpuid and save it to the subset geopackage.
@@ -303,8 +550,7 @@ def subset_table_by_vpu(table: str, vpu: str, hydrofabric: Path, subset_gpkg_nam
         subset_gpkg_name (Path): The name of the subset geopackage.
     """
     logger.debug(f"Subsetting {table} in {subset_gpkg_name}")
-    source_db = sqlite3.connect(f"file:{hydrofabric}?mode=ro", uri=True)
-    dest_db = sqlite3.connect(subset_gpkg_name)
+    dest_db = open_subset_connection(subset_gpkg_name, hydrofabric)
 
     if vpu == "03":
         vpus = ["03N", "03S", "03W"]
@@ -313,35 +559,36 @@ def subset_table_by_vpu(table: str, vpu: str, hydrofabric: Path, subset_gpkg_nam
     else:
         vpus = [vpu]
 
-    vpus = [f"'{x}'" for x in vpus]
+    placeholders = ",".join("?" * len(vpus))
     # in hf v2.2 every table has a vpuid column so subsetting is much easier
-    sql_query = f"SELECT * FROM '{table}' WHERE vpuid IN ({','.join(vpus)})"
-    contents = source_db.execute(sql_query).fetchall()
+    where = f"vpuid IN ({placeholders})"
+    params = list(vpus)
 
     if table == "network":
-        # Look for the network entry that has a toid not in the flowpath or nexus tables
-        network_toids = [x[2] for x in contents]
-        logger.debug(f"Network toids: {len(network_toids)}")
-        sql = "SELECT id FROM flowpaths"
-        flowpath_ids = [x[0] for x in dest_db.execute(sql).fetchall()]
-        logger.debug(f"Flowpath ids: {len(flowpath_ids)}")
-        sql = "SELECT id FROM nexus"
-        nexus_ids = [x[0] for x in dest_db.execute(sql).fetchall()]
-        logger.debug(f"Nexus ids: {len(nexus_ids)}")
-        bad_ids = set(network_toids) - set(flowpath_ids + nexus_ids)
-        logger.debug(bad_ids)
-        logger.info(f"Removing {len(bad_ids)} network entries that are not in flowpaths or nexuses")
-        # id column is second after fid
-        contents = [x for x in contents if x[1] not in bad_ids]
-
-    insert_data(dest_db, table, contents)
+        # Look for the network entries that have a toid not in the flowpath or nexus tables
+        dest_db.execute("DROP TABLE IF EXISTS temp.bad_toids")
+        dest_db.execute(
+            f"""CREATE TEMP TABLE bad_toids AS
+            SELECT DISTINCT toid FROM source.network WHERE vpuid IN ({placeholders})
+            EXCEPT SELECT id FROM main.flowpaths
+            EXCEPT SELECT id FROM main.nexus""",
+            params,
+        )
+        num_bad_ids = dest_db.execute("SELECT COUNT(*) FROM temp.bad_toids").fetchone()[0]
+        logger.info(f"Removing {num_bad_ids} network entries that are not in flowpaths or nexuses")
+        # IS rather than = so a null toid also matches a null id, like a python set would
+        where += " AND NOT EXISTS (SELECT 1 FROM temp.bad_toids b WHERE b.toid IS n.id)"
+
+    logger.debug(f"Inserting {table}")
+    dest_db.execute(
+        f'INSERT INTO main."{table}" SELECT n.* FROM source."{table}" n WHERE {where}', params
+    )
+    dest_db.commit()
 
     if table in get_feature_tables(file_paths.conus_hydrofabric):
-        fids = [str(x[0]) for x in contents]
-        copy_rTree_tables(table, fids, source_db, dest_db)
+        copy_rTree_rows(table, dest_db)
 
     dest_db.commit()
-    source_db.close()
     dest_db.close()
 
 
@@ -356,45 +603,37 @@ def subset_table(table: str, ids: List[str], hydrofabric: Path, subset_gpkg_name
         subset_gpkg_name (str): The name of the subset geopackage.
     """
     logger.debug(f"Subsetting {table} in {subset_gpkg_name}")
-    source_db = sqlite3.connect(f"file:{hydrofabric}?mode=ro", uri=True)
-    dest_db = sqlite3.connect(subset_gpkg_name)
+    dest_db = open_subset_connection(subset_gpkg_name, hydrofabric)
 
     table_keys = {"divide-attributes": "divide_id", "lakes": "poi_id"}
-
-    if table == "lakes":
-        # lakes subset we get from the pois table which was already subset by water body id
-        sql_query = "SELECT poi_id FROM 'pois'"
-        contents = dest_db.execute(sql_query).fetchall()
-        ids = [str(x[0]) for x in contents]
-
-    if table == "divide-attributes":
-        # get the divide ids from the divides that have been subset already
-        sql_query = "SELECT divide_id FROM 'divides'"
-        contents = dest_db.execute(sql_query).fetchall()
-        ids = [str(x[0]) for x in contents]
-
-    if table == "nexus":
-        # add the nexuses in the toid column from the flowpaths table
-        sql_query = "SELECT toid FROM 'flowpaths'"
-        contents = dest_db.execute(sql_query).fetchall()
-        new_ids = [str(x[0]) for x in contents]
-        ids.extend(new_ids)
-
-    ids = [f"'{x}'" for x in ids]
     key_name = "id"
     if table in table_keys:
         key_name = table_keys[table]
-    sql_query = f"SELECT * FROM '{table}' WHERE {key_name} IN ({','.join(ids)})"
-    contents = source_db.execute(sql_query).fetchall()
 
-    insert_data(dest_db, table, contents)
+    with temp_id_table(dest_db, ids) as id_table:
+        if table == "lakes":
+            # lakes subset we get from the pois table which was already subset by water body id
+            id_query = "SELECT poi_id FROM main.pois"
+        elif table == "divide-attributes":
+            # get the divide ids from the divides that have been subset already
+            id_query = "SELECT divide_id FROM main.divides"
+        else:
+            id_query = f"SELECT id FROM {id_table}"
+        if table == "nexus":
+            # add the nexuses in the toid column from the flowpaths table
+            dest_db.execute(f"INSERT OR IGNORE INTO {id_table} SELECT toid FROM main.flowpaths")
+
+        logger.debug(f"Inserting {table}")
+        dest_db.execute(
+            f'INSERT INTO main."{table}" SELECT * FROM source."{table}" '
+            f"WHERE {key_name} IN ({id_query})"
+        )
+        dest_db.commit()
 
     if table in get_feature_tables(file_paths.conus_hydrofabric):
-        fids = [str(x[0]) for x in contents]
-        copy_rTree_tables(table, fids, source_db, dest_db)
+        copy_rTree_rows(table, dest_db)
 
     dest_db.commit()
-    source_db.close()
     dest_db.close()
 
 
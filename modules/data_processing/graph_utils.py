@@ -1,42 +1,82 @@
+import json
 import logging
+import os
+import shutil
 import sqlite3
-from functools import cache
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional, Set, Union
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
 
 import igraph as ig
+import numpy as np
+import pandas as pd
 from data_processing.file_paths import file_paths
+from data_processing.gpkg_utils import temp_id_table
 
 logger = logging.getLogger(__name__)
 
 
-def get_from_to_id_pairs(
+def get_network_dataframe(
     hydrofabric: Path = file_paths.conus_hydrofabric, ids: Optional[Set | List] = None
-) -> List[tuple]:
+) -> pd.DataFrame:
     """
-    Retrieves the from and to IDs from the specified hydrofabric.
-
-    This function reads the from and to IDs from the specified hydrofabric and returns them as a list of tuples.
+    Reads the id, toid and divide_id columns of the network table into a DataFrame,
+    without duplicate rows.
 
     Args:
         hydrofabric (Path, optional): The file path to the hydrofabric. Defaults to file_paths.conus_hydrofabric.
         ids (Set, optional): A set of IDs to filter the results. Defaults to None.
     Returns:
-        List[tuple]: A list of tuples containing the from and to IDs.
+        pd.DataFrame: The id, toid and divide_id of each network entry.
     """
     sql_query = "SELECT id, toid, divide_id FROM network WHERE id IS NOT NULL"
-    if ids:
-        ids = [f"'{x}'" for x in ids]
-        sql_query = f"{sql_query} AND id IN ({','.join(ids)}) AND toid IN ({','.join(ids)})"
     try:
         con = sqlite3.connect(str(hydrofabric.absolute()))
-        edges = con.execute(sql_query).fetchall()
+        if ids:
+            with temp_id_table(con, ids) as id_table:
+                sql_query = (
+                    f"{sql_query} AND id IN (SELECT id FROM {id_table})"
+                    f" AND toid IN (SELECT id FROM {id_table})"
+                )
+                network = pd.read_sql_query(sql_query, con)
+        else:
+            network = pd.read_sql_query(sql_query, con)
         con.close()
-    except sqlite3.Error as e:
+    # pandas wraps sqlite errors in its own DatabaseError
+    except Exception as e:
         logger.error(f"SQLite error: {e}")
         raise
-    unique_edges = list(set(edges))
-    return unique_edges
+    return network.drop_duplicates(ignore_index=True)
+
+
+def build_network_arrays(
+    hydrofabric: Path,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the network table into the vertex and edge arrays of the graph.
+
+    Returns:
+        np.ndarray: Name of each vertex, e.g. wb-121.
+        np.ndarray: Catchment of each vertex, e.g. cat-121, or None.
+        np.ndarray: Vertex index each edge flows from.
+        np.ndarray: Vertex index each edge flows to.
+    """
+    network = get_network_dataframe(hydrofabric)
+    # entries without a toid don't flow anywhere, they are vertices but not edges
+    edges = network.dropna(subset=["toid"]).drop_duplicates(["id", "toid"])
+    num_edges = len(edges)
+    # factorize every id in one call, the edge ends come first so their codes are the edges
+    codes, names = pd.factorize(
+        pd.concat([edges["id"], edges["toid"], network["id"]], ignore_index=True)
+    )
+    sources = codes[:num_edges].astype(np.int32)
+    targets = codes[num_edges : 2 * num_edges].astype(np.int32)
+    # when an id has more than one divide_id, the last one read is kept
+    cat_by_id = network.drop_duplicates("id", keep="last").set_index("id")["divide_id"]
+    cats = cat_by_id.reindex(names).astype(object)
+    cats = cats.where(cats.notna(), None).to_numpy()
+    return np.asarray(names, dtype=object), cats, sources, targets
 
 
 def create_graph_from_gpkg(hydrofabric: Path) -> ig.Graph:
@@ -52,64 +92,369 @@ def create_graph_from_gpkg(hydrofabric: Path) -> ig.Graph:
         ig.Graph: The hydrological network graph.
     """
     logger.info("Building network graph")
-    network = get_from_to_id_pairs(hydrofabric)
-    # this is such a mess, if someone knows igraph better, please save me
-    # trying to reduce looping and O(n) lookups as much as possible
-    vertices = set()
-    cats = dict()
-    edges = set()
-    for id, toid, cat in network:
-        vertices.add(id)
-        vertices.add(toid)
-        edges.add((id, toid))
-        cats[id] = cat
-    vertices = list(vertices)
-    # loop over this once to create an index lookup, built the cat list while we're at it
-    vert_dict = dict()
-    vert_cats = list()
-    for i, v in enumerate(vertices):
-        vert_dict[v] = i
-        vert_cats.append(cats.get(v, None))
-
-    edge_list = list()
-
-    # build the edge list using the index lookup dict
-    for w, n in edges:
-        edge = (vert_dict[w], vert_dict[n])
-        edge_list.append(edge)
-
+    names, cats, sources, targets = build_network_arrays(hydrofabric)
     # edges [(0,1),(0,2)...]
     # vertex_attrs dict = {"name":["wb-121","wb-121"...], "cat":["cat-121","cat-121"...]]
-    attrs = {"name": vertices, "cat": vert_cats}
-    graph = ig.Graph(edges=edge_list, directed=True, vertex_attrs=attrs)
-    return graph
+    attrs = {"name": names.tolist(), "cat": cats.tolist()}
+    edges = np.column_stack([sources, targets]).tolist()
+    return ig.Graph(n=len(names), edges=edges, directed=True, vertex_attrs=attrs)
+
+
+# bump when the layout of the files in the graph cache changes
+GRAPH_CACHE_VERSION = 1
+GRAPH_CACHE_ARRAYS = (
+    "sources",
+    "targets",
+    "up_indptr",
+    "up_indices",
+    "down_indptr",
+    "down_indices",
+    "names",
+    "cats",
+)
+
+
+def get_hydrofabric_signature(hydrofabric: Path) -> Dict[str, int]:
+    """Identifies a version of the hydrofabric, the graph cache is rebuilt when it changes."""
+    stat = hydrofabric.stat()
+    return {
+        "version": GRAPH_CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def encode_string_table(strings: Sequence[str | None]) -> np.ndarray:
+    """Join strings into one newline separated utf-8 array, None is stored as empty."""
+    joined = "\n".join(string or "" for string in strings)
+    return np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+
+
+def decode_string_table(table: np.ndarray) -> np.ndarray:
+    """Inverse of encode_string_table, empty strings become None."""
+    if table.size == 0:
+        return np.array([], dtype=object)
+    strings = table.tobytes().decode("utf-8").split("\n")
+    return np.array([string or None for string in strings], dtype=object)
+
+
+def save_graph_cache(index: "UpstreamIndex", cache_dir: Path, hydrofabric: Path) -> None:
+    """
+    Write the network as .npy arrays plus string tables to cache_dir. The
+    folder is written next to the target and renamed into place, so readers
+    never see a partial cache.
+    """
+    temp_dir = cache_dir.with_name(f"{cache_dir.name}.{os.getpid()}.tmp")
+    if temp_dir.exists():
+        shutil.rmtree(temp_dir)
+    temp_dir.mkdir(parents=True)
+    arrays = {
+        "sources": index.sources,
+        "targets": index.targets,
+        "up_indptr": index.up_indptr,
+        "up_indices": index.up_indices,
+        "down_indptr": index.down_indptr,
+        "down_indices": index.down_indices,
+        "names": encode_string_table(index.names.tolist()),
+        "cats": encode_string_table(index.cats.tolist()),
+    }
+    for name, array in arrays.items():
+        np.save(temp_dir / f"{name}.npy", np.ascontiguousarray(array))
+    with open(temp_dir / "signature.json", "w") as f:
+        json.dump(get_hydrofabric_signature(hydrofabric), f)
+    try:
+        if cache_dir.exists():
+            shutil.rmtree(cache_dir)
+        os.rename(temp_dir, cache_dir)
+    except OSError as e:
+        # another process building the cache at the same time can win the swap
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if load_graph_cache(cache_dir, hydrofabric) is None:
+            raise
+        logger.info(f"Network graph cache was already written to {cache_dir} ({e})")
+        return
+    logger.info(f"Saved network graph cache to {cache_dir}")
 
 
-@cache
-def get_graph() -> ig.Graph:
+def load_graph_cache(cache_dir: Path, hydrofabric: Path) -> Optional["UpstreamIndex"]:
+    """
+    Load the graph cache, memory mapping the numeric arrays so they are shared
+    between processes through the page cache. Returns None if there is no
+    cache or it was built from a different hydrofabric.
     """
-    Attempts to load a graph from a pickled file; if unavailable, creates it from the geopackage.
+    signature_file = cache_dir / "signature.json"
+    if not signature_file.exists():
+        return None
+    try:
+        with open(signature_file) as f:
+            signature = json.load(f)
+        if signature != get_hydrofabric_signature(hydrofabric):
+            logger.info("Hydrofabric has changed, rebuilding the network graph cache")
+            return None
+        arrays = {
+            name: np.load(cache_dir / f"{name}.npy", mmap_mode="r") for name in GRAPH_CACHE_ARRAYS
+        }
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unable to load the network graph cache, rebuilding it: {e}")
+        return None
+    return UpstreamIndex(
+        decode_string_table(arrays["names"]),
+        decode_string_table(arrays["cats"]),
+        arrays["sources"],
+        arrays["targets"],
+        csr=(
+            arrays["up_indptr"],
+            arrays["up_indices"],
+            arrays["down_indptr"],
+            arrays["down_indices"],
+        ),
+    )
+
+
+def build_graph_cache(
+    hydrofabric: Path = file_paths.conus_hydrofabric,
+    cache_dir: Path = file_paths.hydrofabric_graph_cache,
+) -> "UpstreamIndex":
+    """
+    Build the network graph from the hydrofabric and write it to the graph cache.
 
-    This function first checks if a pickled version of the graph exists. If not, it creates a new graph
-    by reading hydrological data from a geopackage file and then pickles the newly created graph for future use.
+    Args:
+        hydrofabric (Path, optional): The file path to the hydrofabric. Defaults to file_paths.conus_hydrofabric.
+        cache_dir (Path, optional): The graph cache folder. Defaults to file_paths.hydrofabric_graph_cache.
+
+    Returns:
+        UpstreamIndex: The index the cache was written from.
+    """
+    logger.info("Building network graph")
+    index = UpstreamIndex(*build_network_arrays(hydrofabric))
+    save_graph_cache(index, cache_dir, hydrofabric)
+    return index
+
+
+_upstream_index: Optional["UpstreamIndex"] = None
+_graph: Optional[ig.Graph] = None
+_graph_lock = threading.RLock()
+
+
+def get_upstream_index() -> "UpstreamIndex":
+    """
+    The process wide UpstreamIndex. Loaded from the graph cache, which is
+    built from the geopackage if it's missing or the hydrofabric has changed.
+    Concurrent first calls wait for the same load instead of each doing it.
+    """
+    global _upstream_index
+    with _graph_lock:
+        if _upstream_index is None:
+            cache_dir = file_paths.hydrofabric_graph_cache
+            hydrofabric = file_paths.conus_hydrofabric
+            index = load_graph_cache(cache_dir, hydrofabric)
+            if index is None:
+                logger.debug("Graph cache does not exist, creating a new graph.")
+                index = build_graph_cache(hydrofabric, cache_dir)
+            _upstream_index = index
+        return _upstream_index
+
+
+def get_graph() -> ig.Graph:
+    """
+    Returns the network as an igraph Graph, built from the graph cache.
 
     Returns:
         ig.Graph: The hydrological network graph.
     """
-    pickled_graph_path = file_paths.hydrofabric_graph
-    if not pickled_graph_path.exists():
-        logger.debug("Graph pickle does not exist, creating a new graph.")
-        network_graph = create_graph_from_gpkg(file_paths.conus_hydrofabric)
-        network_graph.write_pickle(pickled_graph_path)
-    else:
-        try:
-            network_graph = ig.Graph.Read_Pickle(pickled_graph_path)
-        except Exception as e:
-            logger.error(f"Error loading graph pickle: {e}")
-            raise
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            index = get_upstream_index()
+            edges = np.column_stack([index.sources, index.targets]).tolist()
+            attrs = {"name": index.names.tolist(), "cat": index.cats.tolist()}
+            _graph = ig.Graph(
+                n=len(index.names), edges=edges, directed=True, vertex_attrs=attrs
+            )
+            logger.debug(_graph.summary())
+        return _graph
+
+
+class UpstreamIndex:
+    """
+    Compact index of the network graph for upstream queries.
 
-    logger.debug(network_graph.summary())
-    return network_graph
+    Vertices are integers, names are looked up once through a dict, and the
+    edges are stored twice as CSR adjacency in numpy arrays: reversed (every
+    vertex's upstream neighbours) for the traversals and forward for the
+    downstream lookups. Traversals work on arrays of vertex indices, names
+    are only looked up for the final result.
+    """
+
+    # closures at least this big are kept, the large outlets are what people click on
+    MEMO_MIN_SIZE = 10_000
+    MEMO_MAX_ENTRIES = 64
+
+    def __init__(
+        self,
+        names: np.ndarray,
+        cats: np.ndarray,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        csr: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+    ):
+        """
+        Args:
+            names (np.ndarray): Name of each vertex, e.g. wb-121.
+            cats (np.ndarray): Catchment of each vertex, e.g. cat-121, or None.
+            sources (np.ndarray): Vertex index each edge flows from.
+            targets (np.ndarray): Vertex index each edge flows to.
+            csr (tuple, optional): Precomputed (up_indptr, up_indices, down_indptr,
+                down_indices), e.g. from the graph cache. Built from the edges if not given.
+        """
+        self.names = names
+        self.cats = cats
+        self.sources = sources
+        self.targets = targets
+        num_vertices = len(names)
+        if csr is None:
+            self.up_indptr, self.up_indices = build_csr(targets, sources, num_vertices)
+            self.down_indptr, self.down_indices = build_csr(sources, targets, num_vertices)
+        else:
+            self.up_indptr, self.up_indices, self.down_indptr, self.down_indices = csr
+        self.name_to_index: Dict[str, int] = {name: i for i, name in enumerate(names.tolist())}
+        # vs.find(cat=...) returns the first vertex with that cat, reversed so the first wins
+        self.cat_to_index: Dict[str, int] = {
+            cat: i for i, cat in reversed(list(enumerate(cats.tolist()))) if cat is not None
+        }
+        self._memo: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_graph(cls, graph: ig.Graph) -> "UpstreamIndex":
+        edges = np.array(graph.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+        return cls(
+            np.array(graph.vs["name"], dtype=object),
+            np.array(graph.vs["cat"], dtype=object),
+            edges[:, 0],
+            edges[:, 1],
+        )
+
+    def find(self, name: str) -> int:
+        """Vertex index of a wb/nex name, or of the vertex for a cat id. Raises KeyError."""
+        if "cat" in name:
+            return self.cat_to_index[name]
+        return self.name_to_index[name]
+
+    def downstream(self, index: int) -> int | None:
+        """First vertex downstream of index, or None at an outlet."""
+        start, end = self.down_indptr[index], self.down_indptr[index + 1]
+        if start == end:
+            return None
+        return int(self.down_indices[start])
+
+    def upstream(
+        self, sources: Sequence[int] | np.ndarray, stop: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Breadth first search against the flow from every source at once.
+
+        Args:
+            sources (Sequence[int]): Vertex indices to search from.
+            stop (np.ndarray, optional): Boolean mask of vertices that are included
+                in the result when reached, but not searched past.
+
+        Returns:
+            np.ndarray: Sorted indices of every vertex upstream of any source, including them.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        visited = np.zeros(len(self.names), dtype=bool)
+        visited[sources] = True
+        frontier = sources
+        while len(frontier):
+            if stop is None:
+                # a memoized closure would include what is above the stopped vertices
+                frontier = self.use_memo(frontier, visited)
+            counts = self.up_indptr[frontier + 1] - self.up_indptr[frontier]
+            total = int(counts.sum())
+            if total == 0:
+                break
+            # positions of every upstream neighbour of the frontier in up_indices
+            offsets = np.repeat(self.up_indptr[frontier] - np.cumsum(counts) + counts, counts)
+            neighbours = self.up_indices[offsets + np.arange(total)]
+            neighbours = np.unique(neighbours[~visited[neighbours]])
+            visited[neighbours] = True
+            frontier = neighbours if stop is None else neighbours[~stop[neighbours]]
+        closure = np.flatnonzero(visited)
+        if stop is None and len(sources) == 1 and len(closure) >= self.MEMO_MIN_SIZE:
+            self.remember(int(sources[0]), closure)
+        return closure
+
+    def upstream_by_source(self, sources: Sequence[int] | np.ndarray) -> Dict[int, np.ndarray]:
+        """
+        Upstream closure of each source, sharing the traversal between them.
+
+        Each source is only searched up to the other sources, so every vertex is
+        visited about once however many sources share it. The closure of a source
+        is then its own region plus the closures of the sources it reached.
+
+        Returns:
+            Dict[int, np.ndarray]: Sorted indices upstream of each source, including it.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        is_source = np.zeros(len(self.names), dtype=bool)
+        is_source[sources] = True
+        regions: Dict[int, np.ndarray] = {}
+        reached: Dict[int, List[int]] = {}
+        for source in sources.tolist():
+            region = self.upstream([source], stop=is_source)
+            regions[source] = region
+            reached[source] = [i for i in region[is_source[region]].tolist() if i != source]
+
+        # merge the closures depth first, the sources furthest upstream first
+        closures: Dict[int, np.ndarray] = {}
+        for source in sources.tolist():
+            stack = [source]
+            started = set()
+            while stack:
+                current = stack[-1]
+                if current in closures:
+                    stack.pop()
+                    continue
+                # sources already started are skipped, so a cycle can't loop forever
+                pending = [i for i in reached[current] if i not in closures and i not in started]
+                started.add(current)
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                parts = [regions[current]]
+                parts += [closures.get(i, regions[i]) for i in reached[current]]
+                closures[current] = np.unique(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+        return closures
+
+    def use_memo(self, frontier: np.ndarray, visited: np.ndarray) -> np.ndarray:
+        """Mark the memoized closures in the frontier as visited and stop expanding them."""
+        if not self._memo:
+            return frontier
+        with self._memo_lock:
+            memoized = [int(i) for i in frontier if int(i) in self._memo]
+            for i in memoized:
+                visited[self._memo[i]] = True
+                self._memo.move_to_end(i)
+        if not memoized:
+            return frontier
+        return frontier[~np.isin(frontier, memoized)]
+
+    def remember(self, source: int, closure: np.ndarray) -> None:
+        with self._memo_lock:
+            self._memo[source] = closure
+            self._memo.move_to_end(source)
+            while len(self._memo) > self.MEMO_MAX_ENTRIES:
+                self._memo.popitem(last=False)
+
+
+def build_csr(rows: np.ndarray, cols: np.ndarray, num_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR adjacency (indptr, indices) listing the cols of each row."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32)
 
 
 def get_outlet_id(wb_or_cat_id: str) -> str | None:
@@ -131,17 +476,51 @@ def get_outlet_id(wb_or_cat_id: str) -> str | None:
     # remove everything that isn't a digit, then prepend wb- to get the graph node name
     stem = "".join(filter(str.isdigit, wb_or_cat_id))
     name = f"wb-{stem}"
-    graph = get_graph()
-    node_index = graph.vs.find(name=name).index
-    # this returns the current node, and every node downstream of it in order
-    downstream_node = graph.subcomponent(node_index, mode="OUT")
-    if len(downstream_node) >= 2:
-        # if there is more than one node in the list,
-        # then the second is the downstream node of the first
-        return graph.vs[downstream_node[1]]["name"]
+    index = get_upstream_index()
+    if name not in index.name_to_index:
+        raise ValueError(f"no such vertex: {name}")
+    downstream_node = index.downstream(index.name_to_index[name])
+    if downstream_node is not None:
+        return index.names[downstream_node]
     return None
 
 
+def find_sources_by_name(
+    index: UpstreamIndex, names: List[str], log_level: int
+) -> Dict[str, int]:
+    """Vertex index of each name, logging the ones missing from the graph."""
+    sources = {}
+    for name in names:
+        try:
+            sources[name] = index.find(name)
+        except (KeyError, TypeError):
+            logger.log(log_level, f"feature {name} not found in the hydrofabric graph.")
+    return sources
+
+
+def find_sources(index: UpstreamIndex, names: List[str], log_level: int) -> List[int]:
+    """Vertex indices of names, logging the ones missing from the graph."""
+    return list(find_sources_by_name(index, names, log_level).values())
+
+
+def get_search_names(names: List[str], include_outlet: bool) -> Dict[str, str | None]:
+    """
+    Name to start the upstream search from for each of names, the outlet of wb and cat
+    names if include_outlet is set. Names without an outlet are logged and left out.
+    """
+    search_names: Dict[str, str | None] = {}
+    for name in names:
+        if include_outlet and ("wb" in name or "cat" in name):
+            try:
+                search_names[name] = get_outlet_id(name)
+            except ValueError:
+                # one unknown id shouldn't fail the whole batch
+                logger.error(f"feature {name} not found in the hydrofabric graph.")
+        else:
+            search_names[name] = name
+    return search_names
+
+
 def get_upstream_cats(names: Union[str, List[str]]) -> Set[str]:
     """
     Retrieves IDs of all catchments upstream of, and including, the given catchment in the hydrological network.
@@ -155,32 +534,13 @@ def get_upstream_cats(names: Union[str, List[str]]) -> Set[str]:
     Returns:
         Set[str]: A list of IDs for all nodes upstream of the specified node(s). INCLUDING THE INPUT NODES.
     """
-    graph = get_graph()
+    index = get_upstream_index()
     if isinstance(names, str):
         names = [names]
-    # still keeping track of parent ids do we don't read info from overlapping networks more than once
-    parent_ids = set()
-    cat_ids = set()
-    for name in names:
-        if name in parent_ids:
-            continue
-        try:
-            if "cat" in name:
-                node_index = graph.vs.find(cat=name).index
-            else:
-                node_index = graph.vs.find(name=name).index
-            upstream_nodes = graph.subcomponent(node_index, mode="IN")
-            for node in upstream_nodes:
-                parent_ids.add(graph.vs[node]["name"])
-                cat_ids.add(graph.vs[node]["cat"])
-        except KeyError:
-            logger.critical(f"Catchment {name} not found in the hydrofabric graph.")
-        except ValueError:
-            logger.critical(f"Catchment {name} not found in the hydrofabric graph.")
+    sources = find_sources(index, names, logging.CRITICAL)
+    cat_ids = set(index.cats[index.upstream(sources)].tolist())
     # sometimes returns None, which isn't helpful
-    if None in cat_ids:
-        cat_ids.remove(None)
-
+    cat_ids.discard(None)
     return cat_ids
 
 
@@ -197,26 +557,61 @@ def get_upstream_ids(names: Union[str, List[str]], include_outlet: bool = True)
     Returns:
         Set[str]: A list of IDs for all nodes upstream of the specified node(s). INCLUDING THE INPUT NODES.
     """
-    graph = get_graph()
+    index = get_upstream_index()
     if isinstance(names, str):
         names = [names]
-    parent_ids = set()
-    for name in names:
-        if ("wb" in name or "cat" in name) and include_outlet:
-            name = get_outlet_id(name)
-        if name in parent_ids:
-            continue
-        try:
-            if "cat" in name:  # type: ignore # If name is None, this will raise an error, which is handled below
-                node_index = graph.vs.find(cat=name).index
-            else:
-                node_index = graph.vs.find(name=name).index
-            upstream_nodes = graph.subcomponent(node_index, mode="IN")
-            for node in upstream_nodes:
-                parent_ids.add(graph.vs[node]["name"])
-        except KeyError:
-            logger.error(f"feature {name} not found in the hydrofabric graph.")
-        except ValueError:
-            logger.error(f"feature {name} not found in the hydrofabric graph.")
-
-    return parent_ids
+    search_names = list(dict.fromkeys(get_search_names(names, include_outlet).values()))
+    sources = find_sources(index, search_names, logging.ERROR)  # type: ignore
+    return set(index.names[index.upstream(sources)].tolist())
+
+
+def get_upstream_cats_by_id(names: List[str]) -> Dict[str, Set[str]]:
+    """
+    Retrieves the upstream catchments of each of the given nodes separately.
+
+    Equivalent to calling get_upstream_cats once per name, but the traversal is shared,
+    so subtrees upstream of several names are only searched once.
+
+    Args:
+        names (List[str]): Node or catchment names.
+
+    Returns:
+        Dict[str, Set[str]]: The upstream catchment IDs of each name found in the graph,
+        INCLUDING THE INPUT NODE.
+    """
+    index = get_upstream_index()
+    sources = find_sources_by_name(index, names, logging.CRITICAL)
+    closures = index.upstream_by_source(list(sources.values()))
+    upstream_cats = {}
+    for name, source in sources.items():
+        cat_ids = set(index.cats[closures[source]].tolist())
+        cat_ids.discard(None)
+        upstream_cats[name] = cat_ids
+    return upstream_cats
+
+
+def get_upstream_ids_by_id(names: List[str], include_outlet: bool = True) -> Dict[str, Set[str]]:
+    """
+    Retrieves the upstream nodes of each of the given nodes separately.
+
+    Equivalent to calling get_upstream_ids once per name, but the traversal is shared,
+    so subtrees upstream of several names are only searched once.
+
+    Args:
+        names (List[str]): Node names.
+        include_outlet (bool): Search from the outlet of wb and cat names, as get_upstream_ids does.
+
+    Returns:
+        Dict[str, Set[str]]: The upstream node IDs of each name found in the graph,
+        INCLUDING THE INPUT NODE.
+    """
+    index = get_upstream_index()
+    search_names = get_search_names(names, include_outlet)
+    unique_names = list(dict.fromkeys(search_names.values()))
+    sources = find_sources_by_name(index, unique_names, logging.ERROR)  # type: ignore
+    closures = index.upstream_by_source(list(sources.values()))
+    return {
+        name: set(index.names[closures[sources[search_name]]].tolist())
+        for name, search_name in search_names.items()
+        if search_name in sources
+    }
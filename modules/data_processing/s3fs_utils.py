@@ -1,14 +1,66 @@
 from s3fs import S3FileSystem
 from s3fs.core import _error_wrapper, version_id_kw
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import asyncio
 
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# object sizes are cached so repeat reads of the same object skip the HEAD request
+MAX_CACHED_SIZES = 100_000
+
+
+def get_chunk_size(obj_size: int, max_concurrency: int) -> int:
+    """
+    Choose the range size for an object so it is split into about two ranges
+    per concurrent request, which keeps every request slot busy while the
+    slowest ranges finish. Range sizes are kept between 5MB and 64MB.
+    """
+    chunk_size = -(-obj_size // (2 * max_concurrency))
+    return min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
 
 class S3ParallelFileSystem(S3FileSystem):
     """S3FileSystem subclass that supports parallel downloads"""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, max_concurrency: int = 16, **kwargs):
         super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._object_sizes: Dict[Tuple[str, str, Optional[str]], int] = {}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily so it belongs to the filesystem's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def invalidate_cache(self, path: Optional[str] = None) -> None:
+        # s3fs calls this after every write, copy and delete (with the parent
+        # path for bulk deletes), so drop the cached sizes of everything under path
+        super().invalidate_cache(path)
+        if not path:
+            self._object_sizes.clear()
+            return
+        bucket, key, _ = self.split_path(path)
+        prefix = key.rstrip("/") + "/"
+        for cache_key in list(self._object_sizes):
+            cached_bucket, cached_key, _ = cache_key
+            if cached_bucket == bucket and (
+                not key or cached_key == key or cached_key.startswith(prefix)
+            ):
+                self._object_sizes.pop(cache_key, None)
+
+    async def _get_object_size(self, bucket: str, key: str, version_kw: dict) -> int:
+        cache_key = (bucket, key, version_kw.get("VersionId"))
+        if cache_key not in self._object_sizes:
+            if len(self._object_sizes) >= MAX_CACHED_SIZES:
+                self._object_sizes.clear()
+            head = await self._call_s3(
+                "head_object", Bucket=bucket, Key=key, **version_kw, **self.req_kw
+            )
+            self._object_sizes[cache_key] = head["ContentLength"]
+        return self._object_sizes[cache_key]
 
     async def _cat_file(
         self,
@@ -16,7 +68,7 @@ class S3ParallelFileSystem(S3FileSystem):
         version_id: Optional[str] = None,
         start: Optional[int] = None,
         end: Optional[int] = None,
-    ) -> bytes:
+    ) -> bytes | bytearray:
         bucket, key, vers = self.split_path(path)
         version_kw = version_id_kw(version_id or vers)
 
@@ -27,33 +79,37 @@ class S3ParallelFileSystem(S3FileSystem):
 
         # For large files, use parallel downloads
         try:
-            obj_size = (
-                await self._call_s3(
-                    "head_object", Bucket=bucket, Key=key, **version_kw, **self.req_kw
-                )
-            )["ContentLength"]
+            obj_size = await self._get_object_size(bucket, key, version_kw)
         except Exception:
             # Fall back to single request if HEAD fails
             return await self._download_chunk(bucket, key, {}, version_kw)
 
-        CHUNK_SIZE = 5 * 1024 * 1024  # 1MB chunks
-        if obj_size <= CHUNK_SIZE:
+        chunk_size = get_chunk_size(obj_size, self.max_concurrency)
+        if obj_size <= chunk_size:
             return await self._download_chunk(bucket, key, {}, version_kw)
 
-        # Calculate chunks for parallel download
-        chunks = []
-        for start in range(0, obj_size, CHUNK_SIZE):
-            end = min(start + CHUNK_SIZE - 1, obj_size - 1)
-            range_header = f"bytes={start}-{end}"
-            chunks.append({"Range": range_header})
-
-        # Download chunks in parallel
+        # Download the ranges in parallel straight into one buffer,
+        # so the parts don't have to be joined (and copied) at the end
         async def download_all_chunks():
-            tasks = [
-                self._download_chunk(bucket, key, chunk_head, version_kw) for chunk_head in chunks
-            ]
-            chunks_data = await asyncio.gather(*tasks)
-            return b"".join(chunks_data)
+            buffer = bytearray(obj_size)
+            view = memoryview(buffer)
+
+            async def download_into(range_start: int):
+                range_end = min(range_start + chunk_size, obj_size) - 1
+                head = {"Range": f"bytes={range_start}-{range_end}"}
+                # only the ranged requests are limited, so small reads aren't queued behind them
+                async with self.semaphore:
+                    data = await self._download_chunk(bucket, key, head, version_kw)
+                if len(data) != range_end - range_start + 1:
+                    raise IOError(
+                        f"Expected {range_end - range_start + 1} bytes from {path} "
+                        f"at offset {range_start}, got {len(data)}"
+                    )
+                view[range_start : range_end + 1] = data
+
+            await asyncio.gather(*[download_into(i) for i in range(0, obj_size, chunk_size)])
+            # returned as is, it's bytes-like for every reader and a copy would double the peak
+            return buffer
 
         return await _error_wrapper(download_all_chunks, retries=self.retries)
 
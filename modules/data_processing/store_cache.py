@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from dask.distributed import Client
+from data_processing.file_paths import file_paths
+
+logger = logging.getLogger(__name__)
+
+# keys holding zarr (v2) metadata rather than chunk data
+METADATA_KEYS = (".zmetadata", ".zgroup", ".zattrs", ".zarray")
+
+DEFAULT_CHUNK_CACHE_BYTES = 20 * 1024**3
+# fraction of the size limit kept after an eviction, so evictions don't run on every write
+EVICTION_TARGET = 0.9
+
+# chunk cache reads in this process, summed across all stores
+_chunk_cache_stats = {"hits": 0, "misses": 0, "hit_bytes": 0, "miss_bytes": 0}
+_chunk_cache_lock = threading.Lock()
+# bytes this process has written to the chunk cache since it last checked the cache size
+_bytes_since_size_check: Dict[Path, int] = {}
+
+
+def write_file_atomic(path: Path, value: bytes) -> None:
+    """Write value to path so that other processes never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    temp_path.write_bytes(value)
+    os.replace(temp_path, path)
+
+
+class MetadataCachedStore(MutableMapping):
+    """
+    Read only zarr store that wraps a remote store and keeps a local copy of
+    its metadata keys, and of every chunk of the arrays named in cached_arrays
+    (usually the coordinates). The remote stores used here never change, so
+    once these have been fetched, opening the store again needs no requests.
+    """
+
+    def __init__(self, store: MutableMapping, cache_path: Path, cached_arrays: Iterable[str] = ()):
+        self.store = store
+        self.cache_path = cache_path
+        self.cached_arrays = set(cached_arrays)
+
+    def is_cached_key(self, key: str) -> bool:
+        if key.rsplit("/", 1)[-1] in METADATA_KEYS:
+            return True
+        return "/" in key and key.split("/", 1)[0] in self.cached_arrays
+
+    def __getitem__(self, key: str) -> bytes:
+        if not self.is_cached_key(key):
+            return self.store[key]
+        local_path = self.cache_path / key
+        if local_path.exists():
+            return local_path.read_bytes()
+        value = self.store[key]
+        write_file_atomic(local_path, value)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        if isinstance(key, str) and self.is_cached_key(key) and (self.cache_path / key).exists():
+            return True
+        return key in self.store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise PermissionError("MetadataCachedStore is read only")
+
+    def __delitem__(self, key: str) -> None:
+        raise PermissionError("MetadataCachedStore is read only")
+
+
+def get_metadata_cached_store(
+    url: str, store: MutableMapping, cached_arrays: Iterable[str] = ()
+) -> MetadataCachedStore:
+    """
+    Wrap the store for url so its metadata, and the arrays in cached_arrays,
+    are cached under file_paths.store_metadata_cache in a folder named after the url.
+    """
+    relative_path = url.split("://", 1)[-1].strip("/")
+    return MetadataCachedStore(
+        store, file_paths.store_metadata_cache / relative_path, cached_arrays
+    )
+
+
+def record_chunk_read(hit: bool, num_bytes: int) -> None:
+    with _chunk_cache_lock:
+        if hit:
+            _chunk_cache_stats["hits"] += 1
+            _chunk_cache_stats["hit_bytes"] += num_bytes
+        else:
+            _chunk_cache_stats["misses"] += 1
+            _chunk_cache_stats["miss_bytes"] += num_bytes
+
+
+def pop_chunk_cache_stats() -> Dict[str, int]:
+    """Return the chunk cache counters of this process and reset them."""
+    with _chunk_cache_lock:
+        stats = dict(_chunk_cache_stats)
+        for name in _chunk_cache_stats:
+            _chunk_cache_stats[name] = 0
+    return stats
+
+
+def log_chunk_cache_stats() -> None:
+    """
+    Log the chunk cache hit ratio since the last report, summed over this
+    process and the workers of the current dask cluster if there is one.
+    """
+    stats = pop_chunk_cache_stats()
+    try:
+        worker_stats = Client.current().run(pop_chunk_cache_stats)
+    except ValueError:
+        worker_stats = {}
+    for counters in worker_stats.values():
+        for name, value in counters.items():
+            stats[name] += value
+    reads = stats["hits"] + stats["misses"]
+    if reads == 0:
+        return
+    logger.info(
+        f"Chunk cache: {stats['hits']}/{reads} chunks read from disk "
+        f"({stats['hits'] / reads:.0%}), {stats['hit_bytes'] / 10**6:.1f} Mb from disk, "
+        f"{stats['miss_bytes'] / 10**6:.1f} Mb from s3"
+    )
+
+
+def evict_chunk_cache(cache_root: Path, max_bytes: int) -> None:
+    """
+    Delete the least recently used chunks under cache_root until it holds
+    less than EVICTION_TARGET * max_bytes. Safe to run from several
+    processes at once, files that are already gone are skipped.
+    """
+    files = []
+    total_bytes = 0
+    for root, _, names in os.walk(cache_root):
+        for name in names:
+            # don't remove files another process is still writing
+            if name.endswith(".tmp"):
+                continue
+            path = Path(root) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+    if total_bytes <= max_bytes:
+        return
+    target_bytes = max_bytes * EVICTION_TARGET
+    files.sort()
+    removed_bytes = 0
+    for _, size, path in files:
+        if total_bytes - removed_bytes <= target_bytes:
+            break
+        try:
+            path.unlink()
+            removed_bytes += size
+        except FileNotFoundError:
+            continue
+    logger.info(f"Evicted {removed_bytes / 10**6:.1f} Mb from the chunk cache at {cache_root}")
+
+
+class ChunkCachedStore(MutableMapping):
+    """
+    Read only zarr store that keeps a copy of every chunk it reads from the
+    wrapped store on disk. Files are written atomically and read without
+    locks, so the cache can be shared by dask workers and concurrent
+    requests. Chunks are evicted least recently used first once the cache
+    grows past max_bytes.
+    """
+
+    def __init__(
+        self,
+        store: MutableMapping,
+        cache_path: Path,
+        cache_root: Path,
+        max_bytes: int = DEFAULT_CHUNK_CACHE_BYTES,
+    ):
+        self.store = store
+        self.cache_path = cache_path
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+
+    def is_chunk_key(self, key: str) -> bool:
+        if key.rsplit("/", 1)[-1] in METADATA_KEYS:
+            return False
+        # keys the wrapped store already keeps on disk
+        is_cached_key = getattr(self.store, "is_cached_key", None)
+        return not (is_cached_key and is_cached_key(key))
+
+    def __getitem__(self, key: str) -> bytes:
+        if not self.is_chunk_key(key):
+            return self.store[key]
+        local_path = self.cache_path / key
+        try:
+            value = local_path.read_bytes()
+        except FileNotFoundError:
+            value = None
+        if value is not None:
+            try:
+                # reads refresh the modification time, which eviction uses as the last use
+                os.utime(local_path)
+            except FileNotFoundError:
+                pass
+            record_chunk_read(True, len(value))
+            return value
+        value = self.store[key]
+        record_chunk_read(False, len(value))
+        try:
+            write_file_atomic(local_path, value)
+        except OSError as e:
+            logger.warning(f"Could not write {key} to the chunk cache: {e}")
+            return value
+        self.check_size(len(value))
+        return value
+
+    def check_size(self, num_bytes: int) -> None:
+        # scanning the cache is slow, only do it after writing a tenth of the limit
+        with _chunk_cache_lock:
+            written = _bytes_since_size_check.get(self.cache_root, 0) + num_bytes
+            due = written >= self.max_bytes * (1 - EVICTION_TARGET)
+            _bytes_since_size_check[self.cache_root] = 0 if due else written
+        if due:
+            evict_chunk_cache(self.cache_root, self.max_bytes)
+
+    def __contains__(self, key: object) -> bool:
+        if isinstance(key, str) and self.is_chunk_key(key) and (self.cache_path / key).exists():
+            return True
+        return key in self.store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise PermissionError("ChunkCachedStore is read only")
+
+    def __delitem__(self, key: str) -> None:
+        raise PermissionError("ChunkCachedStore is read only")
+
+
+def get_cached_store(
+    url: str,
+    store: MutableMapping,
+    cached_arrays: Iterable[str] = (),
+    use_chunk_cache: bool = False,
+    max_chunk_cache_bytes: int = DEFAULT_CHUNK_CACHE_BYTES,
+) -> MutableMapping:
+    """
+    Wrap the store for url with the metadata cache and, if use_chunk_cache
+    is set, the on disk chunk cache under file_paths.chunk_cache.
+    """
+    cached_store: MutableMapping = get_metadata_cached_store(url, store, cached_arrays)
+    if use_chunk_cache:
+        relative_path = url.split("://", 1)[-1].strip("/")
+        cached_store = ChunkCachedStore(
+            cached_store,
+            file_paths.chunk_cache / relative_path,
+            file_paths.chunk_cache,
+            max_chunk_cache_bytes,
+        )
+    return cached_store
@@ -0,0 +1,409 @@
+import logging
+import sqlite3
+import struct
+import threading
+from functools import cache
+from math import isnan
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pyproj
+import shapely
+from data_processing.file_paths import file_paths
+from data_processing.gpkg_utils import blobs_to_geometries, sqlite_uri
+from data_processing.store_cache import write_file_atomic
+from shapely.geometry.base import BaseGeometry
+
+logger = logging.getLogger(__name__)
+
+# half the width of the web mercator world in metres
+WEB_MERCATOR_EXTENT = 20037508.342789244
+MAX_ZOOM = 22
+# tile coordinates run from 0 to MVT_EXTENT, features are kept MVT_BUFFER past the edges
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+# protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# MVT geometry types and commands
+MVT_UNKNOWN = 0
+MVT_POINT = 1
+MVT_LINESTRING = 2
+MVT_POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+# columns sent with each hydrofabric layer, the geometry is read separately
+HYDROFABRIC_TILE_LAYERS = {
+    "divides": ("divide_id", "toid", "areasqkm", "vpuid"),
+    "flowpaths": ("id", "toid", "order", "tot_drainage_areasqkm"),
+}
+# below these zooms a tile would hold too many features to be useful
+HYDROFABRIC_MIN_ZOOMS = {"divides": 7, "flowpaths": 4}
+# simplification tolerance in tile units, so it scales with the zoom
+SIMPLIFY_TILE_UNITS = 1.0
+
+_connections = threading.local()
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Bounds of an XYZ tile in web mercator.
+
+    Returns:
+        Tuple[float, float, float, float]: (minx, miny, maxx, maxy) in EPSG:3857.
+    """
+    size = 2 * WEB_MERCATOR_EXTENT / 2**z
+    minx = -WEB_MERCATOR_EXTENT + x * size
+    maxy = WEB_MERCATOR_EXTENT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def buffered_tile_bounds(
+    z: int, x: int, y: int, buffer: int = MVT_BUFFER, extent: int = MVT_EXTENT
+) -> Tuple[float, float, float, float]:
+    """Bounds of an XYZ tile in web mercator, grown by buffer tile units on every side."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    pad = (maxx - minx) * buffer / extent
+    return minx - pad, miny - pad, maxx + pad, maxy + pad
+
+
+def to_tile_coordinates(
+    geometries: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    simplify_tolerance: float = SIMPLIFY_TILE_UNITS,
+    extent: int = MVT_EXTENT,
+    buffer: int = MVT_BUFFER,
+) -> np.ndarray:
+    """
+    Clip web mercator geometries to a tile and convert them to tile coordinates.
+
+    Args:
+        geometries (np.ndarray): Geometries in EPSG:3857, None is passed through.
+        bounds (tuple): The tile bounds from tile_bounds.
+        simplify_tolerance (float): Simplification tolerance in tile units, 0 to disable.
+        extent (int): Size of the tile in tile units.
+        buffer (int): Tile units kept past the edges, so lines don't end at tile borders.
+
+    Returns:
+        np.ndarray: Geometries in tile coordinates, with y pointing down.
+    """
+    minx, miny, maxx, maxy = bounds
+    pad = (maxx - minx) * buffer / extent
+    clipped = shapely.clip_by_rect(geometries, minx - pad, miny - pad, maxx + pad, maxy + pad)
+    scale_x = extent / (maxx - minx)
+    scale_y = extent / (maxy - miny)
+    tile_geometries = shapely.transform(
+        clipped,
+        lambda coords: np.column_stack(
+            [(coords[:, 0] - minx) * scale_x, (maxy - coords[:, 1]) * scale_y]
+        ),
+    )
+    if simplify_tolerance > 0:
+        tile_geometries = shapely.simplify(tile_geometries, simplify_tolerance)
+    return tile_geometries
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def varint_field(field: int, value: int) -> bytes:
+    return encode_varint(field << 3 | VARINT) + encode_varint(value)
+
+
+def bytes_field(field: int, value: bytes) -> bytes:
+    return encode_varint(field << 3 | LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+
+def packed_field(field: int, values: Sequence[int]) -> bytes:
+    return bytes_field(field, b"".join(encode_varint(value) for value in values))
+
+
+def encode_value(value: Any) -> bytes:
+    """Encode a property value as an MVT Value message."""
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, int):
+        return varint_field(6, zigzag(value))
+    if isinstance(value, float):
+        return encode_varint(3 << 3 | FIXED64) + struct.pack("<d", value)
+    return bytes_field(1, str(value).encode("utf-8"))
+
+
+def command_integer(command: int, count: int) -> int:
+    return (command & 0x7) | (count << 3)
+
+
+def round_coordinates(coords: np.ndarray) -> np.ndarray:
+    """Round to the tile grid and drop the repeated points that leaves."""
+    points = np.round(coords[:, :2]).astype(np.int64)
+    if len(points) < 2:
+        return points
+    moved = np.any(points[1:] != points[:-1], axis=1)
+    return np.concatenate([points[:1], points[1:][moved]])
+
+
+def encode_geometry(geometry: BaseGeometry) -> Tuple[int, List[int]]:
+    """
+    Encode a geometry already in tile coordinates as MVT geometry commands.
+
+    Polygons take precedence over lines and lines over points when a geometry
+    collection mixes them, as clipping can leave stray parts of a lower dimension.
+    Rings are reoriented as the spec requires: exteriors clockwise on screen, holes
+    anticlockwise.
+
+    Args:
+        geometry (BaseGeometry): The geometry, in tile coordinates.
+
+    Returns:
+        Tuple[int, List[int]]: The MVT geometry type and command integers,
+        (MVT_UNKNOWN, []) if nothing is left once rounded to the tile grid.
+    """
+    commands: List[int] = []
+    cursor = np.zeros(2, dtype=np.int64)
+
+    def add_points(command: int, points: np.ndarray) -> None:
+        nonlocal cursor
+        deltas = np.diff(np.vstack([cursor, points]), axis=0)
+        commands.append(command_integer(command, len(points)))
+        commands.extend(zigzag(delta) for delta in deltas.ravel().tolist())
+        cursor = points[-1]
+
+    parts = shapely.get_parts(geometry)
+    polygons = [part for part in parts if part.geom_type == "Polygon"]
+    lines = [part for part in parts if part.geom_type == "LineString"]
+    points = [part for part in parts if part.geom_type == "Point"]
+
+    if polygons:
+        for polygon in polygons:
+            for i, ring in enumerate([polygon.exterior, *polygon.interiors]):
+                ring_points = round_coordinates(np.asarray(ring.coords))
+                if len(ring_points) > 1 and np.array_equal(ring_points[0], ring_points[-1]):
+                    ring_points = ring_points[:-1]
+                area = 0
+                if len(ring_points) >= 3:
+                    x, y = ring_points[:, 0], ring_points[:, 1]
+                    area = int(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+                if area == 0:
+                    # a polygon whose exterior collapsed is dropped along with its holes
+                    if i == 0:
+                        break
+                    continue
+                # positive area in tile coordinates (y down) is an exterior ring
+                if (area > 0) != (i == 0):
+                    ring_points = ring_points[::-1]
+                add_points(MOVE_TO, ring_points[:1])
+                add_points(LINE_TO, ring_points[1:])
+                commands.append(command_integer(CLOSE_PATH, 1))
+        return (MVT_POLYGON, commands) if commands else (MVT_UNKNOWN, [])
+
+    if lines:
+        for line in lines:
+            line_points = round_coordinates(np.asarray(line.coords))
+            if len(line_points) < 2:
+                continue
+            add_points(MOVE_TO, line_points[:1])
+            add_points(LINE_TO, line_points[1:])
+        return (MVT_LINESTRING, commands) if commands else (MVT_UNKNOWN, [])
+
+    if points:
+        add_points(MOVE_TO, np.round([point.coords[0][:2] for point in points]).astype(np.int64))
+        return MVT_POINT, commands
+    return MVT_UNKNOWN, []
+
+
+def encode_layer(
+    name: str,
+    features: Iterable[Tuple[BaseGeometry, Dict[str, Any]]],
+    extent: int = MVT_EXTENT,
+) -> bytes:
+    """
+    Encode one MVT layer. Features that are empty in tile coordinates are left out,
+    as are properties that are None or NaN.
+
+    Args:
+        name (str): The layer name, the "source-layer" in maplibre styles.
+        features (Iterable): (geometry in tile coordinates, properties) pairs.
+        extent (int): Size of the tile in tile units.
+
+    Returns:
+        bytes: The encoded Layer message, empty if the layer has no features.
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Any], int] = {}
+    encoded_features = []
+    for geometry, properties in features:
+        if geometry is None or geometry.is_empty:
+            continue
+        geometry_type, commands = encode_geometry(geometry)
+        if not commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            # numpy scalars to python types
+            if hasattr(value, "item"):
+                value = value.item()
+            if value is None or (isinstance(value, float) and isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            # keyed by type too, so True and 1 are different values
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = packed_field(2, tags) + varint_field(3, geometry_type) + packed_field(4, commands)
+        encoded_features.append(bytes_field(2, feature))
+    if not encoded_features:
+        return b""
+    layer = [varint_field(15, 2), bytes_field(1, name.encode("utf-8"))]
+    layer += encoded_features
+    layer += [bytes_field(3, key.encode("utf-8")) for key in keys]
+    layer += [bytes_field(4, encode_value(value)) for _, value in values]
+    layer.append(varint_field(5, extent))
+    return b"".join(layer)
+
+
+def encode_tile(layers: Dict[str, Iterable[Tuple[BaseGeometry, Dict[str, Any]]]]) -> bytes:
+    """
+    Encode a Mapbox Vector Tile.
+
+    Args:
+        layers (dict): Layer name to (geometry in tile coordinates, properties) pairs.
+
+    Returns:
+        bytes: The encoded tile, empty if no layer has any features.
+    """
+    encoded_layers = (encode_layer(name, features) for name, features in layers.items())
+    return b"".join(bytes_field(3, layer) for layer in encoded_layers if layer)
+
+
+def get_cached_tile(cache_path: Path, render: Callable[[], bytes]) -> bytes:
+    """
+    Read a tile from the disk cache, or render it and write it there. Files are
+    written atomically, so concurrent requests for the same tile are safe.
+    """
+    try:
+        return cache_path.read_bytes()
+    except FileNotFoundError:
+        pass
+    tile = render()
+    try:
+        write_file_atomic(cache_path, tile)
+    except OSError as e:
+        logger.warning(f"Could not write {cache_path} to the tile cache: {e}")
+    return tile
+
+
+@cache
+def get_transformer_3857_to_5070() -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs("EPSG:3857", "EPSG:5070", always_xy=True)
+
+
+@cache
+def get_transformer_5070_to_3857() -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs("EPSG:5070", "EPSG:3857", always_xy=True)
+
+
+def get_hydrofabric_connection() -> sqlite3.Connection:
+    """Read only connection to the CONUS hydrofabric, one per thread."""
+    con = getattr(_connections, "con", None)
+    if con is None:
+        if not file_paths.conus_hydrofabric.exists():
+            raise FileNotFoundError(f"{file_paths.conus_hydrofabric} not found")
+        con = sqlite3.connect(sqlite_uri(file_paths.conus_hydrofabric, read_only=True), uri=True)
+        _connections.con = con
+    return con
+
+
+def get_hydrofabric_tile_cache_dir() -> Path:
+    """Tile cache folder for the current hydrofabric, replaced when the file changes."""
+    stat = file_paths.conus_hydrofabric.stat()
+    return file_paths.tile_cache / "hydrofabric" / f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def get_min_flowpath_order(z: int) -> int:
+    """Smallest stream order drawn at zoom z, every flowpath is drawn from zoom 10."""
+    return max(1, 11 - z)
+
+
+def render_hydrofabric_tile(layer: str, z: int, x: int, y: int) -> bytes:
+    """
+    Render a tile of the divides or flowpaths of the CONUS hydrofabric.
+
+    The features are found through the geopackage's rtree, so only the rows
+    overlapping the tile are read. Geometries are simplified with a tolerance in
+    tile units, which removes more detail the further out the tile is.
+
+    Args:
+        layer (str): "divides" or "flowpaths", also the name of the layer in the tile.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+
+    Returns:
+        bytes: The encoded tile, empty below the layer's minimum zoom.
+    """
+    if z < HYDROFABRIC_MIN_ZOOMS[layer]:
+        return b""
+    columns = HYDROFABRIC_TILE_LAYERS[layer]
+    # the rtree is in EPSG:5070, search the bounding box of the buffered tile
+    minx, miny, maxx, maxy = get_transformer_3857_to_5070().transform_bounds(
+        *buffered_tile_bounds(z, x, y), densify_pts=21
+    )
+    column_sql = ", ".join(f't."{column}"' for column in columns)
+    sql = f"""SELECT {column_sql}, t.geom FROM {layer} t
+            JOIN rtree_{layer}_geom r ON t.fid = r.id
+            WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?"""
+    params: List[Any] = [maxx, minx, maxy, miny]
+    if layer == "flowpaths":
+        sql += ' AND t."order" >= ?'
+        params.append(get_min_flowpath_order(z))
+    rows = get_hydrofabric_connection().execute(sql, params).fetchall()
+    if not rows:
+        return b""
+
+    geometries = blobs_to_geometries([row[-1] for row in rows])
+    transformer = get_transformer_5070_to_3857()
+    geometries = shapely.transform(
+        geometries,
+        lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])),
+    )
+    tile_geometries = to_tile_coordinates(geometries, tile_bounds(z, x, y))
+    features = (
+        (geometry, dict(zip(columns, row[:-1])))
+        for geometry, row in zip(tile_geometries, rows)
+    )
+    return encode_tile({layer: features})
+
+
+def get_hydrofabric_tile(layer: str, z: int, x: int, y: int) -> bytes:
+    """
+    Cached version of render_hydrofabric_tile.
+
+    Raises:
+        ValueError: If the layer or tile doesn't exist.
+        FileNotFoundError: If the hydrofabric hasn't been downloaded.
+    """
+    if layer not in HYDROFABRIC_TILE_LAYERS:
+        raise ValueError(f"Unknown layer {layer}, expected one of {list(HYDROFABRIC_TILE_LAYERS)}")
+    if not is_valid_tile(z, x, y):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    cache_path = get_hydrofabric_tile_cache_dir() / layer / str(z) / str(x) / f"{y}.pbf"
+    return get_cached_tile(cache_path, lambda: render_hydrofabric_tile(layer, z, x, y))
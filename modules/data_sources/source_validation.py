@@ -23,6 +23,7 @@ from rich.progress import (Progress,
 from rich.prompt import Prompt
 from tqdm import TqdmExperimentalWarning
 from data_processing.gpkg_utils import verify_indices
+from data_processing.graph_utils import build_graph_cache
 import sqlite3
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
@@ -143,18 +144,13 @@ def download_and_update_hf():
     )
 
     if file_paths.hydrofabric_graph.is_file():
+        # the pickled graph is no longer read, the network is cached as npy arrays instead
         console.print(
-            f"Hydrofabric graph already exists at {file_paths.hydrofabric_graph}, removing it to download the latest version.",
+            f"Removing the old hydrofabric graph at {file_paths.hydrofabric_graph}.",
             style="bold yellow",
         )
         file_paths.hydrofabric_graph.unlink()
 
-    download_from_s3(
-        file_paths.hydrofabric_graph,
-        bucket="communityhydrofabric",
-        key="hydrofabrics/community/conus_igraph_network.gpickle"
-    )
-
     status, headers = get_headers()
 
     if status == 200:
@@ -167,6 +163,10 @@ def download_and_update_hf():
         file_paths.conus_hydrofabric.parent,
     )
 
+    # built now so the first upstream query doesn't have to read the whole network table
+    console.print("Building the network graph cache...", style="bold green")
+    build_graph_cache()
+
 def validate_hydrofabric():
     if not file_paths.conus_hydrofabric.is_file():
         response = Prompt.ask(
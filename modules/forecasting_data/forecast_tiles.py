@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+from functools import cache, lru_cache
+from io import BytesIO
+from math import ceil, cos, floor, log2, radians
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import pyproj
+import shapely
+from PIL import Image
+from pyproj.enums import TransformDirection
+
+from data_processing.file_paths import file_paths
+from data_processing.vector_tiles import (
+    buffered_tile_bounds,
+    encode_tile,
+    get_cached_tile,
+    is_valid_tile,
+    tile_bounds,
+    to_tile_coordinates,
+)
+from forecasting_data.forcing_datasets import load_forecasted_forcing_with_options
+
+# Size of a forcing grid cell at scale 1, as assumed by get_simple_point_geometry
+GRID_CELL_METRES = 1000
+# Cells are aggregated until they cover at least this many screen pixels
+FORECAST_TILE_MIN_CELL_PIXELS = 4
+FORECAST_MAX_AGGREGATION = 64
+# Grids are kept for a few forecast frames at each power of two aggregation factor,
+# the full resolution CONUS grid of one frame alone is about 70MB
+MAX_CACHED_FORECAST_GRIDS = 4 * (int(log2(FORECAST_MAX_AGGREGATION)) + 1)
+# Ground size of a screen pixel at zoom 0 (512 px vector tiles) around 40N, mid CONUS
+METRES_PER_PIXEL_Z0 = 2 * 20037508.342789244 / 512 * cos(radians(40))
+FORECAST_TILE_LAYER = "forecasted_precip"
+
+RASTER_TILE_SIZE = 256
+RASTER_TILE_FORMATS = {"png": "PNG", "webp": "WEBP"}
+# Pixel to grid cell indices are kept for this many tiles, about 256KB each
+MAX_CACHED_PIXEL_INDICES = 512
+# kg/m^2/s to in/hr: 1 kg/m^2 is 1 mm of water, 1 mm = 0.0393701 inches
+KG_M2_S_TO_IN_HR = 0.0393701 * 3600
+# noaa_threshold_color_sets["precip_1h"] in globals.js, in/hr, lowest first
+PRECIP_1H_THRESHOLDS = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 2.5, 3, 4, 5, 6, 8, 10])
+PRECIP_1H_COLORS = np.array(
+    [
+        (43, 192, 245),  # very-light-blue or cyan
+        (59, 121, 187),  # lightish-blue
+        (12, 18, 135),  # dark-blue
+        (40, 250, 59),  # light-green
+        (24, 150, 36),  # green
+        (14, 89, 24),  # darkish-green
+        (248, 250, 61),  # yellow
+        (253, 212, 105),  # yellow-orange
+        (246, 140, 40),  # orange
+        (245, 7, 25),  # bright red
+        (162, 3, 17),  # red
+        (112, 2, 9),  # dark red
+        (246, 0, 242),  # magenta
+        (114, 64, 214),  # purple
+        (215, 215, 215),  # very light gray
+    ],
+    dtype=np.uint8,
+)
+MISSING_DATA_COLOR = (114, 114, 114)
+
+
+def get_aggregation_factor(z: int) -> int:
+    """
+    Get the number of grid cells collapsed into one along each axis at a zoom level.
+
+    Args:
+        z (int): Zoom level.
+
+    Returns:
+        int: A power of two, 1 once the cells are large enough on screen.
+    """
+    factor = METRES_PER_PIXEL_Z0 / 2**z * FORECAST_TILE_MIN_CELL_PIXELS / GRID_CELL_METRES
+    if factor <= 1:
+        return 1
+    return min(2 ** ceil(log2(factor)), FORECAST_MAX_AGGREGATION)
+
+
+@cache
+def get_transformer_to_3857(crs: str) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(crs, "EPSG:3857", always_xy=True)
+
+
+@lru_cache(maxsize=MAX_CACHED_FORECAST_GRIDS)
+def get_forecast_grid(
+    date: str,
+    forecast_cycle: int,
+    lead_time: int,
+    factor: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, pyproj.Transformer]:
+    """
+    Get the precipitation grid of a forecast, aggregated by factor along each axis.
+
+    Args:
+        date (str): Date in 'YYYYMMDDHHMM' format.
+        forecast_cycle (int): Forecast cycle hour.
+        lead_time (int): Lead time in hours.
+        factor (int): The number of x and y points to collapse into one.
+
+    Returns:
+        result (Tuple[np.ndarray, np.ndarray, np.ndarray, pyproj.Transformer]): A tuple containing:
+            - Precipitation data as a 2D numpy array with shape (y, x).
+            - X coordinates of the cell centres as a 1D numpy array.
+            - Y coordinates of the cell centres as a 1D numpy array.
+            - A pyproj Transformer from the grid's projection to EPSG:3857.
+    """
+    scale = factor if factor > 1 else None
+    precip_data, transformer = load_forecasted_forcing_with_options(
+        date=date, forecast_cycle=forecast_cycle, lead_time=lead_time, scaleX=scale, scaleY=scale
+    )
+    values = precip_data[0].to_numpy()
+    to_3857 = get_transformer_to_3857(transformer.source_crs.to_wkt())
+    return values, precip_data.x.values, precip_data.y.values, to_3857
+
+
+def get_cell_size(coords: np.ndarray, factor: int) -> float:
+    if len(coords) > 1:
+        return float(abs(coords[1] - coords[0]))
+    return float(GRID_CELL_METRES * factor)
+
+
+def render_forecast_tile(
+    date: str, forecast_cycle: int, lead_time: int, z: int, x: int, y: int
+) -> bytes:
+    """
+    Render the forecast precipitation cells overlapping a tile as a Mapbox Vector Tile.
+
+    Each cell is a polygon with its "value" (RAINRATE, in the dataset's units) and its
+    "row" and "col" in the aggregated grid. Cells with no rain are left out, as in
+    get_timestep_data_for_frontend.
+
+    Args:
+        date (str): Date in 'YYYYMMDDHHMM' format.
+        forecast_cycle (int): Forecast cycle hour.
+        lead_time (int): Lead time in hours.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+
+    Returns:
+        bytes: The encoded tile, empty if no cell in the tile has rain.
+    """
+    factor = get_aggregation_factor(z)
+    values, x_coords, y_coords, to_3857 = get_forecast_grid(date, forecast_cycle, lead_time, factor)
+    # the buffered tile in the grid's projection
+    minx, miny, maxx, maxy = to_3857.transform_bounds(
+        *buffered_tile_bounds(z, x, y), densify_pts=21, direction=TransformDirection.INVERSE
+    )
+    half_x = get_cell_size(x_coords, factor) / 2
+    half_y = get_cell_size(y_coords, factor) / 2
+    cols = np.flatnonzero((x_coords + half_x >= minx) & (x_coords - half_x <= maxx))
+    rows = np.flatnonzero((y_coords + half_y >= miny) & (y_coords - half_y <= maxy))
+    if len(cols) == 0 or len(rows) == 0:
+        return b""
+    tile_values = values[np.ix_(rows, cols)]
+    has_rain = ~np.isnan(tile_values) & ~np.isclose(tile_values, 0.0, atol=1e-6)
+    row_idx, col_idx = np.nonzero(has_rain)
+    if len(row_idx) == 0:
+        return b""
+    rows, cols = rows[row_idx], cols[col_idx]
+    centre_x = x_coords[cols][:, None]
+    centre_y = y_coords[rows][:, None]
+    corners_x = centre_x + np.array([-half_x, half_x, half_x, -half_x])
+    corners_y = centre_y + np.array([-half_y, -half_y, half_y, half_y])
+    mercator_x, mercator_y = to_3857.transform(corners_x.ravel(), corners_y.ravel())
+    corners = np.stack([mercator_x, mercator_y], axis=-1).reshape(-1, 4, 2)
+    cells = shapely.polygons(corners)
+    tile_cells = to_tile_coordinates(cells, tile_bounds(z, x, y), simplify_tolerance=0)
+    features = (
+        (cell, {"value": value, "row": row, "col": col})
+        for cell, value, row, col in zip(
+            tile_cells, tile_values[row_idx, col_idx].tolist(), rows.tolist(), cols.tolist()
+        )
+    )
+    return encode_tile({FORECAST_TILE_LAYER: features})
+
+
+def get_forecast_tile_path(
+    date: str, forecast_cycle: int, lead_time: int, z: int, x: int, y: int, extension: str
+) -> Path:
+    """
+    Get the tile cache path of a forecast tile, validating the request on the way.
+
+    Raises:
+        ValueError: If the date isn't numeric or the tile doesn't exist.
+    """
+    # the date becomes part of the cache path
+    if not date.isdigit():
+        raise ValueError(f"Invalid date {date}, expected YYYYMMDDHHMM")
+    if not is_valid_tile(z, x, y):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    forecast_dir = file_paths.tile_cache / "forecast" / date / str(forecast_cycle) / str(lead_time)
+    return forecast_dir / str(z) / str(x) / f"{y}.{extension}"
+
+
+def get_forecast_tile(
+    date: str, forecast_cycle: int, lead_time: int, z: int, x: int, y: int
+) -> bytes:
+    """
+    Cached version of render_forecast_tile. Published forecasts don't change, so
+    tiles are kept on disk under file_paths.tile_cache.
+
+    Raises:
+        ValueError: If the date isn't numeric or the tile doesn't exist.
+    """
+    cache_path = get_forecast_tile_path(date, forecast_cycle, lead_time, z, x, y, "pbf")
+    return get_cached_tile(
+        cache_path, lambda: render_forecast_tile(date, forecast_cycle, lead_time, z, x, y)
+    )
+
+
+def get_raster_aggregation_factor(z: int) -> int:
+    """
+    Get the number of grid cells collapsed into one along each axis for raster tiles,
+    the largest power of two that keeps a cell no bigger than a tile pixel.
+
+    Args:
+        z (int): Zoom level.
+
+    Returns:
+        int: A power of two, 1 once a tile pixel is smaller than a grid cell.
+    """
+    metres_per_pixel = 2 * METRES_PER_PIXEL_Z0 * 256 / RASTER_TILE_SIZE / 2**z
+    factor = metres_per_pixel / GRID_CELL_METRES
+    if factor < 2:
+        return 1
+    return min(2 ** floor(log2(factor)), FORECAST_MAX_AGGREGATION)
+
+
+@lru_cache(maxsize=MAX_CACHED_PIXEL_INDICES)
+def get_pixel_index(
+    z: int,
+    x: int,
+    y: int,
+    crs: str,
+    x_grid: Tuple[float, float, int],
+    y_grid: Tuple[float, float, int],
+) -> np.ndarray:
+    """
+    Get the grid cell under the centre of every pixel of a raster tile.
+
+    The index only depends on the tile and the layout of the grid, not on the values,
+    so it's computed once and reused for every forecast date, cycle and lead time.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+        crs (str): WKT of the grid's projection.
+        x_grid (tuple): (first cell centre, step, number of cells) along x.
+        y_grid (tuple): (first cell centre, step, number of cells) along y.
+
+    Returns:
+        np.ndarray: Flat index into the (y, x) grid for each pixel, row by row from
+        the top left of the tile, -1 where the pixel is outside the grid.
+    """
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    resolution = (maxx - minx) / RASTER_TILE_SIZE
+    offsets = (np.arange(RASTER_TILE_SIZE) + 0.5) * resolution
+    pixel_x, pixel_y = np.meshgrid(minx + offsets, maxy - offsets)
+    grid_x, grid_y = get_transformer_to_3857(crs).transform(
+        pixel_x.ravel(), pixel_y.ravel(), direction=TransformDirection.INVERSE
+    )
+    x0, x_step, nx = x_grid
+    y0, y_step, ny = y_grid
+    with np.errstate(invalid="ignore"):
+        cols = np.round((grid_x - x0) / x_step)
+        rows = np.round((grid_y - y0) / y_step)
+        inside = (cols >= 0) & (cols < nx) & (rows >= 0) & (rows < ny)
+    index = np.full(len(cols), -1, dtype=np.int32)
+    index[inside] = (rows[inside] * nx + cols[inside]).astype(np.int32)
+    return index
+
+
+def get_grid_layout(coords: np.ndarray, factor: int) -> Tuple[float, float, int]:
+    step = get_cell_size(coords, factor)
+    if len(coords) > 1 and coords[1] < coords[0]:
+        step = -step
+    return float(coords[0]), step, len(coords)
+
+
+def colorize_precip(values: np.ndarray) -> np.ndarray:
+    """
+    Color precipitation values with the NOAA 1 hour thresholds used by the map.
+
+    Matches applyNOAAThresholdToValue in forecast_layers.js: values below the lowest
+    threshold fade out, missing and negative values are gray. Cells with no rain are
+    transparent, as they are left out of the GeoJSON overlay.
+
+    Args:
+        values (np.ndarray): RAINRATE in kg/m^2/s.
+
+    Returns:
+        np.ndarray: RGBA colors, with a trailing axis of length 4.
+    """
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    with np.errstate(invalid="ignore"):
+        inches = values * KG_M2_S_TO_IN_HR
+        dry = np.isclose(values, 0.0, atol=1e-6)
+        missing = np.isnan(values) | ((inches <= 0) & ~dry)
+        wet = ~missing & ~dry
+    level = np.searchsorted(PRECIP_1H_THRESHOLDS, inches[wet], side="right") - 1
+    rgba[wet, :3] = PRECIP_1H_COLORS[np.maximum(level, 0)]
+    # below the lowest threshold the alpha scales with the distance from it
+    fraction = np.where(level < 0, inches[wet] / PRECIP_1H_THRESHOLDS[0], 1.0)
+    rgba[wet, 3] = np.round(255 * fraction).astype(np.uint8)
+    rgba[missing] = (*MISSING_DATA_COLOR, 255)
+    return rgba
+
+
+def render_forecast_raster_tile(
+    date: str, forecast_cycle: int, lead_time: int, z: int, x: int, y: int, image_format: str
+) -> bytes:
+    """
+    Render the forecast precipitation under a tile as a colored PNG or WebP image.
+
+    Args:
+        date (str): Date in 'YYYYMMDDHHMM' format.
+        forecast_cycle (int): Forecast cycle hour.
+        lead_time (int): Lead time in hours.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+        image_format (str): "png" or "webp".
+
+    Returns:
+        bytes: The encoded image, RASTER_TILE_SIZE pixels square.
+    """
+    factor = get_raster_aggregation_factor(z)
+    values, x_coords, y_coords, to_3857 = get_forecast_grid(date, forecast_cycle, lead_time, factor)
+    index = get_pixel_index(
+        z,
+        x,
+        y,
+        to_3857.source_crs.to_wkt(),
+        get_grid_layout(x_coords, factor),
+        get_grid_layout(y_coords, factor),
+    )
+    inside = index >= 0
+    rgba = np.zeros((len(index), 4), dtype=np.uint8)
+    if inside.any():
+        rgba[inside] = colorize_precip(values.ravel()[index[inside]])
+    image = Image.fromarray(rgba.reshape(RASTER_TILE_SIZE, RASTER_TILE_SIZE, 4), "RGBA")
+    buffer = BytesIO()
+    # lossless keeps the palette colors exact, and flat colors compress well anyway
+    image.save(buffer, format=RASTER_TILE_FORMATS[image_format], lossless=True)
+    return buffer.getvalue()
+
+
+def get_forecast_raster_tile(
+    date: str, forecast_cycle: int, lead_time: int, z: int, x: int, y: int, image_format: str
+) -> bytes:
+    """
+    Cached version of render_forecast_raster_tile, tiles are kept on disk under
+    file_paths.tile_cache next to the vector tiles of the same forecast.
+
+    Raises:
+        ValueError: If the date isn't numeric, the tile doesn't exist, or the format
+            isn't png or webp.
+    """
+    if image_format not in RASTER_TILE_FORMATS:
+        raise ValueError(f"Invalid format {image_format}, expected one of png, webp")
+    cache_path = get_forecast_tile_path(date, forecast_cycle, lead_time, z, x, y, image_format)
+    return get_cached_tile(
+        cache_path,
+        lambda: render_forecast_raster_tile(
+            date, forecast_cycle, lead_time, z, x, y, image_format
+        ),
+    )
@@ -2,10 +2,10 @@
 ## It is the entry point for the application and is equivalent to run.sh
 import logging
 import webbrowser
-from threading import Timer
+from threading import Thread, Timer
 
 from data_processing.file_paths import file_paths
-from data_processing.graph_utils import get_graph
+from data_processing.graph_utils import get_upstream_index
 from map_app import app, console_handler
 
 
@@ -32,8 +32,8 @@ def set_logs_to_warning():
 
 
 def main():
-    # call this once to cache the graph
-    Timer(1, get_graph).start()
+    # load the graph in the background, requests that arrive first wait for the same load
+    Thread(target=get_upstream_index, daemon=True).start()
 
     if file_paths.dev_file.is_file():
         Timer(2, set_logs_to_warning).start()
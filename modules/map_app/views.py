@@ -5,13 +5,21 @@ from pathlib import Path
 from typing import Optional
 
 import geopandas as gpd
+from data_processing.dask_utils import cluster_manager
 from data_processing.dataset_utils import save_and_clip_dataset
 from data_processing.datasets import load_aorc_zarr, load_v3_retrospective_zarr
-from data_processing.file_paths import file_paths
-from data_processing.forcings import create_forcings
-from data_processing.graph_utils import get_upstream_cats, get_upstream_ids
-from flask import Blueprint, jsonify, render_template, request
+from data_processing.file_paths import GRIDDED_CACHE_FORMATS, file_paths
+from data_processing.forcings import ZONAL_STATS_ENGINES, create_forcings
+from data_processing.graph_utils import (
+    get_upstream_cats,
+    get_upstream_cats_by_id,
+    get_upstream_ids,
+    get_upstream_ids_by_id,
+)
+from data_processing.vector_tiles import MVT_CONTENT_TYPE, get_hydrofabric_tile
+from flask import Blueprint, Response, jsonify, render_template, request
 
+from forecasting_data.forecast_tiles import get_forecast_raster_tile, get_forecast_tile
 from forecasting_data.forecast_datasets import (
     reproject_points,
     reproject_points_2d,
@@ -40,6 +48,13 @@ intra_module_db = {}
 logger = logging.getLogger(__name__)
 
 
+def parse_bool_option(value) -> bool:
+    # bool("false") is True, so strings from forms or query args are parsed explicitly
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return value is True or value == 1
+
+
 @main.route("/")
 def index():
     return render_template("index.html")
@@ -64,6 +79,92 @@ def get_upstream_wbids():
     return [id for id in upstream_ids if id.startswith("wb")], 200
 
 
+@main.route("/get_upstream_batch", methods=["POST"])
+def get_upstream_batch():
+    # body: JSON.stringify({'ids': [cat_id, ...], 'kind': 'catids' | 'wbids', 'per_id': false})
+    # returns the union of the results of /get_upstream_<kind> for every id,
+    # or with per_id set, an object with the result for each id
+    options = json.loads(request.data.decode("utf-8"))
+    ids = options.get("ids", [])
+    if not isinstance(ids, list) or not all(isinstance(cat_id, str) for cat_id in ids):
+        return jsonify({"error": "ids must be a list of strings"}), 400
+    cat_ids = list(dict.fromkeys(ids))
+    kind = options.get("kind", "catids")
+    per_id = options.get("per_id", False)
+    if kind not in ("catids", "wbids"):
+        return jsonify({"error": f"Invalid kind {kind}, expected catids or wbids"}), 400
+
+    if kind == "catids":
+        # the selected catchments are left out, as in /get_upstream_catids
+        wb_ids = {cat_id: "wb-" + cat_id.split("-")[-1] for cat_id in cat_ids}
+        if not per_id:
+            upstream_cats = get_upstream_cats(list(wb_ids.values())) - set(cat_ids)
+            return jsonify(sorted(upstream_cats)), 200
+        upstream_by_wb = get_upstream_cats_by_id(list(wb_ids.values()))
+        result = {
+            cat_id: sorted(upstream_by_wb.get(wb_id, set()) - {cat_id})
+            for cat_id, wb_id in wb_ids.items()
+        }
+        return jsonify(result), 200
+
+    if not per_id:
+        upstream_ids = get_upstream_ids(cat_ids)
+        return jsonify(sorted(id for id in upstream_ids if id.startswith("wb"))), 200
+    upstream_by_id = get_upstream_ids_by_id(cat_ids)
+    result = {
+        cat_id: sorted(id for id in upstream_by_id.get(cat_id, set()) if id.startswith("wb"))
+        for cat_id in cat_ids
+    }
+    return jsonify(result), 200
+
+
+@main.route("/tiles/hydrofabric/<layer>/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"])
+def get_hydrofabric_vector_tile(layer: str, z: int, x: int, y: int):
+    # vector tiles of the divides or flowpaths, e.g. as a maplibre source
+    # {type: "vector", tiles: [origin + "/tiles/hydrofabric/divides/{z}/{x}/{y}.pbf"]}
+    try:
+        tile = get_hydrofabric_tile(layer, z, x, y)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    return Response(tile, mimetype=MVT_CONTENT_TYPE)
+
+
+@main.route(
+    "/tiles/forecast/<date>/<int:cycle>/<int:lead>/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"]
+)
+def get_forecast_vector_tile(date: str, cycle: int, lead: int, z: int, x: int, y: int):
+    # forecast precipitation cells, in the "forecasted_precip" layer, aggregated by zoom
+    try:
+        tile = get_forecast_tile(date, cycle, lead, z, x, y)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Failed to render forecast tile {date}/{cycle}/{lead}/{z}/{x}/{y}: {e}")
+        return jsonify({"error": str(e)}), 500
+    return Response(tile, mimetype=MVT_CONTENT_TYPE)
+
+
+@main.route(
+    "/tiles/forecast/<date>/<int:cycle>/<int:lead>/<int:z>/<int:x>/<int:y>.<any(png, webp):fmt>",
+    methods=["GET"],
+)
+def get_forecast_raster_image_tile(
+    date: str, cycle: int, lead: int, z: int, x: int, y: int, fmt: str
+):
+    # forecast precipitation colored with the precip_1h thresholds, e.g. as a maplibre
+    # source {type: "raster", tileSize: 256, tiles: [origin + "/tiles/forecast/.../{y}.webp"]}
+    try:
+        tile = get_forecast_raster_tile(date, cycle, lead, z, x, y, fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Failed to render forecast tile {date}/{cycle}/{lead}/{z}/{x}/{y}: {e}")
+        return jsonify({"error": str(e)}), 500
+    return Response(tile, mimetype=f"image/{fmt}")
+
+
 @main.route("/forcings", methods=["POST"])
 def get_forcings():
     # body: JSON.stringify({'forcing_dir': forcing_dir, 'start_time': start_time, 'end_time': end_time}),
@@ -77,6 +178,33 @@ def get_forcings():
 
     # get the selected data source
     data_source = data.get("source")
+    # only compute the timesteps missing from an existing forcings.nc
+    incremental = parse_bool_option(data.get("incremental", False))
+    # local cache of the gridded data, "netcdf" or "zarr"
+    cache_format = data.get("cache_format", "netcdf")
+    if cache_format not in GRIDDED_CACHE_FORMATS:
+        expected = ", ".join(GRIDDED_CACHE_FORMATS)
+        error = f"Invalid cache_format {cache_format}, expected one of {expected}"
+        return jsonify({"error": error}), 400
+    # read whole remote chunks and log how many bytes are fetched
+    align_to_chunks = parse_bool_option(data.get("align_to_chunks", False))
+    # keep the chunks read from s3 on disk for later requests
+    use_chunk_cache = parse_bool_option(data.get("chunk_cache", False))
+    # "multiprocessing" or "dask"
+    zonal_stats_engine = data.get("zonal_stats_engine", "multiprocessing")
+    if zonal_stats_engine not in ZONAL_STATS_ENGINES:
+        expected = ", ".join(ZONAL_STATS_ENGINES)
+        error = f"Invalid zonal_stats_engine {zonal_stats_engine}, expected one of {expected}"
+        return jsonify({"error": error}), 400
+    # bytes the zonal stats may plan for, by default most of the available memory
+    memory_budget = data.get("memory_budget")
+    if memory_budget is not None:
+        try:
+            memory_budget = float(memory_budget)
+            if not memory_budget > 0:
+                raise ValueError(memory_budget)
+        except (TypeError, ValueError):
+            return jsonify({"error": "memory_budget must be a positive number of bytes"}), 400
     # get the forcings
     start_time = datetime.strptime(start_time, "%Y-%m-%dT%H:%M")
     end_time = datetime.strptime(end_time, "%Y-%m-%dT%H:%M")
@@ -88,13 +216,24 @@ def get_forcings():
     logger.debug(f"forcing_dir: {output_folder}")
     try:
         if data_source == "aorc":
-            data = load_aorc_zarr(start_time.year, end_time.year)
+            data = load_aorc_zarr(
+                start_time=start_time, end_time=end_time, use_chunk_cache=use_chunk_cache
+            )
         elif data_source == "nwm":
-            data = load_v3_retrospective_zarr()
+            data = load_v3_retrospective_zarr(use_chunk_cache=use_chunk_cache)
         gdf = gpd.read_file(paths.geopackage_path, layer="divides")
-        cached_data = save_and_clip_dataset(data, gdf, start_time, end_time, paths.cached_nc_file)
+        cache_location = paths.cached_gridded_data(cache_format)
+        cached_data = save_and_clip_dataset(
+            data, gdf, start_time, end_time, cache_location, align_to_chunks=align_to_chunks
+        )
 
-        create_forcings(cached_data, paths.output_dir.stem)  # type: ignore
+        create_forcings(
+            cached_data,  # type: ignore
+            paths.output_dir.stem,
+            memory_budget=memory_budget,
+            incremental=incremental,
+            engine=zonal_stats_engine,
+        )
     except Exception as e:
         logger.info(f"get_forcings() failed with error: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -103,6 +242,28 @@ def get_forcings():
     return "success", 200
 
 
+@main.route("/cluster", methods=["GET", "POST"])
+def cluster_info():
+    """
+    Get the dashboard and metrics links of the dask cluster. POST with any of
+    n_workers, threads_per_worker and memory_limit to resize it.
+    """
+    if request.method == "POST":
+        data = json.loads(request.data.decode("utf-8"))
+        try:
+            cluster_manager.configure(
+                n_workers=data.get("n_workers"),
+                threads_per_worker=data.get("threads_per_worker"),
+                memory_limit=data.get("memory_limit", "auto"),
+            )
+        except RuntimeError as e:
+            # the cluster is busy, restarting it would fail the running job
+            return jsonify({"error": str(e)}), 409
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    return jsonify(cluster_manager.links()), 200
+
+
 @main.route("/get_catids_from_vpu", methods=["POST"])
 def get_catids_from_vpu():
     raise NotImplementedError
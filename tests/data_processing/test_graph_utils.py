@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append("./modules/")
+import importlib
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+from unittest import mock
+
+import igraph as ig
+import numpy as np
+
+from data_processing.graph_utils import (
+    UpstreamIndex,
+    build_network_arrays,
+    load_graph_cache,
+    save_graph_cache,
+)
+
+
+def test_import_graph_utils() -> None:
+    # the map app imports graph_utils at startup, module level code must not fail
+    graph_utils = importlib.import_module("data_processing.graph_utils")
+    assert graph_utils.get_upstream_index is not None
+    assert graph_utils._upstream_index is None or isinstance(
+        graph_utils._upstream_index, graph_utils.UpstreamIndex
+    )
+
+
+def make_network(
+    num_vertices: int = 400, num_diversions: int = 40, seed: int = 42
+) -> Tuple[UpstreamIndex, ig.Graph]:
+    """
+    Random network that drains to vertex 0. Every vertex flows to one vertex with a
+    lower index, and some also flow to a second one, so upstream areas overlap.
+    """
+    rng = np.random.default_rng(seed)
+    sources = list(range(1, num_vertices))
+    targets = [int(rng.integers(0, i)) for i in sources]
+    for i in rng.choice(np.arange(2, num_vertices), num_diversions, replace=False).tolist():
+        target = int(rng.integers(0, i))
+        if target != targets[i - 1]:
+            sources.append(i)
+            targets.append(target)
+    names = np.array([f"wb-{i}" for i in range(num_vertices)], dtype=object)
+    cats = np.array([f"cat-{i}" if i % 7 else None for i in range(num_vertices)], dtype=object)
+    index = UpstreamIndex(
+        names, cats, np.array(sources, dtype=np.int32), np.array(targets, dtype=np.int32)
+    )
+    graph = ig.Graph(n=num_vertices, edges=list(zip(sources, targets)), directed=True)
+    return index, graph
+
+
+def igraph_upstream(
+    graph: ig.Graph, sources: List[int], stop: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Reference breadth first search with igraph, the sources are always searched past."""
+    visited = set(sources)
+    frontier = list(sources)
+    while frontier:
+        next_frontier = []
+        for vertex in frontier:
+            for neighbour in graph.neighbors(vertex, mode="in"):
+                if neighbour in visited:
+                    continue
+                visited.add(neighbour)
+                if stop is None or not stop[neighbour]:
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return np.array(sorted(visited))
+
+
+def test_upstream_matches_igraph() -> None:
+    index, graph = make_network()
+    for sources in ([0], [5], [17, 230], [3, 3, 9]):
+        upstream_sets = [set(graph.subcomponent(source, mode="in")) for source in sources]
+        expected = np.array(sorted(set().union(*upstream_sets)))
+        assert np.array_equal(index.upstream(sources), expected)
+        assert np.array_equal(index.upstream(sources), igraph_upstream(graph, list(set(sources))))
+
+
+def test_upstream_with_stop_mask() -> None:
+    index, graph = make_network()
+    stop = np.zeros(len(index.names), dtype=bool)
+    stop[[1, 2, 4, 8, 50]] = True
+    for sources in ([0], [1], [4, 9]):
+        result = index.upstream(sources, stop=stop)
+        assert np.array_equal(result, igraph_upstream(graph, sources, stop))
+    # the stopped vertices are reached from the outlet, but not searched past
+    result = index.upstream([0], stop=stop)
+    assert stop[result].any()
+    assert len(result) < len(index.upstream([0]))
+
+
+def test_upstream_memo() -> None:
+    index, graph = make_network()
+    index.MEMO_MIN_SIZE = 10
+    first = index.upstream([1])
+    assert 1 in index._memo
+    # searches that reach a memoized vertex reuse its closure
+    assert np.array_equal(index.upstream([1]), first)
+    assert np.array_equal(index.upstream([0]), np.array(sorted(graph.subcomponent(0, mode="in"))))
+
+
+def test_upstream_memo_with_stop_mask() -> None:
+    index, graph = make_network()
+    index.MEMO_MIN_SIZE = 10
+    # warm the memo with the outlet and its largest tributaries
+    for source in [0, 1, 2, 3]:
+        index.upstream([source])
+    assert index._memo
+    stop = np.zeros(len(index.names), dtype=bool)
+    stop[[1, 2, 4, 8, 50]] = True
+    for sources in ([0], [3], [4, 9]):
+        result = index.upstream(sources, stop=stop)
+        assert np.array_equal(result, igraph_upstream(graph, sources, stop))
+    closures = index.upstream_by_source([0, 1, 2, 6])
+    for source, closure in closures.items():
+        assert np.array_equal(closure, np.array(sorted(graph.subcomponent(source, mode="in"))))
+
+
+def test_upstream_by_source_nested_and_overlapping() -> None:
+    index, graph = make_network()
+    # nested: 2 and 6 are upstream of 0, overlapping: diversions share upstream areas
+    sources = [0, 1, 2, 6, 15, 40, 41, 42, 120, 121, 399]
+    closures = index.upstream_by_source(sources)
+    assert sorted(closures) == sorted(set(sources))
+    for source in sources:
+        expected = np.array(sorted(graph.subcomponent(source, mode="in")))
+        assert np.array_equal(closures[source], expected), source
+        assert np.array_equal(closures[source], igraph_upstream(graph, [source]))
+
+
+def test_upstream_by_source_chain() -> None:
+    # every source upstream of the next one, the deepest nesting there is
+    names = np.array([f"wb-{i}" for i in range(6)], dtype=object)
+    cats = np.array([f"cat-{i}" for i in range(6)], dtype=object)
+    sources = np.array([5, 4, 3, 2, 1], dtype=np.int32)
+    targets = np.array([4, 3, 2, 1, 0], dtype=np.int32)
+    index = UpstreamIndex(names, cats, sources, targets)
+    closures = index.upstream_by_source([0, 2, 4])
+    assert closures[0].tolist() == [0, 1, 2, 3, 4, 5]
+    assert closures[2].tolist() == [2, 3, 4, 5]
+    assert closures[4].tolist() == [4, 5]
+
+
+def test_build_network_arrays() -> None:
+    rows = [
+        ("wb-1", "nex-1", "cat-1"),
+        # duplicate rows, e.g. one per flowpath attribute, are one edge
+        ("wb-1", "nex-1", "cat-1"),
+        ("nex-1", "wb-2", None),
+        # the terminal waterbody has no toid, it is a vertex but not an edge
+        ("wb-2", None, "cat-2"),
+        ("wb-3", "nex-1", "cat-3"),
+        ("wb-3", "nex-1", "cat-3b"),
+        # a toid that isn't an id in the table is still a vertex
+        ("wb-4", "nex-9", "cat-4"),
+        (None, "nex-1", "cat-5"),
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hydrofabric = Path(temp_dir) / "network.gpkg"
+        con = sqlite3.connect(hydrofabric)
+        con.execute("CREATE TABLE network (id TEXT, toid TEXT, divide_id TEXT)")
+        con.executemany("INSERT INTO network VALUES (?, ?, ?)", rows)
+        con.commit()
+        con.close()
+        names, cats, sources, targets = build_network_arrays(hydrofabric)
+
+    assert sorted(names.tolist()) == ["nex-1", "nex-9", "wb-1", "wb-2", "wb-3", "wb-4"]
+    edges = sorted(zip(names[sources].tolist(), names[targets].tolist()))
+    assert edges == [
+        ("nex-1", "wb-2"),
+        ("wb-1", "nex-1"),
+        ("wb-3", "nex-1"),
+        ("wb-4", "nex-9"),
+    ]
+    cat_of = dict(zip(names.tolist(), cats.tolist()))
+    # NULL divide ids are None rather than NaN, and the last divide_id of an id is kept
+    assert cat_of == {
+        "wb-1": "cat-1",
+        "nex-1": None,
+        "wb-2": "cat-2",
+        "wb-3": "cat-3b",
+        "wb-4": "cat-4",
+        "nex-9": None,
+    }
+    assert sources.dtype == np.int32 and targets.dtype == np.int32
+
+
+def test_save_graph_cache_lost_race() -> None:
+    index, _ = make_network()
+    rename = os.rename
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hydrofabric = Path(temp_dir) / "network.gpkg"
+        hydrofabric.write_bytes(b"network")
+        cache_dir = Path(temp_dir) / "graph"
+        other_writer = Path(temp_dir) / "other"
+        save_graph_cache(index, other_writer, hydrofabric)
+
+        def lose_race(source, target):
+            # the other writer swaps its cache in between our rmtree and rename
+            rename(other_writer, target)
+            raise OSError(39, "Directory not empty")
+
+        with mock.patch("os.rename", side_effect=lose_race):
+            save_graph_cache(index, cache_dir, hydrofabric)
+        assert sorted(path.name for path in Path(temp_dir).iterdir()) == ["graph", "network.gpkg"]
+        assert load_graph_cache(cache_dir, hydrofabric) is not None
+
+        # without a valid cache in place the error is raised
+        hydrofabric.write_bytes(b"a different network")
+        with mock.patch("os.rename", side_effect=OSError(39, "Directory not empty")):
+            try:
+                save_graph_cache(index, cache_dir, hydrofabric)
+            except OSError:
+                pass
+            else:
+                raise AssertionError("expected an OSError")
+        assert not list(Path(temp_dir).glob("*.tmp"))
+
+
+if __name__ == "__main__":
+    test_import_graph_utils()
+    test_upstream_matches_igraph()
+    test_upstream_with_stop_mask()
+    test_upstream_memo()
+    test_upstream_memo_with_stop_mask()
+    test_upstream_by_source_nested_and_overlapping()
+    test_upstream_by_source_chain()
+    test_build_network_arrays()
+    test_save_graph_cache_lost_race()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append("./modules/")
+from typing import List, Tuple
+
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon
+
+from data_processing.vector_tiles import (
+    CLOSE_PATH,
+    MOVE_TO,
+    MVT_LINESTRING,
+    MVT_POINT,
+    MVT_POLYGON,
+    MVT_UNKNOWN,
+    encode_geometry,
+    encode_layer,
+    encode_tile,
+    encode_varint,
+    zigzag,
+)
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_rings(commands: List[int]) -> List[List[Tuple[int, int]]]:
+    """Decode MVT geometry commands into one list of points per MoveTo."""
+    parts: List[List[Tuple[int, int]]] = []
+    x = y = 0
+    i = 0
+    while i < len(commands):
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command == CLOSE_PATH:
+            continue
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            if command == MOVE_TO:
+                parts.append([])
+            parts[-1].append((x, y))
+    return parts
+
+
+def signed_area(ring: List[Tuple[int, int]]) -> int:
+    # surveyor's formula in tile coordinates, positive is clockwise on screen (y down)
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def test_zigzag() -> None:
+    values = [0, -1, 1, -2, 2, 2**31 - 1, -(2**31)]
+    expected = [0, 1, 2, 3, 4, 2**32 - 2, 2**32 - 1]
+    assert [zigzag(value) for value in values] == expected
+    assert [unzigzag(zigzag(value)) for value in values] == values
+
+
+def test_encode_varint() -> None:
+    assert encode_varint(0) == b"\x00"
+    assert encode_varint(1) == b"\x01"
+    assert encode_varint(127) == b"\x7f"
+    assert encode_varint(300) == b"\xac\x02"
+
+
+def test_encode_line_spec_example() -> None:
+    # the linestring example from the vector tile specification
+    geometry_type, commands = encode_geometry(LineString([(2, 2), (2, 10), (10, 10)]))
+    assert geometry_type == MVT_LINESTRING
+    assert commands == [9, 4, 4, 18, 0, 16, 16, 0]
+
+
+def test_encode_points() -> None:
+    geometry_type, commands = encode_geometry(Point(25, 17))
+    assert geometry_type == MVT_POINT
+    assert commands == [9, 50, 34]
+
+
+def test_ring_orientation() -> None:
+    exterior = [(0, 0), (100, 0), (100, 100), (0, 100)]
+    hole = [(25, 25), (25, 75), (75, 75), (75, 25)]
+    # the encoded orientation doesn't depend on the orientation of the input
+    for shell in (exterior, exterior[::-1]):
+        for interior in (hole, hole[::-1]):
+            geometry_type, commands = encode_geometry(Polygon(shell, [interior]))
+            assert geometry_type == MVT_POLYGON
+            outer, inner = decode_rings(commands)
+            assert signed_area(outer) > 0
+            assert signed_area(inner) < 0
+            assert commands.count(CLOSE_PATH | 1 << 3) == 2
+
+
+def test_multipolygon_rings() -> None:
+    square = Polygon([(0, 0), (0, 10), (10, 10), (10, 0)])
+    other = Polygon([(20, 20), (30, 20), (30, 30), (20, 30)])
+    geometry_type, commands = encode_geometry(MultiPolygon([square, other]))
+    assert geometry_type == MVT_POLYGON
+    rings = decode_rings(commands)
+    assert len(rings) == 2
+    assert all(signed_area(ring) > 0 for ring in rings)
+    # the closing point is implied by ClosePath, not repeated
+    assert all(len(ring) == 4 for ring in rings)
+
+
+def test_empty_geometries() -> None:
+    assert encode_geometry(Polygon()) == (MVT_UNKNOWN, [])
+    assert encode_geometry(LineString()) == (MVT_UNKNOWN, [])
+    # collapses to a single point on the tile grid
+    assert encode_geometry(Polygon([(0, 0), (0.1, 0), (0.1, 0.1)])) == (MVT_UNKNOWN, [])
+    assert encode_geometry(LineString([(5, 5), (5.2, 5.1)])) == (MVT_UNKNOWN, [])
+    features = [(None, {"id": 1}), (Polygon(), {"id": 2}), (LineString([(1, 1), (1.1, 1)]), {})]
+    assert encode_layer("empty", features) == b""
+    assert encode_tile({"empty": features}) == b""
+
+
+def test_encode_layer_properties() -> None:
+    features = [
+        (Point(1, 1), {"id": "wb-1", "order": 3, "area": float("nan"), "toid": None}),
+        (Point(2, 2), {"id": "wb-2", "order": 3}),
+    ]
+    layer = encode_layer("flowpaths", features)
+    assert b"flowpaths" in layer and b"wb-1" in layer and b"wb-2" in layer
+    # NaN and None properties are left out, so their keys are never written
+    assert b"area" not in layer and b"toid" not in layer
+    # keys are only written once per layer
+    assert layer.count(b"order") == 1
+    tile = encode_tile({"flowpaths": features, "divides": []})
+    assert tile.endswith(layer) and b"divides" not in tile
+
+
+if __name__ == "__main__":
+    test_zigzag()
+    test_encode_varint()
+    test_encode_line_spec_example()
+    test_encode_points()
+    test_ring_orientation()
+    test_multipolygon_rings()
+    test_empty_geometries()
+    test_encode_layer_properties()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append("./modules/")
+import numpy as np
+import pyproj
+
+from data_processing.vector_tiles import WEB_MERCATOR_EXTENT
+from forecasting_data.forecast_tiles import (
+    KG_M2_S_TO_IN_HR,
+    MISSING_DATA_COLOR,
+    PRECIP_1H_COLORS,
+    PRECIP_1H_THRESHOLDS,
+    RASTER_TILE_SIZE,
+    colorize_precip,
+    get_pixel_index,
+)
+
+WEB_MERCATOR_WKT = pyproj.CRS("EPSG:3857").to_wkt()
+# a grid with one cell per pixel of the zoom 0 tile
+PIXEL_SIZE = 2 * WEB_MERCATOR_EXTENT / RASTER_TILE_SIZE
+FIRST_X = -WEB_MERCATOR_EXTENT + PIXEL_SIZE / 2
+TOP_Y = WEB_MERCATOR_EXTENT - PIXEL_SIZE / 2
+
+
+def test_colorize_precip_thresholds() -> None:
+    # just above each threshold, so the conversion back to inches can't round below it
+    values = PRECIP_1H_THRESHOLDS * 1.001 / KG_M2_S_TO_IN_HR
+    rgba = colorize_precip(values)
+    assert np.array_equal(rgba[:, :3], PRECIP_1H_COLORS)
+    assert np.all(rgba[:, 3] == 255)
+    # just below a threshold is still the color of the one before it
+    below = colorize_precip(PRECIP_1H_THRESHOLDS[1:] * 0.999 / KG_M2_S_TO_IN_HR)
+    assert np.array_equal(below[:, :3], PRECIP_1H_COLORS[:-1])
+    # far above the highest threshold keeps the last color
+    assert np.array_equal(colorize_precip(np.array([1.0]))[0], [*PRECIP_1H_COLORS[-1], 255])
+
+
+def test_colorize_precip_alpha() -> None:
+    lowest = PRECIP_1H_THRESHOLDS[0] / KG_M2_S_TO_IN_HR
+    rgba = colorize_precip(np.array([lowest * 0.25, lowest * 0.5, lowest * 0.999]))
+    # below the lowest threshold the first color fades out
+    assert np.all(rgba[:, :3] == PRECIP_1H_COLORS[0])
+    assert rgba[:, 3].tolist() == [64, 128, 255]
+
+
+def test_colorize_precip_dry_and_missing() -> None:
+    rgba = colorize_precip(np.array([0.0, 1e-9, np.nan, -1e-3]))
+    # no rain is transparent, missing and negative values are gray
+    assert rgba[0].tolist() == [0, 0, 0, 0]
+    assert rgba[1].tolist() == [0, 0, 0, 0]
+    assert rgba[2].tolist() == [*MISSING_DATA_COLOR, 255]
+    assert rgba[3].tolist() == [*MISSING_DATA_COLOR, 255]
+    # the trailing axis is added to any shape
+    assert colorize_precip(np.zeros((3, 5))).shape == (3, 5, 4)
+
+
+def test_get_pixel_index_aligned_grid() -> None:
+    # y decreasing, the grid rows run from the top of the tile like the pixels
+    x_grid = (FIRST_X, PIXEL_SIZE, RASTER_TILE_SIZE)
+    y_grid = (TOP_Y, -PIXEL_SIZE, RASTER_TILE_SIZE)
+    index = get_pixel_index(0, 0, 0, WEB_MERCATOR_WKT, x_grid, y_grid)
+    assert np.array_equal(index, np.arange(RASTER_TILE_SIZE**2))
+    # the index only depends on the tile and the grid layout, so it's reused
+    assert get_pixel_index(0, 0, 0, WEB_MERCATOR_WKT, x_grid, y_grid) is index
+
+
+def test_get_pixel_index_flipped_and_partial_grid() -> None:
+    half = RASTER_TILE_SIZE // 2
+    bottom_y = -WEB_MERCATOR_EXTENT + PIXEL_SIZE / 2
+    # y increasing, and only the left half of the tile is covered
+    x_grid = (FIRST_X, PIXEL_SIZE, half)
+    y_grid = (bottom_y, PIXEL_SIZE, RASTER_TILE_SIZE)
+    index = get_pixel_index(0, 0, 0, WEB_MERCATOR_WKT, x_grid, y_grid).reshape(
+        RASTER_TILE_SIZE, RASTER_TILE_SIZE
+    )
+    assert np.all(index[:, half:] == -1)
+    rows, cols = np.divmod(index[:, :half], half)
+    assert np.array_equal(cols, np.tile(np.arange(half), (RASTER_TILE_SIZE, 1)))
+    expected_rows = np.arange(RASTER_TILE_SIZE)[::-1, None]
+    assert np.array_equal(rows, np.broadcast_to(expected_rows, rows.shape))
+
+
+def test_get_pixel_index_outside_grid() -> None:
+    # a tile in the other hemisphere from a small grid around the origin
+    x_grid = (-50_000.0, 1000.0, 100)
+    y_grid = (50_000.0, -1000.0, 100)
+    index = get_pixel_index(5, 0, 0, WEB_MERCATOR_WKT, x_grid, y_grid)
+    assert len(index) == RASTER_TILE_SIZE**2
+    assert np.all(index == -1)
+
+
+if __name__ == "__main__":
+    test_colorize_precip_thresholds()
+    test_colorize_precip_alpha()
+    test_colorize_precip_dry_and_missing()
+    test_get_pixel_index_aligned_grid()
+    test_get_pixel_index_flipped_and_partial_grid()
+    test_get_pixel_index_outside_grid()